@@ -0,0 +1,355 @@
+#!/usr/bin/python
+
+"""
+Benchmarks for the render and input hot paths of invective.
+
+Each benchmark drives the real widgets and chat integration code against a
+L{TerminalBuffer} and reports operations per second, the number of bytes the
+operations would have sent to a VT102 terminal, and the peak memory use of the
+process which ran it.  Every benchmark is run in a separate child process so
+that its peak memory is not inflated by the ones run before it.
+
+Run with PYTHONPATH set to the source checkout:
+
+    $ PYTHONPATH=. python benchmarks/bench.py
+    $ PYTHONPATH=. python benchmarks/bench.py --json > results.json
+    $ PYTHONPATH=. python benchmarks/bench.py render-10k paste
+"""
+
+import os, sys, time, resource
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+from twisted.python import usage
+from twisted.internet.task import Clock
+from twisted.conch.insults.helper import TerminalBuffer
+from twisted.words.im.basesupport import AbstractAccount, AbstractGroup
+
+from invective.widgets import OutputWidget, LineInputWidget
+from invective.scrollback import Scrollback
+from invective.history import History
+from invective.completion import PrefixIndex
+from invective.tui import UserInterface
+
+
+class CountingTerminal(TerminalBuffer):
+    """
+    A L{TerminalBuffer} which counts the bytes a real terminal would have been
+    sent for the calls made on it.
+    """
+    def connectionMade(self):
+        TerminalBuffer.connectionMade(self)
+        self.bytesWritten = 0
+
+
+    def write(self, bytes):
+        self.bytesWritten += len(bytes)
+        TerminalBuffer.write(self, bytes)
+
+
+    def cursorPosition(self, column, line):
+        self.bytesWritten += len('\x1b[%d;%dH' % (line + 1, column + 1))
+        TerminalBuffer.cursorPosition(self, column, line)
+
+
+    def selectGraphicRendition(self, *attributes):
+        self.bytesWritten += len('\x1b[%sm' % (';'.join(attributes),))
+        TerminalBuffer.selectGraphicRendition(self, *attributes)
+
+
+    def setScrollRegion(self, first=None, last=None):
+        self.bytesWritten += len('\x1b[%s;%sr' % (first or '', last or ''))
+
+
+    def index(self):
+        self.bytesWritten += len('\x1bD')
+        TerminalBuffer.index(self)
+
+
+
+def newTerminal(width=80, height=24):
+    terminal = CountingTerminal()
+    terminal.width = width
+    terminal.height = height
+    terminal.makeConnection(None)
+    return terminal
+
+
+def message(i):
+    return 'nick%d: message number %d with enough text in it to wrap at least ' \
+           'some of the time when the terminal is narrow %s' % (i % 50, i, 'x' * (i % 40))
+
+
+
+def renderBenchmark(count):
+    """
+    Fill an L{OutputWidget} with C{count} messages, then alternate between
+    rendering it at two widths so every operation is a full re-wrap of the
+    visible messages.
+    """
+    def setUp():
+        widget = OutputWidget(scrollback=Scrollback(count))
+        for i in xrange(count):
+            widget.addMessage(message(i))
+        return widget, newTerminal()
+    def run(state, i):
+        widget, terminal = state
+        widget.render(80 - i % 2, 24, terminal)
+        return terminal.bytesWritten
+    return setUp, run
+
+
+def appendBenchmark(count):
+    """
+    Fill an L{OutputWidget} with C{count} messages, then repeatedly add a
+    message and render it, as happens for each line received in a channel.
+    """
+    def setUp():
+        widget = OutputWidget(scrollback=Scrollback(count))
+        for i in xrange(count):
+            widget.addMessage(message(i))
+        terminal = newTerminal()
+        widget.render(80, 24, terminal)
+        return widget, terminal
+    def run(state, i):
+        widget, terminal = state
+        widget.addMessage(message(i))
+        widget.render(80, 24, terminal)
+        return terminal.bytesWritten
+    return setUp, run
+
+
+def pasteBenchmark(length):
+    """
+    Deliver each character of a C{length} character paste to a
+    L{LineInputWidget} as a separate keystroke, rendering after each.
+    """
+    def setUp():
+        widget = LineInputWidget(length + 1, lambda line: None)
+        widget.focused = True
+        return widget, newTerminal(length + 2, 1)
+    def run(state, i):
+        widget, terminal = state
+        if len(widget.buffer) >= length:
+            widget.setText('')
+        widget.keystrokeReceived(chr(ord('a') + i % 26), None)
+        widget.draw(length + 2, 1, terminal)
+        return terminal.bytesWritten
+    return setUp, run
+
+
+def historyBenchmark(count):
+    """
+    Traverse a L{History} of C{count} lines from the end to the beginning and
+    back again, one line per operation.
+    """
+    def setUp():
+        return History(['/join #channel%d' % (i,) for i in xrange(count)])
+    def run(history, i):
+        if (i // count) % 2:
+            history.nextLine()
+        else:
+            history.previousLine()
+        return 0
+    return setUp, run
+
+
+def completeBenchmark(count):
+    """
+    Complete a nick in a L{LineInputWidget} whose completer searches a
+    L{PrefixIndex} of C{count} nicks, typing the last character of the nick
+    and then tab in each operation.
+    """
+    def setUp():
+        nicks = PrefixIndex(['nick%d' % (i,) for i in xrange(count)])
+        widget = LineInputWidget(80, lambda line: None)
+        widget.completer = lambda word, start: nicks.complete(word)
+        return widget
+    def run(widget, i):
+        line = 'hi nick%d' % (i % count,)
+        widget.buffer = line[:-1]
+        widget.cursor = len(line) - 1
+        widget.keystrokeReceived(line[-1], None)
+        widget.keystrokeReceived('\t', None)
+        return 0
+    return setUp, run
+
+
+def ingestBenchmark(perTurn):
+    """
+    Deliver messages to the focused channel of a complete L{UserInterface}
+    through L{InvectiveGroupConversation.showGroupMessage}, letting the
+    reactor run after every C{perTurn} messages.
+    """
+    def setUp():
+        clock = Clock()
+        terminal = newTerminal()
+        protocol = UserInterface()
+        protocol.reactor = clock
+        protocol.makeConnection(terminal)
+        account = AbstractAccount('bench', False, 'user', '', 'host', 6667)
+        conversation = protocol.ui.getGroupConversation(
+            AbstractGroup('bench', account))
+        protocol.ui.focus(conversation)
+        clock.advance(1)
+        return clock, terminal, conversation
+    def run(state, i):
+        clock, terminal, conversation = state
+        conversation.showGroupMessage('nick%d' % (i % 50,), message(i))
+        if i % perTurn == perTurn - 1:
+            clock.advance(1)
+        return terminal.bytesWritten
+    return setUp, run
+
+
+def netsplitBenchmark(members):
+    """
+    Deliver the departure of each of C{members} members of the focused
+    channel of a complete L{UserInterface}, as a netsplit does, letting the
+    reactor run only after all of them.
+    """
+    def setUp():
+        clock = Clock()
+        terminal = newTerminal()
+        protocol = UserInterface()
+        protocol.reactor = clock
+        protocol.makeConnection(terminal)
+        account = AbstractAccount('bench', False, 'user', '', 'host', 6667)
+        conversation = protocol.ui.getGroupConversation(
+            AbstractGroup('bench', account))
+        protocol.ui.focus(conversation)
+        clock.advance(1)
+        return clock, terminal, conversation
+    def run(state, i):
+        clock, terminal, conversation = state
+        conversation.memberLeft('nick%d' % (i,))
+        if i % members == members - 1:
+            clock.advance(1)
+        return terminal.bytesWritten
+    return setUp, run
+
+
+
+benchmarks = [
+    ('render-10k', renderBenchmark(10000), 200),
+    ('render-100k', renderBenchmark(100000), 200),
+    ('append-10k', appendBenchmark(10000), 2000),
+    ('append-100k', appendBenchmark(100000), 2000),
+    ('paste', pasteBenchmark(1000), 5000),
+    ('history-100k', historyBenchmark(100000), 200000),
+    ('history-1m', historyBenchmark(1000000), 200000),
+    ('complete-10k', completeBenchmark(10000), 20000),
+    ('ingest', ingestBenchmark(1), 2000),
+    ('ingest-burst', ingestBenchmark(500), 20000),
+    ('netsplit', netsplitBenchmark(5000), 50000),
+    ]
+
+
+def bytesWritten(state):
+    """
+    Find the number of bytes the L{CountingTerminal} in the state a benchmark
+    set up has been sent so far, or 0 if it has none.
+    """
+    if isinstance(state, tuple):
+        for part in state:
+            if isinstance(part, CountingTerminal):
+                return part.bytesWritten
+    return 0
+
+
+def measure(name, (setUp, run), iterations):
+    """
+    Run one benchmark in this process.  Bytes sent to the terminal while the
+    benchmark is set up are not counted.
+
+    @return: A C{dict} describing the results.
+    """
+    state = setUp()
+    before = written = bytesWritten(state)
+    start = time.time()
+    for i in xrange(iterations):
+        written = run(state, i)
+    elapsed = time.time() - start
+    return {
+        'name': name,
+        'iterations': iterations,
+        'seconds': elapsed,
+        'opsPerSecond': iterations / elapsed,
+        'bytesPerOp': float(written - before) / iterations,
+        # Kilobytes on Linux, bytes on OS X.
+        'peakRSS': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        }
+
+
+def measureInChild(name, benchmark, iterations):
+    """
+    Run one benchmark in a child process and return its results.
+    """
+    r, w = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(r)
+        try:
+            os.write(w, json.dumps(measure(name, benchmark, iterations)))
+        finally:
+            os._exit(0)
+    os.close(w)
+    chunks = []
+    while True:
+        chunk = os.read(r, 4096)
+        if not chunk:
+            break
+        chunks.append(chunk)
+    os.close(r)
+    os.waitpid(pid, 0)
+    return json.loads(''.join(chunks))
+
+
+
+class Options(usage.Options):
+    synopsis = "bench.py [options] [benchmark ...]"
+    optFlags = [
+        ['json', 'j', 'Write the results as JSON instead of a table.'],
+        ]
+    optParameters = [
+        ['scale', 's', 1.0,
+         'Multiply the number of iterations of each benchmark by this.', float],
+        ]
+
+    def parseArgs(self, *names):
+        known = [benchmark[0] for benchmark in benchmarks]
+        for name in names:
+            if name not in known:
+                raise usage.UsageError(
+                    "Unknown benchmark %r (choose from %s)" % (name, ', '.join(known)))
+        self['names'] = names or known
+
+
+
+def main(argv=None):
+    options = Options()
+    try:
+        options.parseOptions(argv)
+    except usage.UsageError, e:
+        raise SystemExit("%s\n%s" % (e, options))
+
+    results = []
+    for name, benchmark, iterations in benchmarks:
+        if name in options['names']:
+            iterations = max(1, int(iterations * options['scale']))
+            results.append(measureInChild(name, benchmark, iterations))
+
+    if options['json']:
+        json.dump(results, sys.stdout, indent=2)
+        sys.stdout.write('\n')
+    else:
+        print '%-14s %12s %12s %12s' % ('benchmark', 'ops/sec', 'bytes/op', 'peak RSS')
+        for result in results:
+            print '%(name)-14s %(opsPerSecond)12.1f %(bytesPerOp)12.1f %(peakRSS)12d' % result
+
+
+if __name__ == '__main__':
+    main()
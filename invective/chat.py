@@ -8,45 +8,156 @@ up to an invective output area and allows the invective input controller to
 change the state of an IM account object.
 """
 
+from itertools import groupby
+from operator import itemgetter
+
+from twisted.internet import reactor as globalReactor
 from twisted.words.im.basechat import ChatUI, GroupConversation
 
+from invective.scrollback import Scrollback
+from invective.completion import PrefixIndex
+from invective.message import (
+    Message, MESSAGE, JOINED, LEFT, NICK, TOPIC, MEMBERS, MASS_JOINED,
+    MASS_LEFT)
+
 
 class InvectiveGroupConversation(GroupConversation):
     """
     A one-to-many conversation which displays events in an invective output
     area.
+
+    @ivar messages: The L{Scrollback} holding this conversation's
+    L{Message}s.  While this conversation is focused, the output area
+    displays it and messages are added through the output area.  Otherwise
+    they are only appended to it, and nothing is formatted, wrapped or drawn.
+
+    Events are not added to C{messages} as they happen, but collected in
+    C{_events} and added together by L{flush} once the reactor has finished
+    delivering those it has received at once.  Then each unbroken run of
+    more than C{maxMembershipLines} members joining, or of more than that
+    many leaving, as happens in a netsplit, is shown as one L{MASS_JOINED}
+    or L{MASS_LEFT} message.  Everything stays in the order it happened, so
+    the last line about a member always shows whether it is still there.
+
+    @type nicks: L{PrefixIndex}
+    @ivar nicks: The nicks of the members of the group, for completion.  It
+    is updated as events happen.
+
+    @ivar _events: Tuples of the kind and content of the events which have
+    happened since L{flush} was last called, oldest first.  The kind is
+    L{JOINED} or L{LEFT} for a member joining or leaving, and the content is
+    the member's nick, or the kind is C{None} and the content is a
+    L{Message}.
     """
+    maxMembershipLines = 3
+
     def __init__(self, group, account):
         GroupConversation.__init__(self, group, account)
         self.output = account.output
+        self.messages = account.createScrollback(
+            '%s.%s' % (group.account.accountName, group.name))
+        self.nicks = PrefixIndex()
+        self._events = []
 
 
     def show(self):
         pass
 
 
+    def _message(self, sender, kind, text=None):
+        """
+        Create a L{Message} for something which happened in this
+        conversation's group now.
+        """
+        return Message(
+            self.chatui.reactor.seconds(), self.group.account.accountName,
+            self.group.name, sender, kind, text)
+
+
+    def _addEvent(self, kind, content):
+        if not self._events:
+            self.chatui.flushLater(self)
+        self._events.append((kind, content))
+
+
+    def addMessage(self, message):
+        """
+        Add a message to this conversation, with the other events which
+        happen before the reactor next runs, displaying them if this is the
+        focused conversation.
+        """
+        self._addEvent(None, message)
+
+
+    def _summarize(self, run, messages):
+        """
+        Add lines for a run of members joining and leaving to C{messages},
+        in order.
+        """
+        for kind, events in groupby(run, itemgetter(0)):
+            members = map(itemgetter(1), events)
+            if len(members) <= self.maxMembershipLines:
+                for member in members:
+                    messages.append(self._message(member, kind))
+            else:
+                messages.append(self._message(
+                        None, {JOINED: MASS_JOINED, LEFT: MASS_LEFT}[kind],
+                        ' '.join(members)))
+
+
+    def flush(self):
+        """
+        Add the messages for the events which have happened since this was
+        last called to C{messages}, all at once, through the output area if
+        this is the focused conversation.
+        """
+        events = self._events
+        self._events = []
+        messages = []
+        run = []
+        for kind, content in events:
+            if kind is None:
+                if run:
+                    self._summarize(run, messages)
+                    run = []
+                messages.append(content)
+            else:
+                run.append((kind, content))
+        if run:
+            self._summarize(run, messages)
+        if self.chatui.focusedConversation is self:
+            self.output.addMessages(messages)
+        else:
+            self.messages.extend(messages)
+
+
     def showGroupMessage(self, sender, text, metadata=None):
-        self.output.addMessage('%s/%s> %s' % (self.group.name, sender, text))
+        self.addMessage(self._message(sender, MESSAGE, text))
 
 
     def memberJoined(self, member):
-        self.output.addMessage('%s/%s joined' % (self.group.name, member))
+        self.nicks.add(member)
+        self._addEvent(JOINED, member)
 
 
     def memberChangedNick(self, oldnick, newnick):
-        self.output.addMessage("%s/%s is now %s/%s" % (self.group.name, oldnick, self.group.name, newnick))
+        self.nicks.remove(oldnick)
+        self.nicks.add(newnick)
+        self.addMessage(self._message(oldnick, NICK, newnick))
 
 
     def memberLeft(self, member):
-        self.output.addMessage("%s/%s left" % (self.group.name, member))
+        self.nicks.remove(member)
+        self._addEvent(LEFT, member)
 
 
     def setTopic(self, topic, author):
-        self.output.addMessage("%s/%s changed the topic to %s" % (self.group.name, author, topic))
+        self.addMessage(self._message(author, TOPIC, topic))
 
 
     def setGroupMembers(self, members):
-        self.output.addMessage("%s memebers: %s" % (self.group.name, ' '.join(members)))
+        self.nicks = PrefixIndex(members)
+        self.addMessage(self._message(None, MEMBERS, ' '.join(members)))
 
 
 class InvectiveChatUI(ChatUI):
@@ -56,10 +167,82 @@ class InvectiveChatUI(ChatUI):
     This primarily serves to connect the conversation classes,
     L{InvectiveConversation} and L{InvectiveGroupConversation} up to the event
     sources in L{twisted.words.im}.
+
+    @ivar focusedConversation: C{None} or the conversation whose messages
+    the output area displays.
+
+    @ivar statusMessages: The scrollback the output area displays when no
+    conversation is focused.
+
+    @ivar createScrollback: A one-argument callable which is called with the
+    name of each new conversation, the name of its account and of its group
+    separated by a dot, and returns the scrollback to hold its messages.
+
+    @ivar reactor: The reactor which runs L{flush} after events are
+    delivered.
+
+    @ivar _pending: The conversations with events which have not been
+    flushed.
+
+    @ivar _call: C{None}, or the L{IDelayedCall} which will call L{flush}.
+
+    @type channels: L{PrefixIndex}
+    @ivar channels: The names, with a leading C{#}, of the groups which have
+    had a conversation, for completion.
     """
-    def __init__(self, output):
+    focusedConversation = None
+    _call = None
+
+    def __init__(self, output, createScrollback=None, reactor=None):
         ChatUI.__init__(self)
+        if reactor is None:
+            reactor = globalReactor
+        self.reactor = reactor
+        self._pending = []
         self.output = output
+        self.statusMessages = output.messages
+        if createScrollback is None:
+            createScrollback = lambda name: Scrollback()
+        self.createScrollback = createScrollback
+        self.channels = PrefixIndex()
+
+
+    def flushLater(self, conversation):
+        """
+        Arrange for a conversation's events to be flushed once the reactor
+        has delivered all of those it has received at once.
+        """
+        self._pending.append(conversation)
+        if self._call is None:
+            self._call = self.reactor.callLater(0, self.flush)
+
+
+    def flush(self):
+        """
+        Add the messages for the events in every conversation which has had
+        any since this was last called.
+        """
+        if self._call is not None:
+            if self._call.active():
+                self._call.cancel()
+            self._call = None
+        pending = self._pending
+        self._pending = []
+        for conversation in pending:
+            conversation.flush()
+
+
+    def focus(self, conversation):
+        """
+        Make the output area display the messages of the given conversation,
+        or the status messages if C{conversation} is C{None}.
+        """
+        self.flush()
+        self.focusedConversation = conversation
+        if conversation is None:
+            self.output.setScrollback(self.statusMessages)
+        else:
+            self.output.setScrollback(conversation.messages)
 
 
     def getGroupConversation(self, group, Class=InvectiveGroupConversation, stayHidden=False):
@@ -68,4 +251,5 @@ class InvectiveChatUI(ChatUI):
 
         @rtype: L{InvectiveGroupConversation}
         """
+        self.channels.add('#' + group.name)
         return ChatUI.getGroupConversation(self, group, Class, stayHidden)
@@ -0,0 +1,99 @@
+# -*- test-case-name: invective.test.test_completion -*-
+
+"""
+Indexes of words, such as nicks, channel names and commands, which can be
+found by the beginning of their name for tab completion.
+"""
+
+from bisect import bisect_left
+from os.path import commonprefix
+
+
+class PrefixIndex(object):
+    """
+    A set of words which can be searched for those beginning with a prefix,
+    ignoring case.
+
+    The words are kept sorted by their lower-case form, so the words beginning
+    with a prefix are next to each other and the first of them is found by
+    binary search.  Adding or removing a word finds its position the same
+    way, so the index can be kept up to date as words come and go without
+    being rebuilt.
+
+    @ivar _keys: The lower-case form of each word, in ascending order.
+
+    @ivar _words: The words, in the same order as C{_keys}.
+    """
+    def __init__(self, words=()):
+        byKey = dict([(word.lower(), word) for word in words])
+        self._keys = sorted(byKey)
+        self._words = [byKey[key] for key in self._keys]
+
+
+    def __len__(self):
+        return len(self._words)
+
+
+    def __iter__(self):
+        return iter(self._words)
+
+
+    def __contains__(self, word):
+        key = word.lower()
+        keys = self._keys
+        i = bisect_left(keys, key)
+        return i < len(keys) and keys[i] == key
+
+
+    def add(self, word):
+        """
+        Add a word to the index, replacing any word which differs from it only
+        in case.
+        """
+        key = word.lower()
+        keys = self._keys
+        i = bisect_left(keys, key)
+        if i < len(keys) and keys[i] == key:
+            self._words[i] = word
+        else:
+            keys.insert(i, key)
+            self._words.insert(i, word)
+
+
+    def remove(self, word):
+        """
+        Remove a word, or one differing from it only in case, from the index
+        if it is present.
+        """
+        key = word.lower()
+        keys = self._keys
+        i = bisect_left(keys, key)
+        if i < len(keys) and keys[i] == key:
+            del keys[i]
+            del self._words[i]
+
+
+    def complete(self, prefix):
+        """
+        Find the words beginning with C{prefix}, ignoring case.
+
+        @rtype: C{list} of C{str}
+        @return: The matching words, in order.
+        """
+        prefix = prefix.lower()
+        keys = self._keys
+        start = stop = bisect_left(keys, prefix)
+        while stop < len(keys) and keys[stop].startswith(prefix):
+            stop += 1
+        return self._words[start:stop]
+
+
+
+def commonPrefix(words):
+    """
+    Find the longest prefix shared by a non-empty sequence of words, ignoring
+    case.
+
+    @return: The prefix, as it is spelled in the first of C{words}.
+    """
+    return words[0][:len(commonprefix([word.lower() for word in words]))]
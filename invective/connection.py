@@ -0,0 +1,470 @@
+# -*- test-case-name: invective.test.test_connection -*-
+
+"""
+Connections to any number of chat servers at once.
+"""
+
+from random import random
+from collections import deque
+
+from twisted.internet import reactor
+from twisted.internet.protocol import ClientCreator
+from twisted.internet.defer import Deferred, succeed
+from twisted.words.protocols.irc import (
+    IRCClient, ServerSupportedFeatures, split)
+from twisted.words.im.ircsupport import IRCAccount, IRCGroup, IRCProto
+
+from invective.flood import OutgoingQueue
+
+
+CONNECTING = 'connecting'
+CONNECTED = 'connected'
+DISCONNECTED = 'disconnected'
+
+# Commands sent ahead of any others waiting to be sent: those needed to
+# register and stay connected.
+PRIORITY_COMMANDS = frozenset(['PASS', 'NICK', 'USER', 'PING', 'PONG'])
+
+# Commands carrying text which may be split into several lines.
+MESSAGE_COMMANDS = frozenset(['PRIVMSG', 'NOTICE'])
+
+
+class InvectiveIRCProto(IRCProto):
+    """
+    The IRC client protocol used by L{InvectiveIRCAccount}.
+
+    Lines are sent through the account's L{OutgoingQueue} rather than
+    written immediately, so that they are sent no faster than the server
+    allows, with the commands in L{PRIORITY_COMMANDS} ahead of the others.
+    Messages too long to be relayed by the server are split into several.
+
+    Servers refuse to let a client join channels or send messages until it
+    has registered.  So until the server has welcomed the client, only
+    those commands are sent, and the others, including any left from a
+    previous connection, wait.  Then the account's channels are joined and
+    the messages it kept while reconnecting are sent.
+
+    @ivar _registering: C{True} until the server has welcomed the client and
+    the account's channels have been joined.  Those channels are joined
+    ahead of the lines which are waiting, some of which may be messages to
+    them.  Once it is C{False}, JOIN is ordered with everything else, so
+    that it does not overtake a PART of the same channel.
+    """
+    _registering = True
+
+    def __init__(self, account, chatui, logonDeferred=None):
+        IRCProto.__init__(self, account, chatui, logonDeferred)
+        # AbstractClientMixin takes the first base class which is a protocol
+        # as the one to delegate to, which is IRCProto for a subclass.
+        self._protoBase = IRCClient
+
+
+    def connectionMade(self):
+        # IRCProto does not call IRCClient.connectionMade, which sets this up,
+        # and messages cannot be sent to channels without it.
+        self.supported = ServerSupportedFeatures()
+        IRCProto.connectionMade(self)
+        self.account.queue.start(self._reallySendLine, priorityOnly=True)
+
+
+    def connectionLost(self, reason):
+        self.account.queue.stop()
+        IRCProto.connectionLost(self, reason)
+
+
+    def _createHeartbeat(self):
+        heartbeat = IRCProto._createHeartbeat(self)
+        heartbeat.clock = self.account.reactor
+        return heartbeat
+
+
+    def joinGroup(self, name):
+        """
+        Join a channel, unless the server has not welcomed this client yet,
+        in which case it is joined with the rest of the account's channels
+        by L{signedOn}.
+        """
+        if not self._registering:
+            IRCProto.joinGroup(self, name)
+
+
+    def signedOn(self):
+        for name in self.account.channels:
+            IRCProto.joinGroup(self, name)
+        self._registering = False
+        self.account.queue.start(self._reallySendLine)
+        self.account._sendPending()
+
+
+    def _splitMessage(self, line):
+        """
+        Split a PRIVMSG or NOTICE line into lines short enough to be relayed
+        to other clients without being truncated, keeping the command and
+        target, and any CTCP tag, on each.
+        """
+        fmt, separator, text = line.partition(' :')
+        fmt += separator
+        length = self._safeMaximumLineLength(fmt) - len(fmt) - 2
+        if len(text) <= length:
+            return [line]
+        tag = end = ''
+        if text[:1] == '\x01' and text[-1:] == '\x01':
+            tag, space, text = text[1:-1].partition(' ')
+            tag = '\x01' + tag + space
+            end = '\x01'
+        return [fmt + tag + chunk + end
+                for chunk in split(text, length - len(tag) - len(end))]
+
+
+    def msg(self, user, message, length=None):
+        """
+        Send a message, split only at line breaks unless C{length} is given,
+        leaving it to L{sendLine} to split lines which are too long.  Unlike
+        the inherited implementation, this keeps a long CTCP message intact.
+        """
+        if length is not None:
+            return IRCProto.msg(self, user, message, length)
+        for line in message.split('\n'):
+            self.sendLine('PRIVMSG %s :%s' % (user, line))
+
+
+    def sendLine(self, line):
+        command = line.split(' ', 1)[0].upper()
+        if command in MESSAGE_COMMANDS:
+            for part in self._splitMessage(line):
+                self.account.queue.put(part)
+        else:
+            self.account.queue.put(
+                line, command in PRIORITY_COMMANDS or (
+                    command == 'JOIN' and self._registering))
+
+
+
+class InvectiveIRCGroup(IRCGroup):
+    """
+    An IRC channel to which messages sent while its account is disconnected
+    are kept by the account until it reconnects.
+    """
+    def sendGroupMessage(self, text, meta={}):
+        if self.account.client is None and self.account.reconnecting():
+            self.account.pending.append((self, text, meta))
+            return succeed(text)
+        return IRCGroup.sendGroupMessage(self, text, meta)
+
+
+
+class InvectiveIRCAccount(IRCAccount):
+    """
+    An IRC account which connects using a reactor given to it, keeps track of
+    the state of its connection, and reconnects if the connection is lost.
+
+    After the connection is lost, each attempt to reconnect waits longer than
+    the one before, by C{factor}, up to C{maxDelay} seconds.  Each wait is
+    varied randomly by up to C{jitter} of its length, so that many clients
+    disconnected at once by the same network problem do not all reconnect at
+    the same moment.  The waits start again from C{initialDelay} only once a
+    connection has lasted C{stableTime} seconds, so a server which drops
+    connections as soon as they are made is not tried over and over.
+
+    The channels joined with L{joinGroup} are joined again on reconnecting,
+    and messages sent to them while waiting to reconnect are kept in
+    C{pending} and sent then, once the server has welcomed the client.
+
+    @ivar reactor: The reactor used to connect to the server.
+
+    @ivar protocol: The IRC client protocol class to connect with.
+
+    @ivar status: One of L{CONNECTING}, L{CONNECTED} or L{DISCONNECTED}.
+
+    @ivar statusChanged: C{None}, or a one-argument callable which is called
+    with this account whenever C{status} changes.
+
+    @ivar continueTrying: C{True} if this account will reconnect when its
+    connection is lost.  It becomes C{True} when the account first logs on,
+    and C{False} when L{stopReconnecting} is called.
+
+    @ivar retries: The number of attempts to reconnect made since the last
+    stable connection.
+
+    @ivar reconnectCall: C{None}, or the L{IDelayedCall} which will next try
+    to reconnect.
+
+    @type pending: C{deque}
+    @ivar pending: Tuples of the group, text and metadata of messages sent
+    while waiting to reconnect, oldest first.  Only the newest C{maxPending}
+    are kept.
+
+    @type queue: L{OutgoingQueue}
+    @ivar queue: The lines waiting to be sent to the server, sent at no more
+    than C{floodRate} lines per second after a burst of C{floodBurst}.  It is
+    kept across reconnections, so that what was not sent on one connection
+    is sent on the next.
+
+    @ivar random: A no-argument callable returning a random C{float} between
+    0 and 1, used to vary the waits.
+
+    @ivar _connectedAt: The time at which the current connection was made.
+    """
+    _groupFactory = InvectiveIRCGroup
+
+    reactor = reactor
+    protocol = InvectiveIRCProto
+    random = staticmethod(random)
+    status = DISCONNECTED
+    statusChanged = None
+
+    initialDelay = 2.0
+    factor = 2.0
+    maxDelay = 300.0
+    jitter = 0.25
+    stableTime = 60.0
+    maxPending = 100
+    floodRate = 0.5
+    floodBurst = 5
+
+    continueTrying = False
+    retries = 0
+    reconnectCall = None
+    queue = None
+    _chatui = None
+    _connectedAt = None
+
+    def __init__(self, *args, **kwargs):
+        IRCAccount.__init__(self, *args, **kwargs)
+        self.pending = deque((), self.maxPending)
+
+
+    def reconnecting(self):
+        """
+        Determine whether this account is waiting for or trying to make a new
+        connection to replace one which was lost.
+        """
+        return self.continueTrying and self.client is None
+
+
+    def joinGroup(self, name):
+        """
+        Join a channel now, if connected, and whenever this account
+        reconnects.
+        """
+        if name not in self.channels:
+            self.channels.append(name)
+        if self.client is not None:
+            self.client.joinGroup(name)
+
+
+    def leaveGroup(self, name):
+        """
+        Leave a channel now, if connected, and stop joining it when this
+        account reconnects.
+        """
+        if name in self.channels:
+            self.channels.remove(name)
+        if self.client is not None:
+            self.client.leave(name)
+
+
+    def stopReconnecting(self):
+        """
+        Make no more attempts to reconnect, cancelling one which is waiting.
+        """
+        self.continueTrying = False
+        if self.reconnectCall is not None:
+            self.reconnectCall.cancel()
+            self.reconnectCall = None
+
+
+    def _nextDelay(self):
+        """
+        Compute how long to wait before the next attempt to reconnect.
+        """
+        delay = min(self.maxDelay, self.initialDelay * self.factor ** self.retries)
+        delay *= 1 + self.jitter * (2 * self.random() - 1)
+        self.retries += 1
+        return delay
+
+
+    def _scheduleReconnect(self):
+        self.reconnectCall = self.reactor.callLater(
+            self._nextDelay(), self._reconnect)
+
+
+    def _reconnect(self):
+        self.reconnectCall = None
+        self.logOn(self._chatui).addErrback(lambda reason: None)
+
+
+    def _setStatus(self, status):
+        self.status = status
+        if self.statusChanged is not None:
+            self.statusChanged(self)
+
+
+    def _startLogOn(self, chatui):
+        self._chatui = chatui
+        if self.queue is None:
+            self.queue = OutgoingQueue(
+                self.reactor, self.floodRate, self.floodBurst)
+        self._setStatus(CONNECTING)
+        logonDeferred = Deferred()
+        creator = ClientCreator(
+            self.reactor, self.protocol, self, chatui, logonDeferred)
+        d = creator.connectTCP(self.host, self.port)
+        d.addErrback(logonDeferred.errback)
+        return logonDeferred
+
+
+    def _cb_logOn(self, client):
+        client = IRCAccount._cb_logOn(self, client)
+        self.continueTrying = True
+        self._connectedAt = self.reactor.seconds()
+        self._setStatus(CONNECTED)
+        return client
+
+
+    def _sendPending(self):
+        """
+        Send the messages kept while waiting to reconnect.
+        """
+        pending = list(self.pending)
+        self.pending.clear()
+        for group, text, meta in pending:
+            group.sendGroupMessage(text, meta)
+
+
+    def _loginFailed(self, reason):
+        reason = IRCAccount._loginFailed(self, reason)
+        if self.continueTrying:
+            self._scheduleReconnect()
+        self._setStatus(DISCONNECTED)
+        return reason
+
+
+    def _clientLost(self, client, reason):
+        reason = IRCAccount._clientLost(self, client, reason)
+        if self.continueTrying:
+            if self.reactor.seconds() - self._connectedAt >= self.stableTime:
+                self.retries = 0
+            self._scheduleReconnect()
+        self._setStatus(DISCONNECTED)
+        return reason
+
+
+
+class ConnectionManager(object):
+    """
+    The accounts of a chat client, each connected to a different server, or
+    the same server as a different user, in one reactor.
+
+    Messages received on each connection go directly to the conversations of
+    that connection's account, so having more connections adds nothing to
+    the work done for each message.
+
+    @ivar chatui: The L{InvectiveChatUI} the accounts log on to.
+
+    @ivar reactor: The reactor the accounts connect with.
+
+    @ivar statusChanged: C{None}, or a one-argument callable which is called
+    with an account whenever its status changes.
+
+    @ivar _accounts: A C{dict} mapping the name of each account to the
+    L{InvectiveIRCAccount}.
+
+    @ivar _names: The names of the accounts in the order they were added.
+
+    @ivar _summary: C{None}, or the result of L{summary} if no account has
+    been added, removed or changed status since it was computed.
+    """
+    statusChanged = None
+    _summary = None
+
+    def __init__(self, chatui, reactor):
+        self.chatui = chatui
+        self.reactor = reactor
+        self._accounts = {}
+        self._names = []
+
+
+    def __len__(self):
+        return len(self._names)
+
+
+    def __iter__(self):
+        """
+        Iterate over the accounts in the order they were added.
+        """
+        for name in self._names:
+            yield self._accounts[name]
+
+
+    def get(self, name):
+        """
+        Find the account with the given name.
+
+        @return: The L{InvectiveIRCAccount}, or C{None} if there is none.
+        """
+        return self._accounts.get(name)
+
+
+    def _accountStatusChanged(self, account):
+        self._summary = None
+        if self.statusChanged is not None:
+            self.statusChanged(account)
+
+
+    def connect(self, host, username, port=6667):
+        """
+        Add an account for a server and log on to it.  The account is named
+        after the host, with a number added if there is already an account
+        for that host.
+
+        @return: A L{Deferred} which fires with the account when it has
+        logged on, or fails if it cannot connect, in which case the account
+        is forgotten.
+        """
+        name = host
+        count = 1
+        while name in self._accounts:
+            count += 1
+            name = '%s:%d' % (host, count)
+        account = InvectiveIRCAccount(name, True, username, "", host, port, "")
+        account.reactor = self.reactor
+        account.statusChanged = self._accountStatusChanged
+        self._accounts[name] = account
+        self._names.append(name)
+        d = account.logOn(self.chatui)
+        def ebLogOn(reason):
+            self.remove(name)
+            return reason
+        d.addCallbacks(lambda client: account, ebLogOn)
+        return d
+
+
+    def remove(self, name):
+        """
+        Disconnect the account with the given name, if it is connected, and
+        forget it.
+        """
+        account = self._accounts.pop(name)
+        self._names.remove(name)
+        self._summary = None
+        account.statusChanged = None
+        account.stopReconnecting()
+        if account.client is not None:
+            account.client.transport.loseConnection()
+
+
+    def summary(self):
+        """
+        Describe the accounts for display, naming each one and the state of
+        its connection if it is not connected.
+        """
+        if self._summary is None:
+            parts = []
+            for account in self:
+                if account.status == CONNECTED:
+                    parts.append(account.accountName)
+                else:
+                    parts.append('%s(%s)' % (account.accountName, account.status))
+            self._summary = ' '.join(parts)
+        return self._summary
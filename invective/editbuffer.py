@@ -0,0 +1,123 @@
+# -*- test-case-name: invective.test.test_editbuffer -*-
+
+"""
+Storage for text which is being edited a character at a time.
+"""
+
+class EditBuffer(object):
+    """
+    A string which can be efficiently modified near a moving edit point.
+
+    The characters are kept in two lists: those before a gap, in order, and
+    those after the gap, in reverse order.  Inserting or deleting at the gap
+    only appends to or pops from the end of one of the lists.  Editing
+    somewhere else first moves the gap there, which costs time proportional to
+    the distance moved, so a sequence of edits around a cursor is constant
+    time per edit.
+
+    @ivar _before: The characters before the gap.
+
+    @ivar _after: The characters after the gap, in reverse order.
+
+    @ivar _text: C{None} or the contents as a single string, kept until the
+    next modification.
+
+    @type version: C{int}
+    @ivar version: A number which is incremented by every modification, so
+    that whether the contents have changed can be determined without
+    comparing them.
+
+    @ivar changedFrom: C{None}, or the lowest position at which the contents
+    have been modified since the last call to L{resetChanges}.  Characters
+    before this position are the same as they were then.
+    """
+    version = 0
+    changedFrom = None
+
+    def __init__(self, text=''):
+        self._before = list(text)
+        self._after = []
+        self._text = text
+
+
+    def __len__(self):
+        return len(self._before) + len(self._after)
+
+
+    def __str__(self):
+        if self._text is None:
+            self._text = ''.join(self._before) + ''.join(reversed(self._after))
+        return self._text
+
+
+    def _changed(self, position):
+        """
+        Record a modification at C{position}.
+        """
+        self._text = None
+        self.version += 1
+        if self.changedFrom is None or position < self.changedFrom:
+            self.changedFrom = position
+
+
+    def resetChanges(self):
+        """
+        Forget the modifications made so far, so that C{changedFrom} reflects
+        only those made after this call.
+        """
+        self.changedFrom = None
+
+
+    def _moveGap(self, position):
+        """
+        Move the gap so that it follows the first C{position} characters.
+        """
+        before = self._before
+        if position < len(before):
+            moved = before[position:]
+            moved.reverse()
+            self._after.extend(moved)
+            del before[position:]
+        elif position > len(before):
+            after = self._after
+            count = min(position - len(before), len(after))
+            moved = after[len(after) - count:]
+            moved.reverse()
+            before.extend(moved)
+            del after[len(after) - count:]
+
+
+    def insert(self, position, text):
+        """
+        Insert C{text} before the character at C{position}.
+        """
+        self._moveGap(position)
+        if text:
+            self._changed(len(self._before))
+            self._before.extend(text)
+
+
+    def delete(self, position, count=1):
+        """
+        Remove up to C{count} characters starting at C{position}.
+
+        @return: The removed characters, as a string.
+        """
+        self._moveGap(position)
+        after = self._after
+        count = min(count, len(after))
+        if not count:
+            return ''
+        removed = after[len(after) - count:]
+        del after[len(after) - count:]
+        removed.reverse()
+        self._changed(position)
+        return ''.join(removed)
+
+
+    def replace(self, position, count, text):
+        """
+        Replace C{count} characters starting at C{position} with C{text}.
+        """
+        self.delete(position, count)
+        self.insert(position, text)
@@ -0,0 +1,149 @@
+# -*- test-case-name: invective.test.test_flood -*-
+
+"""
+Limits on the rate at which lines are sent to a server, so that it does not
+disconnect the client for flooding.
+"""
+
+from collections import deque
+
+
+class TokenBucket(object):
+    """
+    A rate limiter which allows a burst of up to C{capacity} operations at
+    once, and C{rate} operations per second after that.
+
+    Tokens are added at C{rate} per second, up to C{capacity}, and each
+    operation takes one.  Tokens are only counted up when they are asked for,
+    so an idle bucket costs nothing.
+
+    @ivar clock: An L{IReactorTime} provider.
+
+    @ivar tokens: The number of tokens in the bucket at C{_updated}.
+
+    @ivar _updated: The time at which C{tokens} was last counted up.
+    """
+    def __init__(self, clock, rate, capacity):
+        self.clock = clock
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self._updated = clock.seconds()
+
+
+    def _refill(self):
+        now = self.clock.seconds()
+        self.tokens = min(
+            self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+
+    def consume(self):
+        """
+        Take a token, if there is one.
+
+        @return: C{True} if a token was taken, C{False} if the operation must
+        wait.
+        """
+        self._refill()
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+
+    def wait(self):
+        """
+        Compute the number of seconds until a token will be available.
+        """
+        self._refill()
+        return max(0, (1 - self.tokens) / self.rate)
+
+
+
+class OutgoingQueue(object):
+    """
+    Lines waiting to be sent to a server, sent as quickly as a L{TokenBucket}
+    allows.
+
+    There are two lanes.  Lines in the priority lane are always sent before
+    those in the other, and the lines in each lane are sent in the order they
+    were added.
+
+    @ivar send: C{None}, or a one-argument callable which sends a line.  While
+    it is C{None}, lines are kept until L{start} is called.
+
+    @ivar priorityOnly: If C{True}, only lines in the priority lane are sent,
+    and the others are kept until L{start} is called without it.
+
+    @ivar _lanes: The priority lane and the other lane, each a C{deque} of
+    lines, oldest first.
+
+    @ivar _call: C{None}, or the L{IDelayedCall} which will send more lines
+    once the bucket has a token for them.
+    """
+    send = None
+    priorityOnly = False
+    _call = None
+
+    def __init__(self, clock, rate, burst):
+        self.clock = clock
+        self.bucket = TokenBucket(clock, rate, burst)
+        self._lanes = (deque(), deque())
+
+
+    def __len__(self):
+        return len(self._lanes[0]) + len(self._lanes[1])
+
+
+    def put(self, line, priority=False):
+        """
+        Add a line to be sent, in the priority lane if C{priority} is C{True}.
+        """
+        self._lanes[not priority].append(line)
+        if self._call is None:
+            self._flush()
+
+
+    def start(self, send, priorityOnly=False):
+        """
+        Begin sending lines with the given callable, only those in the
+        priority lane if C{priorityOnly} is C{True}.
+        """
+        self.send = send
+        self.priorityOnly = priorityOnly
+        self._flush()
+
+
+    def stop(self):
+        """
+        Stop sending lines, because the connection they were for is gone.
+        Lines in the priority lane only mean something to that connection,
+        and are discarded; the others are kept until L{start} is called
+        again.
+        """
+        self.send = None
+        self._lanes[0].clear()
+        if self._call is not None:
+            self._call.cancel()
+            self._call = None
+
+
+    def _flush(self):
+        """
+        Send as many lines as the bucket allows, and arrange to send the rest
+        later.
+        """
+        self._call = None
+        if self.send is None:
+            return
+        lanes = self._lanes
+        if self.priorityOnly:
+            lanes = lanes[:1]
+        for lane in lanes:
+            while lane:
+                if not self.bucket.consume():
+                    self._call = self.clock.callLater(
+                        self.bucket.wait(), self._flush)
+                    return
+                self.send(lane.popleft())
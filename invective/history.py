@@ -4,20 +4,371 @@
 Self-contained input history representation.
 """
 
+import os
+from fcntl import flock, LOCK_EX, LOCK_UN
+from mmap import mmap, ACCESS_READ
+from array import array
+from bisect import bisect_left
+from itertools import chain
+
+class TrigramIndex(object):
+    """
+    An index of a range of the lines of a L{History} by the three character
+    substrings they contain, for finding the lines which contain a string
+    without examining every line.
+
+    @type postings: C{dict}
+    @ivar postings: Each three character string found in any line, mapped to
+    an C{array} of the numbers of the lines containing it, in ascending
+    order.
+
+    @type first: C{int}
+    @ivar first: The number of the first line in the index.  Lines are
+    numbered from zero, oldest first.
+
+    @type count: C{int}
+    @ivar count: The number of lines which have been indexed.
+    """
+    def __init__(self, first=0):
+        self.postings = {}
+        self.first = first
+        self.count = 0
+
+
+    def add(self, line):
+        """
+        Index a line, giving it the next line number.
+        """
+        number = self.first + self.count
+        self.count += 1
+        postings = self.postings
+        for trigram in set([line[i:i + 3] for i in xrange(len(line) - 2)]):
+            numbers = postings.get(trigram)
+            if numbers is None:
+                numbers = postings[trigram] = array('I')
+            numbers.append(number)
+
+
+    def extend(self, later):
+        """
+        Add the lines of another index, which must begin with the line after
+        the last one in this index, to this one.  C{later} should not be used
+        afterwards.
+        """
+        postings = self.postings
+        for trigram, numbers in later.postings.iteritems():
+            mine = postings.get(trigram)
+            if mine is None:
+                postings[trigram] = numbers
+            else:
+                mine.extend(numbers)
+        self.count += later.count
+
+
+    def renumber(self, lines, before):
+        """
+        Number the lines in this index again, after some lines have been
+        removed.
+
+        @param lines: The lines by their old numbers, with C{None} for those
+            which have been removed.
+
+        @param before: A sequence giving, for each old number up to and
+            including the one after the last line in this index, the number
+            of lines before it which have not been removed.  This is the new
+            number of the line, if it has not been removed.
+        """
+        postings = {}
+        for trigram, numbers in self.postings.iteritems():
+            numbers = array('I', [
+                    before[number] for number in numbers
+                    if lines[number] is not None])
+            if numbers:
+                postings[trigram] = numbers
+        self.postings = postings
+        end = before[self.first + self.count]
+        self.first = before[self.first]
+        self.count = end - self.first
+
+
+    def candidates(self, query):
+        """
+        Find the lines which may contain C{query}.
+
+        @return: A sequence of line numbers, in ascending order, which
+        includes every line in the index containing C{query}.  It is the
+        shortest of the lists of lines containing each three character
+        substring of C{query}, or every line if C{query} is shorter than
+        that.
+        """
+        if len(query) < 3:
+            return xrange(self.first, self.first + self.count)
+        best = None
+        for i in xrange(len(query) - 2):
+            numbers = self.postings.get(query[i:i + 3])
+            if numbers is None:
+                return ()
+            if best is None or len(numbers) < len(best):
+                best = numbers
+        return best
+
+
+    def before(self, query, stop):
+        """
+        Generate the numbers of lines before C{stop} which may contain
+        C{query}, nearest first.
+        """
+        candidates = self.candidates(query)
+        for i in xrange(bisect_left(candidates, stop) - 1, -1, -1):
+            yield candidates[i]
+
+
+    def after(self, query, start):
+        """
+        Generate the numbers of lines from C{start} onwards which may contain
+        C{query}, nearest first.
+        """
+        candidates = self.candidates(query)
+        for i in xrange(bisect_left(candidates, start), len(candidates)):
+            yield candidates[i]
+
+
+
 class History(object):
     """
-    @type beforeLines: C{list} of C{str}
-    @ivar beforeLines: The lines in this history which come before the current position.
+    A list of input lines and a position within it.  Moving the position,
+    adding a line and resetting the position all take constant time, however
+    long the history is.
+
+    Optionally, repeated lines are stored only once and the number of lines
+    is limited, so that the memory used and the cost of moving through the
+    history depend on the number of different lines rather than on how many
+    have been added.  Lines which are removed by these options leave a
+    C{None} in their place, so that removing one from the middle is constant
+    time.  These are skipped over when moving the position, and discarded
+    all at once when they outnumber the remaining lines.
 
-    @type afterLines: C{list} of C{str}
-    @ivar afterLines: The lines in this history which come after the current position.
+    @type maxLines: C{int} or C{NoneType}
+    @ivar maxLines: The greatest number of lines which will be retained, or
+    C{None} for no limit.  The oldest lines are discarded to make room for
+    new ones.
+
+    @type ignoreRepeats: C{bool}
+    @ivar ignoreRepeats: If C{True}, a line which is the same as the newest
+    line is not added.
+
+    @type unique: C{bool}
+    @ivar unique: If C{True}, adding a line which is already in the history
+    removes the older copy of it, so that each line appears only once.
+
+    @type _lines: C{list} of C{str}
+    @ivar _lines: All of the lines in this history, oldest first, with
+    C{None} in place of lines which have been removed.
+
+    @type _live: C{int}
+    @ivar _live: The number of lines in C{_lines} which have not been
+    removed.
+
+    @ivar _oldest: The index in C{_lines} before which every line has been
+    removed.
+
+    @ivar _numbers: If C{unique} is set, a C{dict} mapping each line to its
+    index in C{_lines}.
+
+    @type _back: C{int}
+    @ivar _back: The number of lines between the current position and the
+    end.  The position is at the end, after every line, when this is C{0}.
+
+    @ivar _segments: C{None} until the lines are first searched or indexed.
+    Then, a C{list} of L{TrigramIndex}es covering consecutive ranges of
+    lines, oldest first.  Lines added after that are added to the last one.
+    Each segment made by L{indexMore} is merged with the segments after it
+    while they are no larger than it, so there are only logarithmically
+    many.
+
+    @ivar _unindexed: The number of lines, starting from the oldest, which
+    are in none of C{_segments}.  They are searched by examining each line,
+    until L{indexMore} indexes them.
     """
+    maxLines = None
+    ignoreRepeats = False
+    unique = False
+
+    _segments = None
+    _unindexed = 0
+    _oldest = 0
 
-    def __init__(self, lines=None):
+    def __init__(self, lines=None, maxLines=None, ignoreRepeats=False,
+                 unique=False):
         if lines is None:
             lines = []
-        self.beforeLines = lines
-        self.afterLines = []
+        self.maxLines = maxLines
+        self.ignoreRepeats = ignoreRepeats
+        self.unique = unique
+        self._back = 0
+        if maxLines is None and not ignoreRepeats and not unique:
+            self._lines = lines
+            self._live = len(lines)
+        else:
+            self._lines = []
+            self._live = 0
+            self._numbers = {}
+            for line in lines:
+                self.addLine(line)
+
+
+    def _slots(self):
+        """
+        Return a list of every line, with C{None} in place of removed lines.
+        """
+        return self._lines
+
+
+    def _getBeforeLines(self):
+        lines = self._slots()
+        return [
+            line for line in lines[:len(lines) - self._back]
+            if line is not None]
+
+    beforeLines = property(
+        _getBeforeLines,
+        doc="A copy of the lines which come before the current position.")
+
+
+    def _getAfterLines(self):
+        lines = self._slots()
+        return [
+            line for line in lines[len(lines) - self._back:]
+            if line is not None]
+
+    afterLines = property(
+        _getAfterLines,
+        doc="A copy of the lines which come after the current position.")
+
+
+    def _getPosition(self):
+        return self._back
+
+
+    def _setPosition(self, position):
+        self._back = position
+
+    position = property(
+        _getPosition, _setPosition,
+        doc="The number of lines between the current position and the end.")
+
+
+    def _line(self, back):
+        """
+        Return the line C{back} lines before the end, or C{None} if it has
+        been removed.
+
+        @raise IndexError: If there are fewer lines than C{back}.
+        """
+        if back <= len(self._lines):
+            return self._lines[-back]
+        raise IndexError(back)
+
+
+    def _append(self, line):
+        """
+        Store a new line after all of the others.
+        """
+        if self.unique:
+            self._numbers[line] = len(self._lines)
+        self._lines.append(line)
+        self._live += 1
+
+
+    def _remove(self, index):
+        """
+        Remove the line at C{index} in C{_lines}, leaving C{None} in its
+        place.
+        """
+        line = self._lines[index]
+        if self.unique and self._numbers.get(line) == index:
+            del self._numbers[line]
+        self._lines[index] = None
+        self._live -= 1
+        if index == self._oldest:
+            lines = self._lines
+            while self._oldest < len(lines) and lines[self._oldest] is None:
+                self._oldest += 1
+
+
+    def _compact(self):
+        """
+        Discard the places of removed lines, keeping the position at the same
+        line.  The search index refers to lines by their places, so the lines
+        in it are numbered again.
+        """
+        lines = self._lines
+        self._back = len([
+                line for line in lines[len(lines) - self._back:]
+                if line is not None])
+        self._lines = [line for line in lines if line is not None]
+        self._oldest = 0
+        if self.unique:
+            self._numbers = dict([
+                    (line, i) for (i, line) in enumerate(self._lines)])
+        if self._segments is not None:
+            before = array('I')
+            live = 0
+            for line in lines:
+                before.append(live)
+                if line is not None:
+                    live += 1
+            before.append(live)
+            for segment in self._segments:
+                segment.renumber(lines, before)
+            self._unindexed = before[self._unindexed]
+
+
+    def _count(self):
+        """
+        Return the number of lines.
+        """
+        return len(self._lines)
+
+
+    def _getSegments(self):
+        if self._segments is None:
+            count = self._count()
+            self._segments = [TrigramIndex(count)]
+            self._unindexed = count
+        return self._segments
+
+
+    def indexMore(self, count=4096):
+        """
+        Index up to C{count} of the newest lines which have not been indexed
+        yet, so that searching them is faster.  Lines are indexed as they are
+        added, but this must be called to index those the history began with.
+
+        @return: C{True} if there are more lines to index, C{False} if they
+        have all been indexed.
+        """
+        segments = self._getSegments()
+        stop = self._unindexed
+        start = max(0, stop - count)
+        total = segments[-1].first + segments[-1].count
+        if start < stop:
+            segment = TrigramIndex(start)
+            for number in xrange(start, stop):
+                segment.add(self._line(total - number) or '')
+            while segments and segments[0].count <= segment.count:
+                segment.extend(segments.pop(0))
+            segments.insert(0, segment)
+            self._unindexed = start
+        return start > 0
+
+
+    def atEnd(self):
+        """
+        Return C{True} if the position is at the end of this history, after
+        every line, C{False} otherwise.
+        """
+        return self._back == 0
 
 
     def nextLine(self):
@@ -25,11 +376,14 @@ class History(object):
         Advance the position by one and return the line there, or an empty
         string if there is no next line.
         """
-        if self.afterLines:
-            self.beforeLines.append(self.afterLines.pop(0))
-            if self.afterLines:
-                return self.afterLines[0]
-            return ""
+        back = self._back
+        while back > 1:
+            back -= 1
+            line = self._line(back)
+            if line is not None:
+                self._back = back
+                return line
+        self._back = 0
         return ""
 
 
@@ -38,32 +392,294 @@ class History(object):
         Rewind the position by one and return the line there, or an empty
         string if there is no previous line.
         """
-        if self.beforeLines:
-            self.afterLines.insert(0, self.beforeLines.pop())
-            return self.afterLines[0]
-        return ""
+        back = self._back
+        while True:
+            back += 1
+            try:
+                line = self._line(back)
+            except IndexError:
+                return ""
+            if line is not None:
+                self._back = back
+                return line
 
 
     def allLines(self):
         """
         Return a list of all lines in this history object.
         """
-        return self.beforeLines + self.afterLines
+        return [line for line in self._lines if line is not None]
+
+
+    def _newest(self):
+        """
+        Return the newest line, or C{None} if there are no lines.
+        """
+        back = 1
+        while True:
+            try:
+                line = self._line(back)
+            except IndexError:
+                return None
+            if line is not None:
+                return line
+            back += 1
 
 
     def addLine(self, line):
         """
-        Add a new line to the end of this history object.
+        Add a new line to the end of this history object.  The position stays
+        at the same line, or at the end if it was at the end.
+        """
+        if self.ignoreRepeats and line == self._newest():
+            return
+        if type(line) is str:
+            line = intern(line)
+        if self.unique:
+            index = self._numbers.get(line)
+            if index is not None:
+                self._remove(index)
+        self._append(line)
+        if self._segments is not None:
+            self._segments[-1].add(line)
+        if self._back:
+            self._back += 1
+        if self.maxLines is not None:
+            while self._live > self.maxLines:
+                self._remove(self._oldest)
+        if len(self._lines) > 2 * self._live + 16:
+            self._compact()
+
+
+    def search(self, query, backward=True, again=False):
+        """
+        Move the position to the nearest line containing C{query}.
+
+        @param backward: If C{True}, look at the lines before the current
+            position, otherwise those after it.
+
+        @param again: If C{True}, do not consider the line at the current
+            position, so that the next match is found.
+
+        @return: The line found, or C{None} if there is no such line, in
+            which case the position is not changed.
         """
-        if self.afterLines:
-            self.afterLines.append(line)
+        segments = self._getSegments()
+        total = segments[-1].first + segments[-1].count
+        # The number of the line at the current position, or of the line
+        # which would be added next if the position is at the end.
+        current = total - self._back
+        if backward:
+            if again or not self._back:
+                stop = current
+            else:
+                stop = current + 1
+            numbers = [
+                segment.before(query, stop) for segment in reversed(segments)
+                if segment.first < stop]
+            numbers.append(xrange(min(stop, self._unindexed) - 1, -1, -1))
         else:
-            self.beforeLines.append(line)
+            if again:
+                start = current + 1
+            else:
+                start = current
+            numbers = [xrange(start, self._unindexed)]
+            numbers.extend([
+                segment.after(query, start) for segment in segments
+                if segment.first + segment.count > start])
+        for number in chain(*numbers):
+            line = self._line(total - number)
+            if line is not None and query in line:
+                self._back = total - number
+                return line
+        return None
 
 
     def resetPosition(self):
         """
         Set the position in the input history to the end.
         """
-        self.beforeLines.extend(self.afterLines)
-        self.afterLines = []
+        self._back = 0
+
+
+
+class FileHistory(History):
+    """
+    A L{History} which is saved in a file, so that it persists from one
+    session to the next.
+
+    Each line is appended to the file as it is added, with any newline or
+    backslash characters in it escaped.  The lines already in the file when it
+    is opened are read through a memory map of it, and found by searching
+    backwards from the end only as far as the position is moved back, so
+    opening a long history does not read all of it.
+
+    Several processes may use the same file at once.  Each appends its lines
+    while holding an exclusive lock on the file, and sees the lines added by
+    the others the next time it opens the file.
+
+    The lines in the file cannot be removed individually, so C{maxLines} and
+    C{unique} are not supported; the file is bounded by C{maxSize} instead.
+    C{ignoreRepeats} is supported.
+
+    @type maxSize: C{int} or C{NoneType}
+    @ivar maxSize: The number of bytes the file is compacted to, by discarding
+    its oldest lines, when it is opened larger than this, or when it grows to
+    twice this.  C{None} to let the file grow without limit.
+
+    @ivar _lines: The lines added since the file was opened.
+
+    @ivar _file: The file, opened for appending.
+
+    @ivar _map: C{None}, or an C{mmap} of the contents the file had when it
+    was opened.
+
+    @ivar _starts: An C{array} of the offsets in C{_map} of the lines found in
+    it so far, newest first.
+
+    @ivar _chunkSize: The number of bytes of C{_map} examined at once when
+    counting the lines in it.
+    """
+    _map = None
+    _chunkSize = 2 ** 16
+
+    def __init__(self, path, maxSize=None, ignoreRepeats=False):
+        History.__init__(self, ignoreRepeats=ignoreRepeats)
+        self.path = path
+        self.maxSize = maxSize
+        self._file = open(path, 'ab+')
+        self._starts = array('L')
+        size = os.fstat(self._file.fileno()).st_size
+        if maxSize is not None and size > maxSize:
+            self.compact()
+            size = os.fstat(self._file.fileno()).st_size
+        if size:
+            self._map = mmap(self._file.fileno(), size, access=ACCESS_READ)
+
+
+    def _lock(self):
+        """
+        Acquire the lock on the file, opening it again first if it has been
+        replaced by another process compacting it.
+        """
+        while True:
+            flock(self._file.fileno(), LOCK_EX)
+            try:
+                current = os.stat(self.path).st_ino
+            except OSError:
+                current = None
+            if current == os.fstat(self._file.fileno()).st_ino:
+                return
+            flock(self._file.fileno(), LOCK_UN)
+            self._file.close()
+            self._file = open(self.path, 'ab+')
+
+
+    def _unlock(self):
+        flock(self._file.fileno(), LOCK_UN)
+
+
+    def _line(self, back):
+        if back <= len(self._lines):
+            return self._lines[-back]
+        back -= len(self._lines)
+        starts = self._starts
+        while len(starts) < back:
+            # Each line ends just before the start of the next one, or at the
+            # end of the file.
+            if starts:
+                end = starts[-1]
+            elif self._map is not None:
+                end = len(self._map)
+            else:
+                end = 0
+            if end <= 0:
+                raise IndexError(back)
+            starts.append(self._map.rfind('\n', 0, end - 1) + 1)
+        start = starts[back - 1]
+        if back > 1:
+            end = starts[back - 2]
+        else:
+            end = len(self._map)
+        if self._map[end - 1] == '\n':
+            end -= 1
+        return self._map[start:end].decode('string_escape')
+
+
+    def _append(self, line):
+        History._append(self, line)
+        self._lock()
+        try:
+            self._file.write(line.encode('string_escape') + '\n')
+            self._file.flush()
+            size = os.fstat(self._file.fileno()).st_size
+        finally:
+            self._unlock()
+        if self.maxSize is not None and size > self.maxSize * 2:
+            self.compact()
+
+
+    def _count(self):
+        count = len(self._lines)
+        if self._map is not None:
+            size = len(self._map)
+            for offset in xrange(0, size, self._chunkSize):
+                count += self._map[offset:offset + self._chunkSize].count('\n')
+            if self._map[size - 1] != '\n':
+                count += 1
+        return count
+
+
+    def _slots(self):
+        return self.allLines()
+
+
+    def allLines(self):
+        lines = []
+        if self._map is not None:
+            lines = self._map[:].splitlines()
+        return [
+            line.decode('string_escape') for line in lines] + self._lines
+
+
+    def compact(self):
+        """
+        Discard the oldest lines in the file, so that it is no larger than
+        C{maxSize}.  The remaining lines are written to a new file which then
+        replaces the old one, so the history is not lost if this is
+        interrupted.  The lines available from this object are not changed.
+        """
+        self._lock()
+        try:
+            size = os.fstat(self._file.fileno()).st_size
+            if size <= self.maxSize:
+                return
+            contents = mmap(self._file.fileno(), size, access=ACCESS_READ)
+            try:
+                cut = contents.find('\n', size - self.maxSize - 1) + 1
+                temporary = self.path + '.compact'
+                compacted = open(temporary, 'wb')
+                try:
+                    if cut:
+                        compacted.write(contents[cut:])
+                    compacted.flush()
+                    os.fsync(compacted.fileno())
+                finally:
+                    compacted.close()
+                os.rename(temporary, self.path)
+            finally:
+                contents.close()
+        finally:
+            self._unlock()
+        self._file.close()
+        self._file = open(self.path, 'ab+')
+
+
+    def close(self):
+        """
+        Release the file.  No lines may be added or retrieved afterwards.
+        """
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        self._file.close()
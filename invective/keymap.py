@@ -0,0 +1,181 @@
+# -*- test-case-name: invective.test.test_keymap -*-
+
+"""
+Tables mapping keystrokes, and sequences of keystrokes, to the actions they
+invoke.
+"""
+
+from twisted.conch.insults.insults import ServerProtocol, FUNCTION_KEYS
+
+
+class Keymap(object):
+    """
+    A table of key bindings.
+
+    A key is either a C{(keyID, modifier)} tuple, which matches exactly that
+    keystroke, or a C{keyID} alone, which matches that key with any modifier.
+    Control characters are received with no modifier, so C-k is
+    C{('\\x0b', None)}.  Each key is bound either to an action, a callable
+    taking the widget which received the keystroke and the keystroke's
+    modifier, or to another L{Keymap} holding the bindings for the keys which
+    may follow it in a multi-key sequence.
+
+    @type bindings: C{dict}
+    @ivar bindings: The keys of this table mapped to actions or L{Keymap}s.
+
+    @type actions: C{dict}
+    @ivar actions: Actions which may be bound by name, such as the handlers
+    defined by a widget class.
+    """
+    def __init__(self, bindings=None, actions=None):
+        if bindings is None:
+            bindings = {}
+        if actions is None:
+            actions = {}
+        self.bindings = bindings
+        self.actions = actions
+
+
+    def copy(self):
+        """
+        Create a new L{Keymap} with the same bindings as this one.  Keymaps for
+        multi-key sequences are copied as well, so binding keys in the copy
+        never changes this keymap.
+        """
+        bindings = {}
+        for key, binding in self.bindings.iteritems():
+            if isinstance(binding, Keymap):
+                binding = binding.copy()
+            bindings[key] = binding
+        return Keymap(bindings, self.actions)
+
+
+    def lookup(self, keyID, modifier):
+        """
+        Find the binding for a keystroke.
+
+        @return: An action, a L{Keymap} for the rest of a multi-key sequence,
+        or C{None} if the keystroke is not bound.
+        """
+        binding = self.bindings.get((keyID, modifier))
+        if binding is None:
+            binding = self.bindings.get(keyID)
+        return binding
+
+
+    def bind(self, keys, action):
+        """
+        Bind a key, or a sequence of keys, to an action.
+
+        @param keys: A key, or a C{list} of keys which must be typed in order
+        to invoke C{action}.
+
+        @param action: A callable taking a widget and a modifier, or the name
+        of one of C{actions}.
+
+        @raise KeyError: If C{action} is a name not found in C{actions}.
+        """
+        if isinstance(action, str):
+            action = self.actions[action]
+        if not isinstance(keys, list):
+            keys = [keys]
+        keymap = self
+        for key in keys[:-1]:
+            prefix = keymap.bindings.get(key)
+            if not isinstance(prefix, Keymap):
+                prefix = keymap.bindings[key] = Keymap(actions=self.actions)
+            keymap = prefix
+        keymap.bindings[keys[-1]] = action
+
+
+    def unbind(self, keys):
+        """
+        Remove the binding for a key, or a sequence of keys, if there is one.
+        """
+        if not isinstance(keys, list):
+            keys = [keys]
+        keymap = self
+        for key in keys[:-1]:
+            keymap = keymap.bindings.get(key)
+            if not isinstance(keymap, Keymap):
+                return
+        keymap.bindings.pop(keys[-1], None)
+
+
+
+def methods(cls, prefix):
+    """
+    Find the methods of C{cls}, including inherited ones, whose names begin
+    with C{prefix}.
+
+    @return: A C{dict} mapping the remainder of each method's name to the
+    unbound method.
+    """
+    found = {}
+    for name in dir(cls):
+        if name.startswith(prefix):
+            found[name[len(prefix):]] = getattr(cls, name)
+    return found
+
+
+
+_functionKeys = dict([
+        (key.name, key) for key in FUNCTION_KEYS
+        if key not in (ServerProtocol.ALT, ServerProtocol.SHIFT,
+                       ServerProtocol.CONTROL)])
+
+
+def _withoutModifier(method):
+    return lambda widget, modifier: method(widget)
+
+
+def methodKeymap(cls):
+    """
+    Build a L{Keymap} from the C{func_} methods of C{cls}, named the way the
+    insults widgets name them:
+
+        - C{func_HOME} handles a function key with any modifier and is called
+          with the modifier.
+
+        - C{func_CTRL_a} handles a control character and is called with no
+          arguments.
+
+        - C{func_ALT_b} handles a character with a modifier and is called with
+          no arguments.
+
+    Each method is also available to L{Keymap.bind} by its full name.
+    """
+    keymap = Keymap()
+    for name, method in methods(cls, 'func_').iteritems():
+        if name in _functionKeys:
+            key = _functionKeys[name]
+            action = method
+        else:
+            modifierName, _, keyID = name.partition('_')
+            if len(keyID) != 1:
+                continue
+            if modifierName == 'CTRL':
+                key = (chr(ord(keyID) & 0x1f), None)
+            elif modifierName in ('ALT', 'SHIFT', 'CONTROL'):
+                key = (keyID, getattr(ServerProtocol, modifierName))
+            else:
+                continue
+            action = _withoutModifier(method)
+        keymap.actions['func_' + name] = action
+        keymap.bind(key, action)
+    return keymap
+
+
+
+_classKeymaps = {}
+
+def classKeymap(cls):
+    """
+    Get the L{Keymap} built by L{methodKeymap} for C{cls}.  It is built only
+    once, and shared by every caller, so it must not be changed; use
+    L{Keymap.copy} to get one which may be.
+    """
+    keymap = _classKeymaps.get(cls)
+    if keymap is None:
+        keymap = _classKeymaps[cls] = methodKeymap(cls)
+    return keymap
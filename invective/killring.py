@@ -0,0 +1,97 @@
+# -*- test-case-name: invective.test.test_killring -*-
+
+"""
+Storage for text which has been killed from an input area, so that it can be
+yanked back.
+"""
+
+from collections import deque
+
+
+class KillRing(object):
+    """
+    A bounded sequence of killed strings, oldest first, which can be rotated
+    to bring an older string to the end.
+
+    The strings are kept in a C{deque} with a maximum length, so adding a
+    string, discarding the oldest one when the capacity is reached, and
+    rotating are all constant time operations.
+
+    A L{KillRing} compares equal to a C{list} of the same strings.  One may be
+    shared by several input areas, so text killed in one can be yanked in
+    another.
+
+    @type capacity: C{int}
+    @ivar capacity: The greatest number of strings which will be retained.
+    """
+    def __init__(self, strings=(), capacity=60):
+        if capacity < 1:
+            raise ValueError("KillRing capacity must be at least 1")
+        self.capacity = capacity
+        self._strings = deque(strings, capacity)
+
+
+    def __len__(self):
+        return len(self._strings)
+
+
+    def __iter__(self):
+        return iter(self._strings)
+
+
+    def __eq__(self, other):
+        if isinstance(other, (KillRing, list)):
+            return list(self) == list(other)
+        return NotImplemented
+
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        if result is NotImplemented:
+            return result
+        return not result
+
+
+    def __repr__(self):
+        return 'KillRing(%r, %d)' % (list(self), self.capacity)
+
+
+    def newest(self):
+        """
+        Return the string at the end of the ring, or C{None} if it is empty.
+        """
+        if self._strings:
+            return self._strings[-1]
+        return None
+
+
+    def kill(self, text, merge=False, before=False):
+        """
+        Add a killed string to the end of the ring, discarding the oldest one
+        if the ring is full.
+
+        @param merge: If C{True}, and the ring is not empty, combine C{text}
+            with the string at the end instead, as is done for consecutive
+            kills.
+
+        @param before: If C{True}, a merged C{text} goes before the string it
+            is combined with, as it does when killing backwards.
+        """
+        strings = self._strings
+        if merge and strings:
+            if before:
+                strings[-1] = text + strings[-1]
+            else:
+                strings[-1] += text
+        else:
+            strings.append(text)
+
+
+    def rotate(self):
+        """
+        Move the string at the end of the ring to the beginning.
+
+        @return: The string now at the end, or C{None} if the ring is empty.
+        """
+        self._strings.rotate(1)
+        return self.newest()
@@ -0,0 +1,102 @@
+# -*- test-case-name: invective.test.test_message -*-
+
+"""
+Records of the things which happen in conversations, kept in the form they
+arrive in and only turned into text when they are displayed.
+"""
+
+MESSAGE = 'message'
+JOINED = 'joined'
+LEFT = 'left'
+NICK = 'nick'
+TOPIC = 'topic'
+MEMBERS = 'members'
+MASS_JOINED = 'mass joined'
+MASS_LEFT = 'mass left'
+
+
+class Message(object):
+    """
+    Something which happened in a conversation, such as a member saying
+    something or joining.
+
+    Scrollbacks hold many of these, so each is only a few slots.  The text
+    which displays it is produced by C{str} when it is asked for, which is
+    when the message is wrapped to be drawn, and is not kept: the output area
+    keeps the wrapped lines instead.  A message which is never scrolled to is
+    never formatted.
+
+    @type time: C{float}
+    @ivar time: The time, in seconds since the epoch, at which it happened.
+
+    @ivar network: The name of the account it happened on.
+
+    @ivar channel: The name of the group it happened in.
+
+    @ivar sender: The nick of the member who did it, or C{None} if it was not
+    done by any one member.
+
+    @ivar kind: One of L{MESSAGE}, L{JOINED}, L{LEFT}, L{NICK}, L{TOPIC},
+    L{MEMBERS}, or L{MASS_JOINED} or L{MASS_LEFT} for a run of many members
+    joining or leaving, such as a netsplit.
+
+    @ivar text: C{None} or the text belonging to it: what was said, the new
+    nick, the new topic, or the names of the members, separated by spaces.
+
+    @ivar maxNamesShown: The greatest number of names displayed for a
+    L{MASS_JOINED} or L{MASS_LEFT} message.  The others are only counted.
+    """
+    __slots__ = ('time', 'network', 'channel', 'sender', 'kind', 'text')
+
+    formats = {
+        MESSAGE: '%(channel)s/%(sender)s> %(text)s',
+        JOINED: '%(channel)s/%(sender)s joined',
+        LEFT: '%(channel)s/%(sender)s left',
+        NICK: '%(channel)s/%(sender)s is now %(channel)s/%(text)s',
+        TOPIC: '%(channel)s/%(sender)s changed the topic to %(text)s',
+        MEMBERS: '%(channel)s memebers: %(text)s',
+        MASS_JOINED: '%(channel)s/%(count)d joined: %(names)s',
+        MASS_LEFT: '%(channel)s/%(count)d left: %(names)s',
+        }
+
+    maxNamesShown = 10
+
+    def __init__(self, time, network, channel, sender, kind, text=None):
+        self.time = time
+        self.network = network
+        self.channel = channel
+        self.sender = sender
+        self.kind = kind
+        self.text = text
+
+
+    def __repr__(self):
+        return 'Message(%r, %r, %r, %r, %r, %r)' % (
+            self.time, self.network, self.channel, self.sender, self.kind,
+            self.text)
+
+
+    def __str__(self):
+        fields = {
+            'channel': self.channel, 'sender': self.sender, 'text': self.text}
+        if self.kind in (MASS_JOINED, MASS_LEFT):
+            names = self.text.split()
+            shown = ', '.join(names[:self.maxNamesShown])
+            if len(names) > self.maxNamesShown:
+                shown += ' and %d more' % (len(names) - self.maxNamesShown,)
+            fields['count'] = len(names)
+            fields['names'] = shown
+        return self.formats[self.kind] % fields
+
+
+    def size(self):
+        """
+        Approximate the length of the text which displays this message by
+        the length of the text it holds, without formatting it.
+        """
+        length = len(self.channel)
+        if self.sender is not None:
+            length += len(self.sender)
+        if self.text is not None:
+            length += len(self.text)
+        return length
@@ -0,0 +1,231 @@
+# -*- test-case-name: invective.test.test_screen -*-
+
+"""
+An in-memory screen which widgets draw on in place of the real terminal.
+"""
+
+from twisted.conch.insults.insults import CS_US, G0, NORMAL
+
+
+class ShadowTerminal(object):
+    """
+    A virtual terminal which records the character and attributes of every
+    cell written to it.  L{flush} then updates a real terminal by sending only
+    the cells which differ from those sent by the previous flush.
+
+    Only the subset of L{ITerminalTransport} used by widgets is supported:
+    cursor positioning, writing, graphic rendition and character set
+    selection, saving and restoring the cursor, and scrolling with a scroll
+    region.
+
+    Text written to it is decoded as UTF-8, with undecodable bytes replaced,
+    and each character occupies one cell.  Runs of cells are encoded as UTF-8
+    again when they are sent to the real terminal, so a multibyte character
+    is always written whole.  Characters which a terminal displays two
+    columns wide are not accounted for.
+
+    @type cells: C{list} of C{list}
+    @ivar cells: One list per row of C{(character, attributes)} tuples, where
+    attributes is a tuple of the G0 character set and a C{frozenset} of the
+    graphic rendition attributes in effect when the character was written.
+
+    @ivar flushed: C{None} or a copy of C{cells} as of the last flush, which is
+    what the real terminal is displaying.  C{None} means the real terminal's
+    contents are unknown, so the next flush writes every cell.
+
+    @ivar maxGap: The greatest number of unchanged cells which will be written
+    again to join two runs of changed cells on one row, instead of moving the
+    cursor over them.
+
+    @ivar _scrolls: A list of C{(top, bottom)} row pairs, one for each time a
+    scroll region was scrolled up by one row since the last flush.
+    """
+    maxGap = 4
+
+    def __init__(self, width, height):
+        self.resize(width, height)
+
+
+    def resize(self, width, height):
+        """
+        Change the size of this screen.  Its contents are blanked, and the
+        real terminal's contents are considered unknown.
+        """
+        self.width = width
+        self.height = height
+        self.x = self.y = 0
+        self._attributes = (CS_US, frozenset())
+        self._saved = None
+        self._region = (0, height - 1)
+        self._scrolls = []
+        self.cells = [self._blankRow() for i in xrange(height)]
+        self.flushed = None
+
+
+    def _blankRow(self):
+        return [(' ', (CS_US, frozenset()))] * self.width
+
+
+    def cursorPosition(self, column, line):
+        self.x = column
+        self.y = line
+
+
+    def cursorForward(self, n=1):
+        self.x = min(self.width, self.x + n)
+
+
+    def write(self, bytes):
+        if isinstance(bytes, str):
+            text = bytes.decode('utf-8', 'replace')
+        else:
+            text = bytes
+        if 0 <= self.y < self.height:
+            row = self.cells[self.y]
+            cell = self._attributes
+            x = self.x
+            for ch in text[:max(0, self.width - x)]:
+                row[x] = (ch, cell)
+                x += 1
+        self.x += len(text)
+
+
+    def selectGraphicRendition(self, *attributes):
+        charSet, graphics = self._attributes
+        graphics = set(graphics)
+        for a in attributes:
+            a = int(a)
+            if a == NORMAL:
+                graphics.clear()
+            else:
+                graphics.add(a)
+        self._attributes = (charSet, frozenset(graphics))
+
+
+    def selectCharacterSet(self, charSet, which):
+        if which == G0:
+            self._attributes = (charSet, self._attributes[1])
+
+
+    def saveCursor(self):
+        self._saved = (self.x, self.y, self._attributes)
+
+
+    def restoreCursor(self):
+        if self._saved is not None:
+            self.x, self.y, self._attributes = self._saved
+
+
+    def setScrollRegion(self, first=None, last=None):
+        """
+        Set the rows, one-based and inclusive, which L{index} scrolls.  With
+        no arguments, the region is reset to the whole screen.
+        """
+        if first is None:
+            first = 1
+        if last is None:
+            last = self.height
+        self._region = (first - 1, last - 1)
+        self.x = self.y = 0
+
+
+    def index(self):
+        """
+        Move the cursor down a row, scrolling the scroll region up if the
+        cursor is on its bottom row.
+        """
+        top, bottom = self._region
+        if self.y == bottom:
+            self._scroll(self.cells, top, bottom)
+            self._scrolls.append((top, bottom))
+        elif self.y < self.height - 1:
+            self.y += 1
+
+
+    def _scroll(self, rows, top, bottom):
+        del rows[top]
+        rows.insert(bottom, self._blankRow())
+
+
+    def flush(self, terminal):
+        """
+        Bring C{terminal} up to date with the contents of this screen.  If
+        C{terminal} does not support scroll regions, rows which were scrolled
+        here are written to it again instead.
+        """
+        flushed = self.flushed
+        if flushed is None:
+            flushed = [[None] * self.width for i in xrange(self.height)]
+        elif getattr(terminal, 'setScrollRegion', None) is not None:
+            # Repeat on the real terminal the scrolling done here, so that
+            # the rows it moved need not be written.
+            for top, bottom in self._scrolls:
+                terminal.setScrollRegion(top + 1, bottom + 1)
+                terminal.cursorPosition(0, bottom)
+                terminal.index()
+                self._scroll(flushed, top, bottom)
+            if self._scrolls:
+                terminal.setScrollRegion()
+        self._scrolls = []
+
+        current = (CS_US, frozenset())
+        cursor = None
+        for y in xrange(self.height):
+            row = self.cells[y]
+            old = flushed[y]
+            if row == old:
+                continue
+            x = 0
+            while x < self.width:
+                if row[x] == old[x]:
+                    x += 1
+                    continue
+                # Find the end of this run of changes, absorbing short runs of
+                # unchanged cells between changes.
+                end = x + 1
+                gap = 0
+                for i in xrange(x + 1, self.width):
+                    if row[i] == old[i]:
+                        gap += 1
+                        if gap > self.maxGap:
+                            break
+                    else:
+                        gap = 0
+                        end = i + 1
+                if cursor != (x, y):
+                    terminal.cursorPosition(x, y)
+                current = self._writeRun(terminal, row[x:end], current)
+                cursor = (end, y)
+                x = end
+            flushed[y] = row[:]
+        if current != (CS_US, frozenset()):
+            self._setAttributes(terminal, current, (CS_US, frozenset()))
+        self.flushed = flushed
+
+
+    def _writeRun(self, terminal, cells, current):
+        """
+        Write a run of cells, changing attributes only where they differ from
+        the preceding character.
+
+        @return: The attributes in effect on the terminal afterwards.
+        """
+        text = []
+        for ch, attributes in cells:
+            if attributes != current:
+                if text:
+                    terminal.write(u''.join(text).encode('utf-8'))
+                    text = []
+                self._setAttributes(terminal, current, attributes)
+                current = attributes
+            text.append(ch)
+        terminal.write(u''.join(text).encode('utf-8'))
+        return current
+
+
+    def _setAttributes(self, terminal, current, attributes):
+        if attributes[0] != current[0]:
+            terminal.selectCharacterSet(attributes[0], G0)
+        if attributes[1] != current[1]:
+            terminal.selectGraphicRendition(
+                str(NORMAL), *[str(a) for a in sorted(attributes[1])])
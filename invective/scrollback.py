@@ -0,0 +1,251 @@
+# -*- test-case-name: invective.test.test_scrollback -*-
+
+"""
+Bounded storage for the messages displayed by an output area.
+"""
+
+from os import fstat, rename
+from mmap import mmap, ACCESS_READ
+from array import array
+
+
+def _size(message):
+    """
+    Measure a message: the length of a C{str}, or the C{size} of a record
+    such as an L{invective.message.Message}.
+    """
+    if isinstance(message, str):
+        return len(message)
+    return message.size()
+
+
+
+class Scrollback(object):
+    """
+    A sequence of messages with a fixed capacity.  When the capacity is
+    exceeded, the oldest messages are discarded to make room for new ones.
+
+    Messages are kept in a circular list, so appending a message and
+    discarding the oldest one are both constant time operations, as is
+    indexing.  Nothing is stored per message other than a reference to the
+    message itself.
+
+    @type maxLines: C{int}
+    @ivar maxLines: The greatest number of messages which will be retained.
+
+    @type maxBytes: C{int} or C{NoneType}
+    @ivar maxBytes: The greatest total length of the messages which will be
+    retained, or C{None} for no limit other than C{maxLines}.  The most
+    recently added message is always retained, even if it alone exceeds this
+    limit.
+
+    @type bytes: C{int}
+    @ivar bytes: The total length of the messages currently retained.  Each
+    message is a C{str}, or a record with a C{size} method giving its
+    length.
+    """
+    def __init__(self, maxLines=10000, maxBytes=None):
+        if maxLines < 1:
+            raise ValueError("maxLines must be at least 1")
+        self.maxLines = maxLines
+        self.maxBytes = maxBytes
+        self.bytes = 0
+        self._ring = []
+        self._start = 0
+        self._length = 0
+
+
+    def __len__(self):
+        return self._length
+
+
+    def __iter__(self):
+        for i in xrange(self._length):
+            yield self._ring[(self._start + i) % self.maxLines]
+
+
+    def __getitem__(self, index):
+        """
+        Retrieve a message by its position, with C{0} being the oldest message
+        retained.  Negative indexes count back from the newest message.  If a
+        slice is given, a C{list} of the messages it selects is returned.
+        """
+        if isinstance(index, slice):
+            return [self[i] for i in xrange(*index.indices(self._length))]
+        if index < 0:
+            index += self._length
+        if not 0 <= index < self._length:
+            raise IndexError(index)
+        return self._ring[(self._start + index) % self.maxLines]
+
+
+    def append(self, message):
+        """
+        Add a message after all the others, discarding the oldest messages if
+        necessary to stay within the configured limits.
+        """
+        if self._length == self.maxLines:
+            self._evict()
+        position = self._start + self._length
+        if position == len(self._ring) < self.maxLines:
+            # The ring has not yet grown to its full size.
+            self._ring.append(message)
+        else:
+            self._ring[position % self.maxLines] = message
+        self._length += 1
+        self.bytes += _size(message)
+        if self.maxBytes is not None:
+            while self.bytes > self.maxBytes and self._length > 1:
+                self._evict()
+
+
+    def extend(self, messages):
+        """
+        Add each of the given messages, in order.
+        """
+        for message in messages:
+            self.append(message)
+
+
+    def _evict(self):
+        """
+        Discard the oldest message.
+
+        @return: The discarded message.
+        """
+        message = self._ring[self._start]
+        self._ring[self._start] = None
+        self._start = (self._start + 1) % self.maxLines
+        self._length -= 1
+        self.bytes -= _size(message)
+        return message
+
+
+
+class SpillingScrollback(Scrollback):
+    """
+    A L{Scrollback} which, rather than forgetting the messages it discards
+    from memory, appends them to a log file.  Messages in the log remain
+    available by index, so the sequence as a whole only ever grows.
+
+    Only the starting offset of each message in the log is kept in memory.
+    Messages are read back through a memory map of the log, so paging through
+    old messages does not load the log into memory.
+
+    Messages are written to the log as the C{str} of them, and are read back
+    as C{str}.
+
+    @type maxSize: C{int} or C{NoneType}
+    @ivar maxSize: The number of bytes to which the log file is truncated, by
+    discarding its oldest contents, when it is opened larger than this.
+    C{None} to let the file grow without limit.
+
+    @ivar _offsets: An C{array} of the starting offset in the log file of each
+    message which has been written to it.
+
+    @ivar _size: The offset in the log file at which the next message will be
+    written.
+
+    @ivar _map: C{None} or an C{mmap} of the log file.  It is replaced when a
+    message beyond its end is requested.
+    """
+    _map = None
+
+    def __init__(self, path, maxLines=10000, maxBytes=None, maxSize=None):
+        """
+        @param path: The name of the log file.  If it already exists, new
+            messages are appended to it and its existing contents are ignored.
+        """
+        Scrollback.__init__(self, maxLines, maxBytes)
+        self.path = path
+        self.maxSize = maxSize
+        self._log = open(path, 'ab+')
+        self._size = fstat(self._log.fileno()).st_size
+        if maxSize is not None and self._size > maxSize:
+            self._truncate()
+        self._offsets = array('L')
+
+
+    def _truncate(self):
+        """
+        Discard the oldest contents of the log file, so that it is no larger
+        than C{maxSize}.  The remaining contents are written to a new file
+        which then replaces the old one, so the log is not lost if this is
+        interrupted.
+        """
+        self._log.seek(self._size - self.maxSize)
+        contents = self._log.read(self.maxSize)
+        temporary = self.path + '.truncate'
+        truncated = open(temporary, 'wb')
+        try:
+            truncated.write(contents)
+        finally:
+            truncated.close()
+        rename(temporary, self.path)
+        self._log.close()
+        self._log = open(self.path, 'ab+')
+        self._size = len(contents)
+
+
+    def __len__(self):
+        return len(self._offsets) + self._length
+
+
+    def __iter__(self):
+        for i in xrange(len(self._offsets)):
+            yield self._spilled(i)
+        for message in Scrollback.__iter__(self):
+            yield message
+
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in xrange(*index.indices(len(self)))]
+        spilled = len(self._offsets)
+        if index < 0:
+            index += spilled + self._length
+        if 0 <= index < spilled:
+            return self._spilled(index)
+        return Scrollback.__getitem__(self, index - spilled)
+
+
+    def _evict(self):
+        """
+        Discard the oldest message from memory and append it to the log.
+        """
+        message = Scrollback._evict(self)
+        text = str(message)
+        self._offsets.append(self._size)
+        self._log.write(text)
+        self._size += len(text)
+        return message
+
+
+    def _spilled(self, index):
+        """
+        Read the message at the given position in the log.
+        """
+        start = self._offsets[index]
+        if index + 1 < len(self._offsets):
+            end = self._offsets[index + 1]
+        else:
+            end = self._size
+        if start == end:
+            return ''
+        if self._map is None or len(self._map) < end:
+            self._log.flush()
+            if self._map is not None:
+                self._map.close()
+            self._map = mmap(self._log.fileno(), 0, access=ACCESS_READ)
+        return self._map[start:end]
+
+
+    def close(self):
+        """
+        Release the log file.  No messages may be added or retrieved
+        afterwards.
+        """
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        self._log.close()
@@ -4,8 +4,10 @@ Tests for the L{twisted.words.im} integration code in L{invective.chat}.
 
 from twisted.words.im.basesupport import AbstractAccount, AbstractPerson, AbstractGroup
 from twisted.trial.unittest import TestCase
+from twisted.internet.task import Clock
 
 from invective.chat import InvectiveChatUI
+from invective.message import MASS_LEFT
 
 
 class DummyOutput(object):
@@ -21,6 +23,14 @@ class DummyOutput(object):
         self.messages.append(message)
 
 
+    def addMessages(self, messages):
+        self.messages.extend(messages)
+
+
+    def setScrollback(self, scrollback):
+        self.messages = scrollback
+
+
 
 class ChatMixin:
     """
@@ -49,7 +59,8 @@ class ChatMixin:
         self.group = AbstractGroup(self.groupName, self.account)
 
         self.output = DummyOutput()
-        self.chat = InvectiveChatUI(self.output)
+        self.clock = Clock()
+        self.chat = InvectiveChatUI(self.output, reactor=self.clock)
 
 
 
@@ -60,12 +71,176 @@ class GroupConversationTests(ChatMixin, TestCase):
     """
     def test_showGroupMessage(self):
         """
-        Verify that new messages are properly passed on to the display layer.
+        Verify that new messages in the focused conversation are passed on
+        to the display layer once the reactor runs.
         """
         message = 'hello world'
         conversation = self.chat.getGroupConversation(self.group)
+        self.chat.focus(conversation)
         conversation.showGroupMessage(self.person.name, message, {})
+        self.assertEqual(list(self.output.messages), [])
+        self.clock.advance(0)
 
         self.assertEqual(
-            self.output.messages,
+            map(str, self.output.messages),
             ['%s/%s> %s' % (self.group.name, self.person.name, message)])
+        self.assertIdentical(self.output.messages, conversation.messages)
+
+
+    def test_backgroundMessage(self):
+        """
+        Verify that messages in a conversation which is not focused are kept in
+        that conversation's scrollback without being passed to the display
+        layer, and are displayed when it is focused.
+        """
+        conversation = self.chat.getGroupConversation(self.group)
+        conversation.showGroupMessage(self.person.name, 'hello world', {})
+        self.clock.advance(0)
+        self.assertEqual(self.output.messages, [])
+        self.assertEqual(
+            map(str, conversation.messages),
+            ['%s/%s> hello world' % (self.group.name, self.person.name)])
+
+        self.chat.focus(conversation)
+        self.assertIdentical(self.output.messages, conversation.messages)
+
+
+    def test_unfocus(self):
+        """
+        Verify that focusing C{None} makes the display layer show the status
+        messages again.
+        """
+        status = self.output.messages
+        conversation = self.chat.getGroupConversation(self.group)
+        self.chat.focus(conversation)
+        self.chat.focus(None)
+        self.assertIdentical(self.output.messages, status)
+
+
+    def test_createScrollback(self):
+        """
+        Verify that the scrollback for each conversation is created by the
+        callable given to L{InvectiveChatUI}.
+        """
+        names = []
+        def createScrollback(name):
+            names.append(name)
+            return []
+        chat = InvectiveChatUI(self.output, createScrollback)
+        conversation = chat.getGroupConversation(self.group)
+        self.assertEqual(names, ['%s.%s' % (self.accountName, self.group.name)])
+        self.assertEqual(conversation.messages, [])
+
+
+    def test_nicks(self):
+        """
+        Verify that the nicks of a group's members are kept in the
+        conversation's L{PrefixIndex} as members join, leave and change nick.
+        """
+        conversation = self.chat.getGroupConversation(self.group)
+        conversation.setGroupMembers(['alice', 'bob'])
+        conversation.memberJoined('carol')
+        conversation.memberLeft('bob')
+        conversation.memberChangedNick('alice', 'alison')
+        self.assertEqual(list(conversation.nicks), ['alison', 'carol'])
+
+
+    def test_channels(self):
+        """
+        Verify that the names of groups with conversations are kept in the
+        chat UI's L{PrefixIndex}.
+        """
+        self.chat.getGroupConversation(self.group)
+        self.assertEqual(list(self.chat.channels), ['#' + self.group.name])
+
+
+    def test_batched(self):
+        """
+        Verify that the messages for the events which happen before the
+        reactor runs are given to the display layer all at once.
+        """
+        batches = []
+        self.output.addMessages = batches.append
+        conversation = self.chat.getGroupConversation(self.group)
+        self.chat.focus(conversation)
+        conversation.showGroupMessage('alice', 'one')
+        conversation.memberJoined('bob')
+        conversation.showGroupMessage('bob', 'two')
+        self.clock.advance(0)
+        self.assertEqual([map(str, batch) for batch in batches], [[
+                    'group name/alice> one', 'group name/bob joined',
+                    'group name/bob> two']])
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+
+
+    def test_membershipInOrder(self):
+        """
+        Verify that a short run of members joining and leaving is shown as
+        a line for each, in order.
+        """
+        conversation = self.chat.getGroupConversation(self.group)
+        conversation.memberLeft('alice')
+        conversation.memberJoined('bob')
+        conversation.memberJoined('alice')
+        self.clock.advance(0)
+        self.assertEqual(
+            map(str, conversation.messages),
+            ['group name/alice left', 'group name/bob joined',
+             'group name/alice joined'])
+
+
+    def test_netsplit(self):
+        """
+        Verify that a long run of members leaving is shown as one line, in
+        order with the events around it, and that messages before and after
+        it are not summarized.
+        """
+        conversation = self.chat.getGroupConversation(self.group)
+        conversation.showGroupMessage('alice', 'bye')
+        for i in range(12):
+            conversation.memberLeft('nick%d' % (i,))
+        conversation.memberJoined('bob')
+        conversation.showGroupMessage('bob', 'hi')
+        self.clock.advance(0)
+        self.assertEqual(
+            map(str, conversation.messages),
+            ['group name/alice> bye',
+             'group name/12 left: ' + ', '.join(
+                    ['nick%d' % (i,) for i in range(10)]) + ' and 2 more',
+             'group name/bob joined',
+             'group name/bob> hi'])
+        summary = conversation.messages[1]
+        self.assertEqual(summary.kind, MASS_LEFT)
+        self.assertIdentical(summary.sender, None)
+        self.assertEqual(
+            summary.text.split(), ['nick%d' % (i,) for i in range(12)])
+
+
+    def test_netsplitRejoin(self):
+        """
+        Verify that members leaving in a netsplit and then joining again are
+        shown leaving before they are shown joining.
+        """
+        conversation = self.chat.getGroupConversation(self.group)
+        nicks = ['nick%d' % (i,) for i in range(5)]
+        for nick in nicks:
+            conversation.memberLeft(nick)
+        for nick in nicks:
+            conversation.memberJoined(nick)
+        self.clock.advance(0)
+        self.assertEqual(
+            map(str, conversation.messages),
+            ['group name/5 left: ' + ', '.join(nicks),
+             'group name/5 joined: ' + ', '.join(nicks)])
+
+
+    def test_focusFlushes(self):
+        """
+        Verify that events which happened before a conversation is focused
+        are in its scrollback when it is displayed.
+        """
+        conversation = self.chat.getGroupConversation(self.group)
+        conversation.showGroupMessage('alice', 'hi')
+        self.chat.focus(conversation)
+        self.assertEqual(map(str, self.output.messages), ['group name/alice> hi'])
+        self.assertEqual(self.clock.getDelayedCalls(), [])
@@ -0,0 +1,77 @@
+
+"""
+Tests for L{invective.completion}.
+"""
+
+from twisted.trial.unittest import TestCase
+
+from invective.completion import PrefixIndex, commonPrefix
+
+
+class PrefixIndexTests(TestCase):
+    """
+    Tests for L{PrefixIndex}'s storage and search of words.
+    """
+    def test_initial(self):
+        """
+        Verify that a L{PrefixIndex} holds the words it is given, in order,
+        without words differing only in case.
+        """
+        index = PrefixIndex(['bob', 'Alice', 'carol', 'BOB'])
+        self.assertEqual(len(index), 3)
+        self.assertEqual(list(index), ['Alice', 'BOB', 'carol'])
+        self.assertIn('alice', index)
+        self.assertNotIn('dave', index)
+
+
+    def test_complete(self):
+        """
+        Verify that L{PrefixIndex.complete} finds the words beginning with a
+        prefix, ignoring case.
+        """
+        index = PrefixIndex(['alice', 'Alison', 'bob', 'al'])
+        self.assertEqual(index.complete('al'), ['al', 'alice', 'Alison'])
+        self.assertEqual(index.complete('ALI'), ['alice', 'Alison'])
+        self.assertEqual(index.complete('b'), ['bob'])
+        self.assertEqual(index.complete('c'), [])
+        self.assertEqual(index.complete('bobby'), [])
+        self.assertEqual(index.complete(''), ['al', 'alice', 'Alison', 'bob'])
+
+
+    def test_add(self):
+        """
+        Verify that L{PrefixIndex.add} adds a word in order, replacing one
+        which differs from it only in case.
+        """
+        index = PrefixIndex(['alice', 'carol'])
+        index.add('bob')
+        index.add('Alice')
+        self.assertEqual(list(index), ['Alice', 'bob', 'carol'])
+        self.assertEqual(index.complete('a'), ['Alice'])
+
+
+    def test_remove(self):
+        """
+        Verify that L{PrefixIndex.remove} removes a word, ignoring case, and
+        does nothing for a word which is not present.
+        """
+        index = PrefixIndex(['alice', 'bob', 'carol'])
+        index.remove('BOB')
+        index.remove('dave')
+        self.assertEqual(list(index), ['alice', 'carol'])
+        self.assertEqual(index.complete('b'), [])
+
+
+
+class CommonPrefixTests(TestCase):
+    """
+    Tests for L{commonPrefix}.
+    """
+    def test_commonPrefix(self):
+        """
+        Verify that L{commonPrefix} finds the longest prefix shared by some
+        words, ignoring case and spelled as in the first word.
+        """
+        self.assertEqual(commonPrefix(['Alice', 'alison']), 'Ali')
+        self.assertEqual(commonPrefix(['alice']), 'alice')
+        self.assertEqual(commonPrefix(['alice', 'bob']), '')
@@ -0,0 +1,427 @@
+
+"""
+Tests for L{invective.connection}.
+"""
+
+from twisted.trial.unittest import TestCase
+from twisted.internet.error import TimeoutError
+from twisted.internet.task import Clock
+from twisted.test.proto_helpers import MemoryReactor, StringTransport
+
+from invective.connection import (
+    CONNECTING, CONNECTED, DISCONNECTED, ConnectionManager)
+from invective.chat import InvectiveChatUI
+from invective.test.test_chat import DummyOutput
+
+
+def welcome(client):
+    """
+    Deliver the server's welcome to a client, completing its registration.
+    """
+    client.lineReceived(':irc.example.org 001 alice :Welcome')
+
+
+
+class FakeReactor(MemoryReactor, Clock):
+    """
+    A reactor which records connection attempts instead of making them and
+    runs timed calls when it is advanced.
+    """
+    def __init__(self):
+        MemoryReactor.__init__(self)
+        Clock.__init__(self)
+
+
+
+class ConnectionManagerTests(TestCase):
+    """
+    Tests for L{ConnectionManager}'s tracking of several accounts.
+    """
+    def setUp(self):
+        self.reactor = FakeReactor()
+        self.chat = InvectiveChatUI(DummyOutput())
+        self.manager = ConnectionManager(self.chat, self.reactor)
+        self.changes = []
+        self.manager.statusChanged = self.changes.append
+
+
+    def _logOn(self, index):
+        """
+        Complete the connection attempt with the given index.
+
+        @return: The client protocol.
+        """
+        host, port, factory = self.reactor.tcpClients[index][:3]
+        protocol = factory.buildProtocol((host, port))
+        protocol.makeConnection(StringTransport())
+        self.reactor.advance(0)
+        return protocol
+
+
+    def test_connect(self):
+        """
+        Verify that L{ConnectionManager.connect} connects to the server using
+        the manager's reactor, and that the L{Deferred} it returns fires with
+        the account once it has logged on.
+        """
+        accounts = []
+        self.manager.connect('irc.example.org', 'alice', 6668).addCallback(
+            accounts.append)
+        self.assertEqual(self.reactor.tcpClients[0][:2], ('irc.example.org', 6668))
+        account = self.manager.get('irc.example.org')
+        self.assertEqual(account.status, CONNECTING)
+        self.assertEqual(account.username, 'alice')
+        self.assertEqual(accounts, [])
+
+        client = self._logOn(0)
+        self.assertEqual(accounts, [account])
+        self.assertEqual(account.status, CONNECTED)
+        self.assertIdentical(account.client, client)
+        self.assertEqual(self.changes, [account, account])
+
+
+    def test_manyConnections(self):
+        """
+        Verify that accounts are kept for any number of servers, with a number
+        added to the name of a second account for the same server.
+        """
+        self.manager.connect('irc.example.org', 'alice')
+        self.manager.connect('irc.example.net', 'alice')
+        self.manager.connect('irc.example.org', 'bob')
+        self.assertEqual(len(self.manager), 3)
+        self.assertEqual(
+            [account.accountName for account in self.manager],
+            ['irc.example.org', 'irc.example.net', 'irc.example.org:2'])
+        self.assertEqual(self.manager.get('irc.example.org:2').username, 'bob')
+        self.assertIdentical(self.manager.get('irc.example.com'), None)
+
+
+    def test_connectionFailed(self):
+        """
+        Verify that an account which cannot connect is forgotten, and that
+        the L{Deferred} returned by L{ConnectionManager.connect} fails.
+        """
+        d = self.manager.connect('irc.example.org', 'alice')
+        factory = self.reactor.tcpClients[0][2]
+        factory.clientConnectionFailed(None, TimeoutError("mock"))
+        self.reactor.advance(0)
+        self.assertEqual(len(self.manager), 0)
+        return self.assertFailure(d, TimeoutError)
+
+
+    def test_connectionLost(self):
+        """
+        Verify that the status of an account whose connection is lost
+        becomes L{DISCONNECTED}.
+        """
+        self.manager.connect('irc.example.org', 'alice')
+        client = self._logOn(0)
+        client.connectionLost(None)
+        account = self.manager.get('irc.example.org')
+        self.assertEqual(account.status, DISCONNECTED)
+        self.assertIdentical(account.client, None)
+
+
+    def test_remove(self):
+        """
+        Verify that L{ConnectionManager.remove} disconnects and forgets an
+        account.
+        """
+        self.manager.connect('irc.example.org', 'alice')
+        client = self._logOn(0)
+        self.manager.remove('irc.example.org')
+        self.assertEqual(len(self.manager), 0)
+        self.assertTrue(client.transport.disconnecting)
+
+
+    def test_summary(self):
+        """
+        Verify that L{ConnectionManager.summary} names each account, with the
+        status of those which are not connected.
+        """
+        self.assertEqual(self.manager.summary(), '')
+        self.manager.connect('irc.example.org', 'alice')
+        self.manager.connect('irc.example.net', 'alice')
+        self.assertEqual(
+            self.manager.summary(),
+            'irc.example.org(connecting) irc.example.net(connecting)')
+        self._logOn(0)
+        self.assertEqual(
+            self.manager.summary(),
+            'irc.example.org irc.example.net(connecting)')
+
+
+
+class ReconnectTests(TestCase):
+    """
+    Tests for L{InvectiveIRCAccount}'s reconnection after its connection is
+    lost.
+    """
+    def setUp(self):
+        self.reactor = FakeReactor()
+        self.chat = InvectiveChatUI(DummyOutput())
+        self.manager = ConnectionManager(self.chat, self.reactor)
+        self.manager.connect('irc.example.org', 'alice')
+        self.account = self.manager.get('irc.example.org')
+        self.account.random = lambda: 0.5
+        self.client = self._logOn()
+
+
+    def _logOn(self, registered=True):
+        """
+        Complete the most recent connection attempt.
+
+        @param registered: If C{True}, also deliver the server's welcome.
+
+        @return: The client protocol.
+        """
+        host, port, factory = self.reactor.tcpClients[-1][:3]
+        protocol = factory.buildProtocol((host, port))
+        protocol.makeConnection(StringTransport())
+        self.reactor.advance(0)
+        if registered:
+            welcome(protocol)
+        return protocol
+
+
+    def _fail(self):
+        """
+        Fail the most recent connection attempt.
+        """
+        factory = self.reactor.tcpClients[-1][2]
+        factory.clientConnectionFailed(None, TimeoutError("mock"))
+        self.reactor.advance(0)
+
+
+    def _delay(self):
+        """
+        Get the time until the next attempt to reconnect.
+        """
+        return self.account.reconnectCall.getTime() - self.reactor.seconds()
+
+
+    def test_reconnect(self):
+        """
+        Verify that a lost connection is replaced after C{initialDelay}
+        seconds, and that the channels which were joined are joined again.
+        """
+        self.account.joinGroup('example')
+        self.account.joinGroup('other')
+        self.account.leaveGroup('other')
+        self.client.connectionLost(None)
+        self.assertEqual(self._delay(), self.account.initialDelay)
+        self.reactor.advance(self.account.initialDelay)
+        self.assertEqual(len(self.reactor.tcpClients), 2)
+        client = self._logOn()
+        self.assertIdentical(self.account.client, client)
+        # Wait for the lines to get past flood control.
+        self.reactor.advance(10)
+        self.assertIn('JOIN #example\r\n', client.transport.value())
+        self.assertNotIn('other', client.transport.value())
+
+
+    def test_backoff(self):
+        """
+        Verify that each failed attempt to reconnect waits C{factor} times
+        longer than the one before, up to C{maxDelay}.
+        """
+        self.client.connectionLost(None)
+        delays = []
+        for i in range(10):
+            delay = self._delay()
+            delays.append(delay)
+            self.reactor.advance(delay)
+            self._fail()
+        self.assertEqual(
+            delays, [2.0, 4.0, 8.0, 16.0, 32.0, 64.0, 128.0, 256.0, 300.0, 300.0])
+
+
+    def test_jitter(self):
+        """
+        Verify that the wait before reconnecting is varied by up to C{jitter}
+        of its length.
+        """
+        self.account.random = lambda: 0.0
+        self.client.connectionLost(None)
+        self.assertEqual(self._delay(), 1.5)
+        self.reactor.advance(1.5)
+        self.account.random = lambda: 1.0
+        self._fail()
+        self.assertEqual(self._delay(), 5.0)
+
+
+    def test_unstableConnection(self):
+        """
+        Verify that the waits start again from C{initialDelay} only after a
+        connection has lasted C{stableTime} seconds.
+        """
+        self.client.connectionLost(None)
+        self.reactor.advance(self._delay())
+        self._logOn().connectionLost(None)
+        self.assertEqual(self._delay(), 4.0)
+        self.reactor.advance(self._delay())
+        client = self._logOn()
+        self.reactor.advance(self.account.stableTime)
+        client.connectionLost(None)
+        self.assertEqual(self._delay(), 2.0)
+
+
+    def test_pending(self):
+        """
+        Verify that messages sent to a channel while waiting to reconnect are
+        sent once reconnected, and not before the server has welcomed the
+        client.
+        """
+        self.account.joinGroup('example')
+        group = self.account.getGroup('example')
+        self.client.connectionLost(None)
+        group.sendGroupMessage('hello')
+        self.assertEqual(list(self.account.pending), [(group, 'hello', {})])
+        self.reactor.advance(self._delay())
+        client = self._logOn(registered=False)
+        self.reactor.advance(10)
+        self.assertEqual(list(self.account.pending), [(group, 'hello', {})])
+        self.assertNotIn('#example', client.transport.value())
+        welcome(client)
+        self.assertEqual(list(self.account.pending), [])
+        self.reactor.advance(10)
+        self.assertTrue(client.transport.value().endswith(
+            'JOIN #example\r\nPRIVMSG #example :hello\r\n'))
+
+
+    def test_remove(self):
+        """
+        Verify that removing an account which is waiting to reconnect stops it
+        from reconnecting.
+        """
+        self.client.connectionLost(None)
+        self.manager.remove('irc.example.org')
+        self.assertEqual(self.reactor.getDelayedCalls(), [])
+        self.assertFalse(self.account.continueTrying)
+
+
+
+class FloodControlTests(TestCase):
+    """
+    Tests for L{InvectiveIRCProto}'s sending of lines through its account's
+    L{OutgoingQueue}.
+    """
+    def setUp(self):
+        self.reactor = FakeReactor()
+        self.chat = InvectiveChatUI(DummyOutput())
+        self.manager = ConnectionManager(self.chat, self.reactor)
+        self.manager.connect('irc.example.org', 'alice')
+        self.account = self.manager.get('irc.example.org')
+        host, port, factory = self.reactor.tcpClients[-1][:3]
+        self.client = factory.buildProtocol((host, port))
+        self.transport = StringTransport()
+        self.client.makeConnection(self.transport)
+        self.reactor.advance(0)
+        welcome(self.client)
+        self.reactor.advance(100)
+        self.transport.clear()
+
+
+    def _sent(self):
+        lines = self.transport.value().split('\r\n')[:-1]
+        self.transport.clear()
+        return lines
+
+
+    def test_rate(self):
+        """
+        Verify that lines are sent at once until C{floodBurst} have been
+        sent, and then at C{floodRate} per second.
+        """
+        for i in range(7):
+            self.client.say('#example', str(i))
+        self.assertEqual(
+            self._sent(), ['PRIVMSG #example :%d' % (i,) for i in range(5)])
+        self.reactor.advance(1 / self.account.floodRate)
+        self.assertEqual(self._sent(), ['PRIVMSG #example :5'])
+        self.reactor.advance(1 / self.account.floodRate)
+        self.assertEqual(self._sent(), ['PRIVMSG #example :6'])
+
+
+    def test_priority(self):
+        """
+        Verify that a PONG is sent before messages which are waiting to be
+        sent.
+        """
+        for i in range(6):
+            self.client.say('#example', str(i))
+        self.client.lineReceived('PING :irc.example.org')
+        self._sent()
+        self.reactor.advance(1 / self.account.floodRate)
+        self.assertEqual(self._sent(), ['PONG irc.example.org'])
+
+
+    def test_split(self):
+        """
+        Verify that a message too long to be relayed by the server is split
+        into several.
+        """
+        text = ' '.join(['word%d' % (i,) for i in range(100)])
+        self.client.sendLine('PRIVMSG #example :' + text)
+        lines = self._sent()
+        self.assertTrue(len(lines) > 1)
+        for line in lines:
+            self.assertTrue(line.startswith('PRIVMSG #example :'))
+            self.assertTrue(len(line) <= 510 - 100)
+        self.assertEqual(
+            ' '.join([line[len('PRIVMSG #example :'):] for line in lines]),
+            text)
+
+
+    def test_splitAction(self):
+        """
+        Verify that each part of a split CTCP ACTION is a complete CTCP
+        ACTION.
+        """
+        self.client.describe('#example', 'x ' * 300)
+        lines = self._sent()
+        self.assertTrue(len(lines) > 1)
+        for line in lines:
+            self.assertTrue(line.startswith('PRIVMSG #example :\x01ACTION x'))
+            self.assertTrue(line.endswith('x\x01'))
+
+
+    def test_keptAcrossReconnection(self):
+        """
+        Verify that messages not yet sent when the connection is lost are sent
+        on the next connection, after registering and joining channels, and
+        not before the server has welcomed the client.
+        """
+        self.account.random = lambda: 0.5
+        self.account.joinGroup('example')
+        for i in range(8):
+            self.client.say('#example', str(i))
+        self._sent()
+        self.client.connectionLost(None)
+        self.reactor.advance(self.account.reconnectCall.getTime())
+        host, port, factory = self.reactor.tcpClients[-1][:3]
+        client = factory.buildProtocol((host, port))
+        client.makeConnection(self.transport)
+        self.reactor.advance(100)
+        self.assertEqual(
+            self._sent(), ['NICK alice', 'USER alice foo bar :Twisted-IM user'])
+        welcome(client)
+        self.reactor.advance(100)
+        self.assertEqual(
+            self._sent(),
+            ['JOIN #example'] +
+            ['PRIVMSG #example :%d' % (i,) for i in range(4, 8)])
+
+
+    def test_partThenJoin(self):
+        """
+        Verify that once registered, a JOIN does not overtake a PART of the
+        same channel which is waiting to be sent.
+        """
+        for i in range(5):
+            self.client.say('#example', str(i))
+        self.client.leave('example')
+        self.client.join('example')
+        self._sent()
+        self.reactor.advance(2 / self.account.floodRate)
+        self.assertEqual(self._sent(), ['PART #example', 'JOIN #example'])
@@ -0,0 +1,102 @@
+
+"""
+Tests for L{invective.editbuffer}.
+"""
+
+from twisted.trial.unittest import TestCase
+
+from invective.editbuffer import EditBuffer
+
+
+class EditBufferTests(TestCase):
+    """
+    Tests for L{EditBuffer}'s modification of its contents.
+    """
+    def test_initial(self):
+        """
+        Verify that an L{EditBuffer} starts with the text it is given.
+        """
+        self.assertEqual(str(EditBuffer()), '')
+        self.assertEqual(len(EditBuffer()), 0)
+        self.assertEqual(str(EditBuffer('hello')), 'hello')
+        self.assertEqual(len(EditBuffer('hello')), 5)
+
+
+    def test_insert(self):
+        """
+        Verify that L{EditBuffer.insert} inserts text at the given position,
+        wherever the previous edit was.
+        """
+        b = EditBuffer('hello')
+        b.insert(5, ' world')
+        self.assertEqual(str(b), 'hello world')
+        b.insert(0, '>')
+        self.assertEqual(str(b), '>hello world')
+        b.insert(6, ',')
+        self.assertEqual(str(b), '>hello, world')
+        b.insert(13, '!')
+        self.assertEqual(str(b), '>hello, world!')
+        self.assertEqual(len(b), 14)
+
+
+    def test_delete(self):
+        """
+        Verify that L{EditBuffer.delete} removes and returns characters
+        starting at the given position.
+        """
+        b = EditBuffer('hello world')
+        self.assertEqual(b.delete(5), ' ')
+        self.assertEqual(str(b), 'helloworld')
+        self.assertEqual(b.delete(0, 2), 'he')
+        self.assertEqual(str(b), 'lloworld')
+        self.assertEqual(b.delete(4, 100), 'orld')
+        self.assertEqual(str(b), 'llow')
+        self.assertEqual(b.delete(4), '')
+        self.assertEqual(str(b), 'llow')
+
+
+    def test_replace(self):
+        """
+        Verify that L{EditBuffer.replace} substitutes text for a range of
+        characters.
+        """
+        b = EditBuffer('hello world')
+        b.replace(6, 5, 'there')
+        self.assertEqual(str(b), 'hello there')
+        b.replace(0, 5, 'hi')
+        self.assertEqual(str(b), 'hi there')
+
+
+    def test_gapMovesBothWays(self):
+        """
+        Verify that edits alternating between positions before and after the
+        previous edit keep the text consistent.
+        """
+        b = EditBuffer('abcdef')
+        b.insert(2, 'X')
+        b.insert(6, 'Y')
+        b.delete(1)
+        b.insert(0, 'Z')
+        self.assertEqual(str(b), 'ZaXcdeYf')
+
+
+    def test_changes(self):
+        """
+        Verify that every modification increments L{EditBuffer.version}, and
+        that L{EditBuffer.changedFrom} is the lowest position modified since
+        L{EditBuffer.resetChanges} was called.
+        """
+        b = EditBuffer('hello world')
+        self.assertIdentical(b.changedFrom, None)
+        b.insert(5, ',')
+        b.delete(8)
+        self.assertEqual(b.version, 2)
+        self.assertEqual(b.changedFrom, 5)
+        b.resetChanges()
+        self.assertIdentical(b.changedFrom, None)
+        b.delete(100)
+        b.insert(3, '')
+        self.assertEqual(b.version, 2)
+        self.assertIdentical(b.changedFrom, None)
+        b.replace(0, 1, 'j')
+        self.assertEqual(b.changedFrom, 0)
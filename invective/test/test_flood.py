@@ -0,0 +1,136 @@
+
+"""
+Tests for L{invective.flood}.
+"""
+
+from twisted.trial.unittest import TestCase
+from twisted.internet.task import Clock
+
+from invective.flood import TokenBucket, OutgoingQueue
+
+
+class TokenBucketTests(TestCase):
+    """
+    Tests for L{TokenBucket}'s limit on the rate of operations.
+    """
+    def setUp(self):
+        self.clock = Clock()
+        self.bucket = TokenBucket(self.clock, 0.5, 3)
+
+
+    def test_burst(self):
+        """
+        Verify that a full bucket allows C{capacity} operations at once.
+        """
+        self.assertEqual(
+            [self.bucket.consume() for i in range(4)],
+            [True, True, True, False])
+
+
+    def test_refill(self):
+        """
+        Verify that tokens are added at C{rate} per second, up to
+        C{capacity}.
+        """
+        for i in range(3):
+            self.bucket.consume()
+        self.clock.advance(1)
+        self.assertFalse(self.bucket.consume())
+        self.clock.advance(1)
+        self.assertTrue(self.bucket.consume())
+        self.clock.advance(100)
+        self.assertEqual(
+            [self.bucket.consume() for i in range(4)],
+            [True, True, True, False])
+
+
+    def test_wait(self):
+        """
+        Verify that L{TokenBucket.wait} computes how long it will be until a
+        token is available.
+        """
+        self.assertEqual(self.bucket.wait(), 0)
+        for i in range(3):
+            self.bucket.consume()
+        self.assertEqual(self.bucket.wait(), 2.0)
+        self.clock.advance(0.5)
+        self.assertEqual(self.bucket.wait(), 1.5)
+
+
+
+class OutgoingQueueTests(TestCase):
+    """
+    Tests for L{OutgoingQueue}'s sending of lines.
+    """
+    def setUp(self):
+        self.clock = Clock()
+        self.sent = []
+        self.queue = OutgoingQueue(self.clock, 1.0, 2)
+        self.queue.start(self.sent.append)
+
+
+    def test_rate(self):
+        """
+        Verify that lines are sent immediately until the burst is used up,
+        and then one at a time as the rate allows.
+        """
+        for i in range(5):
+            self.queue.put(str(i))
+        self.assertEqual(self.sent, ['0', '1'])
+        self.assertEqual(len(self.queue), 3)
+        self.clock.advance(1)
+        self.assertEqual(self.sent, ['0', '1', '2'])
+        self.clock.advance(2)
+        self.assertEqual(self.sent, ['0', '1', '2', '3', '4'])
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+
+
+    def test_priority(self):
+        """
+        Verify that lines in the priority lane are sent before the others
+        waiting to be sent.
+        """
+        for i in range(4):
+            self.queue.put(str(i))
+        self.queue.put('PONG', priority=True)
+        self.clock.advance(1)
+        self.assertEqual(self.sent, ['0', '1', 'PONG'])
+
+
+    def test_stopped(self):
+        """
+        Verify that lines are kept while the queue is stopped, apart from
+        those which were in the priority lane when it was stopped, and sent
+        when it is started again.
+        """
+        for i in range(3):
+            self.queue.put(str(i))
+        self.queue.put('PONG', priority=True)
+        self.queue.stop()
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+        self.queue.put('3')
+        self.queue.put('PING', priority=True)
+        self.clock.advance(10)
+        self.assertEqual(self.sent, ['0', '1'])
+        self.queue.start(self.sent.append)
+        self.assertEqual(self.sent, ['0', '1', 'PING', '2'])
+        self.clock.advance(1)
+        self.assertEqual(self.sent, ['0', '1', 'PING', '2', '3'])
+
+
+    def test_priorityOnly(self):
+        """
+        Verify that a queue started with C{priorityOnly} sends only the lines
+        in the priority lane, and the others once it is started without it.
+        """
+        self.queue.stop()
+        self.queue.put('0')
+        self.queue.put('NICK', priority=True)
+        self.queue.start(self.sent.append, priorityOnly=True)
+        self.queue.put('1')
+        self.queue.put('USER', priority=True)
+        self.clock.advance(10)
+        self.assertEqual(self.sent, ['NICK', 'USER'])
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+        self.queue.start(self.sent.append)
+        self.assertEqual(self.sent, ['NICK', 'USER', '0', '1'])
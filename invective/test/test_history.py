@@ -5,7 +5,7 @@ Tests for input history tracking as provided by L{History}.
 
 from twisted.trial.unittest import TestCase
 
-from invective.history import History
+from invective.history import History, FileHistory, TrigramIndex
 
 
 class HistoryTests(TestCase):
@@ -146,3 +146,422 @@ class HistoryTests(TestCase):
         h.previousLine()
         h.resetPosition()
         self.assertEqual(h.nextLine(), "")
+
+
+    def test_atEnd(self):
+        """
+        Verify that C{atEnd} is true only when the position is after every
+        line, and that adding a line at the end leaves the position there.
+        """
+        h = History(["hello"])
+        self.assertTrue(h.atEnd())
+        h.addLine("world")
+        self.assertTrue(h.atEnd())
+        h.previousLine()
+        self.assertFalse(h.atEnd())
+        h.nextLine()
+        self.assertTrue(h.atEnd())
+
+
+    def test_beforeAndAfterLines(self):
+        """
+        Verify that C{beforeLines} and C{afterLines} are the lines on either
+        side of the current position.
+        """
+        h = History(["a", "b", "c"])
+        h.previousLine()
+        h.previousLine()
+        self.assertEqual(h.beforeLines, ["a"])
+        self.assertEqual(h.afterLines, ["b", "c"])
+        h.addLine("d")
+        self.assertEqual(h.afterLines, ["b", "c", "d"])
+        h.resetPosition()
+        self.assertEqual(h.afterLines, [])
+
+
+
+class FileHistoryTests(TestCase):
+    """
+    Tests for L{FileHistory}'s storage of input lines in a file.
+    """
+    def setUp(self):
+        self.path = self.mktemp()
+
+
+    def open(self, maxSize=None):
+        history = FileHistory(self.path, maxSize)
+        self.addCleanup(history.close)
+        return history
+
+
+    def test_persistence(self):
+        """
+        Verify that lines added to a L{FileHistory} are available from a
+        L{FileHistory} created later for the same file.
+        """
+        h = self.open()
+        h.addLine("hello")
+        h.addLine("multi\nline \\ text")
+        h = self.open()
+        self.assertTrue(h.atEnd())
+        self.assertEqual(h.previousLine(), "multi\nline \\ text")
+        self.assertEqual(h.previousLine(), "hello")
+        self.assertEqual(h.previousLine(), "")
+        self.assertEqual(h.nextLine(), "multi\nline \\ text")
+        self.assertEqual(h.nextLine(), "")
+        self.assertEqual(
+            h.allLines(), ["hello", "multi\nline \\ text"])
+
+
+    def test_escaping(self):
+        """
+        Verify that newlines and backslashes are escaped in the file, so each
+        line of history is one line of the file.
+        """
+        h = self.open()
+        h.addLine("a\nb\\n")
+        self.assertEqual(open(self.path).read(), "a\\nb\\\\n\n")
+
+
+    def test_lazyIndex(self):
+        """
+        Verify that lines in the file are located only as the position is
+        moved back to them, and that lines added in this session come before
+        them.
+        """
+        h = self.open()
+        for i in range(100):
+            h.addLine(str(i))
+        h = self.open()
+        h.addLine("new")
+        self.assertEqual(len(h._starts), 0)
+        self.assertEqual(h.previousLine(), "new")
+        self.assertEqual(h.previousLine(), "99")
+        self.assertEqual(h.previousLine(), "98")
+        self.assertEqual(len(h._starts), 2)
+        self.assertEqual(h.afterLines, ["98", "99", "new"])
+
+
+    def test_countInChunks(self):
+        """
+        Verify that the lines in the file are counted correctly when it is
+        examined in several chunks, whether or not it ends with a newline.
+        """
+        h = self.open()
+        for i in range(10):
+            h.addLine(str(i))
+        h.close()
+        h = self.open()
+        h._chunkSize = 3
+        h.addLine("new")
+        self.assertEqual(h._count(), 11)
+        h.close()
+        open(self.path, 'ab').write('last')
+        h = self.open()
+        h._chunkSize = 3
+        self.assertEqual(h._count(), 12)
+
+
+    def test_concurrentAppend(self):
+        """
+        Verify that two L{FileHistory} objects using the same file both
+        append to it, and each sees only its own new lines until the file is
+        opened again.
+        """
+        first = self.open()
+        second = self.open()
+        first.addLine("one")
+        second.addLine("two")
+        first.addLine("three")
+        self.assertEqual(first.allLines(), ["one", "three"])
+        self.assertEqual(self.open().allLines(), ["one", "two", "three"])
+
+
+    def test_ignoreRepeats(self):
+        """
+        Verify that a L{FileHistory} with C{ignoreRepeats} does not write a
+        line the same as the newest one, even if that is in the file.
+        """
+        h = self.open()
+        h.addLine("hello")
+        h = FileHistory(self.path, ignoreRepeats=True)
+        self.addCleanup(h.close)
+        h.addLine("hello")
+        h.addLine("world")
+        h.addLine("world")
+        self.assertEqual(open(self.path).read(), "hello\nworld\n")
+
+
+    def test_compactOnOpen(self):
+        """
+        Verify that a file larger than C{maxSize} is compacted to no more than
+        that size when it is opened, keeping whole lines from the end.
+        """
+        h = self.open()
+        for i in range(10):
+            h.addLine("line %d" % (i,))
+        h = self.open(maxSize=21)
+        self.assertEqual(h.allLines(), ["line 7", "line 8", "line 9"])
+        self.assertEqual(open(self.path).read(), "line 7\nline 8\nline 9\n")
+
+
+    def test_compactWhileAppending(self):
+        """
+        Verify that the file is compacted when it grows to twice C{maxSize},
+        and that another L{FileHistory} using it then appends to the compacted
+        file.
+        """
+        h = self.open(maxSize=14)
+        other = self.open()
+        for i in range(5):
+            h.addLine("line %d" % (i,))
+        self.assertEqual(open(self.path).read(), "line 3\nline 4\n")
+        other.addLine("other")
+        self.assertEqual(
+            open(self.path).read(), "line 3\nline 4\nother\n")
+        self.assertEqual(h.allLines(), ["line %d" % (i,) for i in range(5)])
+
+
+
+class SearchTests(TestCase):
+    """
+    Tests for L{History.search} and the L{TrigramIndex} it uses.
+    """
+    def setUp(self):
+        self.history = History(
+            ["/join #python", "hello world", "/join #twisted", "goodbye"])
+
+
+    def test_candidates(self):
+        """
+        Verify that L{TrigramIndex.candidates} returns the shortest list of
+        lines containing one of the query's trigrams, or every line if the
+        query is too short.
+        """
+        index = TrigramIndex(10)
+        for line in self.history.allLines():
+            index.add(line)
+        self.assertEqual(list(index.candidates("/join #")), [10, 12])
+        self.assertEqual(list(index.candidates("#tw")), [12])
+        self.assertEqual(list(index.candidates("xyz")), [])
+        self.assertEqual(list(index.candidates("jo")), [10, 11, 12, 13])
+        self.assertEqual(list(index.before("oin", 12)), [10])
+        self.assertEqual(list(index.after("oin", 11)), [12])
+
+
+    def test_searchBackward(self):
+        """
+        Verify that a backward search finds the nearest older line containing
+        the query and moves the position to it, considering the line at the
+        current position unless C{again} is C{True}.
+        """
+        h = self.history
+        self.assertEqual(h.search("join"), "/join #twisted")
+        self.assertEqual(h.position, 2)
+        self.assertEqual(h.search("join"), "/join #twisted")
+        self.assertEqual(h.search("join", again=True), "/join #python")
+        self.assertIdentical(h.search("join", again=True), None)
+        self.assertEqual(h.position, 4)
+        self.assertEqual(h.nextLine(), "hello world")
+
+
+    def test_searchForward(self):
+        """
+        Verify that a forward search finds the nearest newer line containing
+        the query.
+        """
+        h = self.history
+        h.search("python")
+        self.assertEqual(h.search("o", backward=False, again=True), "hello world")
+        self.assertEqual(h.search("oo", backward=False, again=True), "goodbye")
+        self.assertIdentical(h.search("o", backward=False, again=True), None)
+
+
+    def test_indexMore(self):
+        """
+        Verify that L{History.indexMore} indexes the lines the history began
+        with, newest first, and that searches find lines whether they have
+        been indexed or not.
+        """
+        h = History(["line %d" % (i,) for i in range(10)])
+        self.assertTrue(h.indexMore(4))
+        self.assertEqual(
+            [(s.first, s.count) for s in h._segments], [(6, 4)])
+        self.assertEqual(h.search("line 2"), "line 2")
+        self.assertEqual(h.search("line 8", backward=False), "line 8")
+        self.assertTrue(h.indexMore(4))
+        self.assertFalse(h.indexMore(4))
+        self.assertEqual(
+            [(s.first, s.count) for s in h._segments], [(0, 2), (2, 8)])
+        h.addLine("line 10")
+        self.assertEqual(h.search("line 1", again=True), "line 1")
+        self.assertEqual(h.search("line 1", backward=False, again=True), "line 10")
+
+
+    def test_indexMoreMerges(self):
+        """
+        Verify that L{History.indexMore} merges the segments it makes, so
+        that indexing many lines a few at a time leaves only a few segments
+        to search.
+        """
+        h = History(["line %04d" % (i,) for i in range(1000)])
+        while h.indexMore(10):
+            pass
+        self.assertTrue(len(h._segments) <= 8)
+        self.assertEqual(sum([s.count for s in h._segments]), 1000)
+        self.assertEqual(h.search("line 0123"), "line 0123")
+        self.assertEqual(h.search("line 001", again=True), "line 0019")
+        self.assertEqual(
+            h.search("line 0999", backward=False), "line 0999")
+
+
+    def test_searchAddedLines(self):
+        """
+        Verify that lines added after the first search are found by later
+        ones.
+        """
+        h = self.history
+        self.assertIdentical(h.search("#divmod"), None)
+        h.addLine("/join #divmod")
+        self.assertEqual(h.search("#divmod"), "/join #divmod")
+        self.assertEqual(h.position, 1)
+
+
+    def test_searchFileHistory(self):
+        """
+        Verify that a L{FileHistory} searches the lines in its file as well as
+        those added to it.
+        """
+        path = self.mktemp()
+        h = FileHistory(path)
+        for line in self.history.allLines():
+            h.addLine(line)
+        h.close()
+        h = FileHistory(path)
+        self.addCleanup(h.close)
+        h.addLine("/join #divmod")
+        self.assertEqual(h.search("join", again=True), "/join #divmod")
+        self.assertEqual(h.search("join", again=True), "/join #twisted")
+        self.assertEqual(h.search("join", again=True), "/join #python")
+
+
+
+class BoundedHistoryTests(TestCase):
+    """
+    Tests for L{History}'s optional limit on its size and removal of repeated
+    lines.
+    """
+    def test_maxLines(self):
+        """
+        Verify that when there are more than C{maxLines} lines, the oldest are
+        discarded.
+        """
+        h = History(["a", "b", "c"], maxLines=2)
+        self.assertEqual(h.allLines(), ["b", "c"])
+        h.addLine("d")
+        self.assertEqual(h.allLines(), ["c", "d"])
+        self.assertEqual(h.previousLine(), "d")
+        self.assertEqual(h.previousLine(), "c")
+        self.assertEqual(h.previousLine(), "")
+
+
+    def test_ignoreRepeats(self):
+        """
+        Verify that with C{ignoreRepeats} a line the same as the newest one is
+        not added.
+        """
+        h = History(["a", "a", "b"], ignoreRepeats=True)
+        h.addLine("b")
+        h.addLine("a")
+        self.assertEqual(h.allLines(), ["a", "b", "a"])
+
+
+    def test_unique(self):
+        """
+        Verify that with C{unique} adding a line removes any older copy of it,
+        and that moving the position skips over the places of removed lines.
+        """
+        h = History(["a", "b", "a", "c"], unique=True)
+        self.assertEqual(h.allLines(), ["b", "a", "c"])
+        h.addLine("b")
+        self.assertEqual(h.allLines(), ["a", "c", "b"])
+        self.assertEqual(h.previousLine(), "b")
+        self.assertEqual(h.previousLine(), "c")
+        self.assertEqual(h.previousLine(), "a")
+        self.assertEqual(h.previousLine(), "")
+        self.assertEqual(h.beforeLines, [])
+        self.assertEqual(h.afterLines, ["a", "c", "b"])
+        self.assertEqual(h.nextLine(), "c")
+        self.assertEqual(h.nextLine(), "b")
+        self.assertEqual(h.nextLine(), "")
+        self.assertTrue(h.atEnd())
+
+
+    def test_uniqueWithMaxLines(self):
+        """
+        Verify that a line discarded to stay within C{maxLines} can be added
+        again with C{unique}, without the count of lines going wrong.
+        """
+        h = History(maxLines=2, unique=True)
+        for line in ["a", "b", "c", "a"]:
+            h.addLine(line)
+        self.assertEqual(h.allLines(), ["c", "a"])
+        h = History(maxLines=3, unique=True)
+        for i in range(12):
+            h.addLine(str(i % 4))
+        self.assertEqual(h.allLines(), ["1", "2", "3"])
+        self.assertEqual(h._live, 3)
+
+
+    def test_interned(self):
+        """
+        Verify that equal lines added separately are stored as one string.
+        """
+        h = History()
+        h.addLine("/join " + "#twisted")
+        h.addLine("/join #" + "twisted")
+        first, second = h.allLines()
+        self.assertIdentical(first, second)
+
+
+    def test_compaction(self):
+        """
+        Verify that when removed lines greatly outnumber the others, their
+        places are discarded, and that the position and searching are not
+        affected.
+        """
+        h = History(unique=True, maxLines=100)
+        for i in range(1000):
+            h.addLine("/join #%d" % (i % 3,))
+        self.assertTrue(len(h._lines) < 100)
+        h.addLine("hello")
+        h.previousLine()
+        for i in range(1000):
+            h.addLine("/join #%d" % (i % 3,))
+        self.assertEqual(h.nextLine(), "/join #1")
+        self.assertEqual(h.search("hello"), "hello")
+        self.assertEqual(h.allLines(), ["hello", "/join #1", "/join #2", "/join #0"])
+        self.assertTrue(len(h._lines) < 100)
+
+
+    def test_compactionKeepsIndex(self):
+        """
+        Verify that compaction numbers the lines in the search index again
+        rather than discarding it, so that later searches still use it.
+        """
+        h = History(["/join #a", "hello", "/join #b"], unique=True, maxLines=100)
+        h.indexMore()
+        for i in range(1000):
+            h.addLine("/join #%d" % (i % 3,))
+        self.assertTrue(len(h._lines) < 100)
+        self.assertEqual(h._unindexed, 0)
+        total = h._segments[-1].first + h._segments[-1].count
+        self.assertEqual(total, len(h._lines))
+        for segment in h._segments:
+            for trigram, numbers in segment.postings.iteritems():
+                for number in numbers:
+                    line = h._lines[number]
+                    self.assertTrue(line is None or trigram in line)
+        self.assertEqual(h.search("hello"), "hello")
+        self.assertEqual(h.search("#b", backward=False), "/join #b")
+        self.assertEqual(h.search("#1", backward=False), "/join #1")
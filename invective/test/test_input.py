@@ -6,9 +6,27 @@ Tests for the input widget.
 from twisted.trial.unittest import TestCase
 
 from twisted.conch.insults.insults import ServerProtocol
+from twisted.conch.insults.window import YieldFocus
+from twisted.conch.insults.helper import TerminalBuffer
 
 from invective.widgets import LineInputWidget
 from invective.history import History
+from invective.killring import KillRing
+
+
+class RecordingTerminal(TerminalBuffer):
+    """
+    A L{TerminalBuffer} which remembers the columns written to.
+    """
+    def connectionMade(self):
+        TerminalBuffer.connectionMade(self)
+        self.writtenColumns = []
+
+
+    def write(self, bytes):
+        self.writtenColumns.extend(range(self.x, self.x + len(bytes)))
+        TerminalBuffer.write(self, bytes)
+
 
 
 class InputTests(TestCase):
@@ -665,3 +683,464 @@ class InputTests(TestCase):
         self.widget.keystrokeReceived('\x0e', None)
         self.assertEqual(self.widget.buffer, s2)
         self.assertEqual(self.widget.cursor, n)
+
+
+    def test_longLineEditing(self):
+        """
+        Verify that edits in the middle of a long line change only the text
+        around the cursor.
+        """
+        s = 'x' * 50
+        self.widget.buffer = s
+        self.widget.cursor = 10
+        self.widget.keystrokeReceived('a', None)
+        self.widget.keystrokeReceived('b', None)
+        self.widget.keystrokeReceived(ServerProtocol.BACKSPACE, None)
+        self.widget.keystrokeReceived(ServerProtocol.DELETE, None)
+        self.assertEqual(self.widget.buffer, s[:10] + 'a' + s[11:])
+        self.assertEqual(self.widget.cursor, 11)
+
+
+    def test_maxWidth(self):
+        """
+        Verify that characters are not inserted once the buffer is as long as
+        the widget's maximum width.
+        """
+        self.widget.buffer = 'x' * self.maxWidth
+        self.widget.cursor = 0
+        self.widget.keystrokeReceived('a', None)
+        self.assertEqual(self.widget.buffer, 'x' * self.maxWidth)
+        self.assertEqual(self.widget.cursor, 0)
+
+
+    def test_paste(self):
+        """
+        Verify that pasted text is inserted at the cursor as one edit, with a
+        repaint requested.
+        """
+        self.widget.buffer = 'hello world'
+        self.widget.cursor = 5
+        self.widget.pasteReceived(', big')
+        self.assertEqual(self.widget.buffer, 'hello, big world')
+        self.assertEqual(self.widget.cursor, 10)
+        self.failUnless(self.painted)
+
+
+    def test_pasteLineBreaks(self):
+        """
+        Verify that line breaks in pasted text become spaces, and other control
+        characters are discarded.
+        """
+        self.widget.pasteReceived('one\r\ntwo\nthree\rfour\tfive\x07\x1b\x7f')
+        self.assertEqual(self.widget.buffer, 'one two three four five')
+        self.assertEqual(self.lines, [])
+
+
+    def test_pasteSubmitLines(self):
+        """
+        Verify that if C{submitPastedLines} is set, each line break in pasted
+        text submits the line before it, and the text after the last line
+        break is left in the buffer.
+        """
+        self.widget.submitPastedLines = True
+        self.widget.buffer = '> '
+        self.widget.cursor = 2
+        self.widget.pasteReceived('one\ntwo\nthree')
+        self.assertEqual(self.lines, ['> one', 'two'])
+        self.assertEqual(self.widget.buffer, 'three')
+        self.assertEqual(self.widget.cursor, 5)
+
+
+    def test_pasteMaxWidth(self):
+        """
+        Verify that pasted text beyond the widget's maximum width is
+        discarded.
+        """
+        self.widget.pasteReceived('x' * (self.maxWidth + 10))
+        self.assertEqual(self.widget.buffer, 'x' * self.maxWidth)
+
+
+    def test_bindKey(self):
+        """
+        Verify that a key may be bound to one of the widget's actions by name,
+        without changing the bindings of other widgets.
+        """
+        self.widget.bindKey(('\x0f', None), 'func_CTRL_k') # C-o
+        self.widget.buffer = 'hello world'
+        self.widget.cursor = 5
+        self.widget.keystrokeReceived('\x0f', None)
+        self.assertEqual(self.widget.buffer, 'hello')
+        self.assertEqual(self.widget.killRing, [' world'])
+
+        other = LineInputWidget(self.maxWidth, self.lines.append)
+        other.buffer = 'hello world'
+        other.keystrokeReceived('\x0f', None)
+        self.assertEqual(other.buffer, 'hello world')
+
+
+    def test_unbindKey(self):
+        """
+        Verify that a key which is unbound is treated like any other key with
+        no binding.
+        """
+        self.widget.unbindKey(('\x0b', None)) # C-k
+        self.widget.buffer = 'hello world'
+        self.widget.keystrokeReceived('\x0b', None)
+        self.assertEqual(self.widget.buffer, 'hello world')
+
+
+    def test_keySequence(self):
+        """
+        Verify that a sequence of keys invokes its action only once all of the
+        keys have been received, and that a key which does not continue a
+        sequence is discarded along with it.
+        """
+        calls = []
+        self.widget.bindKey([('\x18', None), ('\x0b', None)], # C-x C-k
+                            lambda widget, modifier: calls.append(widget))
+        self.widget.keystrokeReceived('\x18', None)
+        self.assertEqual(calls, [])
+        self.widget.keystrokeReceived('\x0b', None)
+        self.assertEqual(calls, [self.widget])
+
+        self.widget.keystrokeReceived('\x18', None)
+        self.widget.keystrokeReceived('a', None)
+        self.assertEqual(self.widget.buffer, '')
+        self.widget.keystrokeReceived('a', None)
+        self.assertEqual(self.widget.buffer, 'a')
+
+
+    def _renderTerminal(self):
+        terminal = RecordingTerminal()
+        terminal.width = self.maxWidth + 1
+        terminal.height = 1
+        terminal.makeConnection(None)
+        self.widget.focused = True
+        for ch in 'hello world':
+            self.widget.keystrokeReceived(ch, None)
+        self.widget.render(terminal.width, 1, terminal)
+        del terminal.writtenColumns[:]
+        return terminal
+
+
+    def test_renderChangedColumns(self):
+        """
+        Verify that after an edit, only the columns from the first changed
+        character to one past the end of the longer of the old and new text
+        are written.
+        """
+        terminal = self._renderTerminal()
+        self.widget.cursor = 5
+        self.widget.keystrokeReceived(',', None)
+        self.widget.render(terminal.width, 1, terminal)
+        self.assertEqual(terminal.writtenColumns, range(5, 13))
+        self.assertEqual(str(terminal).splitlines()[0].rstrip(), 'hello, world')
+
+
+    def test_renderDeletedColumns(self):
+        """
+        Verify that after text is deleted, the columns it occupied are
+        cleared and nothing past them is written.
+        """
+        terminal = self._renderTerminal()
+        self.widget.keystrokeReceived('\x17', None) # C-w
+        self.widget.render(terminal.width, 1, terminal)
+        self.assertEqual(terminal.writtenColumns, range(6, 12))
+        self.assertEqual(str(terminal).splitlines()[0].rstrip(), 'hello')
+
+
+    def test_renderCursorMovement(self):
+        """
+        Verify that if only the cursor moves, only the cells it moves from and
+        to are written.
+        """
+        terminal = self._renderTerminal()
+        self.widget.keystrokeReceived('\x01', None) # C-a
+        self.widget.render(terminal.width, 1, terminal)
+        self.assertEqual(sorted(terminal.writtenColumns), [0, 11])
+
+
+    def test_renderFilthy(self):
+        """
+        Verify that after the widget is made filthy the whole line is written.
+        """
+        terminal = self._renderTerminal()
+        self.widget.filthy()
+        self.widget.render(terminal.width, 1, terminal)
+        self.assertEqual(terminal.writtenColumns, range(self.maxWidth + 1))
+
+
+    def test_unchangedNoRepaint(self):
+        """
+        Verify that a keystroke which changes neither the text nor the cursor
+        does not request a repaint.
+        """
+        self.widget.keystrokeReceived('\x02', None) # C-b
+        self.assertFalse(self.painted)
+
+
+    def _searchHistory(self):
+        self.widget.setInputHistory(History(
+                ["/join #python", "hello world", "/join #twisted", "goodbye"]))
+        self.widget.keystrokeReceived('x', None)
+        self.widget.keystrokeReceived('\x12', None) # C-r
+
+
+    def test_reverseSearch(self):
+        """
+        Verify that after C-r each character typed narrows an incremental
+        search backwards through input history, putting the nearest line which
+        contains the search string in the buffer.
+        """
+        self._searchHistory()
+        for ch in 'jo':
+            self.widget.keystrokeReceived(ch, None)
+        self.assertEqual(self.widget.buffer, '/join #twisted')
+        self.assertEqual(self.widget.cursor, 1)
+        for ch in 'in #p':
+            self.widget.keystrokeReceived(ch, None)
+        self.assertEqual(self.widget.buffer, '/join #python')
+        self.failUnless(self.painted)
+
+
+    def test_searchAgain(self):
+        """
+        Verify that C-r during a search finds the next older match and C-s the
+        next newer one, and that with no search string typed they repeat the
+        previous search.
+        """
+        self._searchHistory()
+        self.widget.keystrokeReceived('o', None)
+        self.assertEqual(self.widget.buffer, 'goodbye')
+        self.widget.keystrokeReceived('\x12', None) # C-r
+        self.assertEqual(self.widget.buffer, '/join #twisted')
+        self.widget.keystrokeReceived('\x13', None) # C-s
+        self.assertEqual(self.widget.buffer, 'goodbye')
+        self.widget.keystrokeReceived('\x01', None) # C-a
+
+        self.widget.keystrokeReceived('\x12', None) # C-r
+        self.widget.keystrokeReceived('\x12', None) # C-r
+        self.assertEqual(self.widget.buffer, '/join #twisted')
+
+
+    def test_searchBackspace(self):
+        """
+        Verify that backspace during a search removes the last character of
+        the search string and returns to the line found before it was typed.
+        """
+        self._searchHistory()
+        for ch in 'hel':
+            self.widget.keystrokeReceived(ch, None)
+        self.assertEqual(self.widget.buffer, 'hello world')
+        self.widget.keystrokeReceived(ServerProtocol.BACKSPACE, None)
+        self.widget.keystrokeReceived(ServerProtocol.BACKSPACE, None)
+        self.widget.keystrokeReceived(ServerProtocol.BACKSPACE, None)
+        self.assertEqual(self.widget.buffer, 'x')
+        self.widget.keystrokeReceived('\x07', None) # C-g
+        self.assertEqual(self.widget.buffer, 'x')
+
+
+    def test_searchAbort(self):
+        """
+        Verify that C-g abandons a search, restoring the buffer and history
+        position from before it began.
+        """
+        self._searchHistory()
+        self.widget.keystrokeReceived('p', None)
+        self.widget.keystrokeReceived('\x07', None) # C-g
+        self.assertEqual(self.widget.buffer, 'x')
+        self.assertEqual(self.widget.cursor, 1)
+        self.assertTrue(self.widget.inputHistory.atEnd())
+        self.widget.keystrokeReceived('y', None)
+        self.assertEqual(self.widget.buffer, 'xy')
+
+
+    def test_searchAccept(self):
+        """
+        Verify that a key with no meaning in a search ends it, leaving the line
+        found in the buffer, and is then handled as usual.
+        """
+        self._searchHistory()
+        self.widget.keystrokeReceived('w', None)
+        self.widget.keystrokeReceived('o', None)
+        self.widget.keystrokeReceived('\x05', None) # C-e
+        self.assertEqual(self.widget.buffer, 'hello world')
+        self.assertEqual(self.widget.cursor, len('hello world'))
+        self.widget.keystrokeReceived('\x0e', None) # C-n
+        self.assertEqual(self.widget.buffer, '/join #twisted')
+        self.widget.keystrokeReceived('\r', None)
+        self.assertEqual(self.lines, ['/join #twisted'])
+
+
+    def test_searchFailing(self):
+        """
+        Verify that when no line contains the search string the buffer is left
+        alone and the prompt says the search is failing.
+        """
+        self._searchHistory()
+        for ch in 'zz':
+            self.widget.keystrokeReceived(ch, None)
+        self.assertEqual(self.widget.buffer, 'x')
+        terminal = TerminalBuffer()
+        terminal.width = self.maxWidth + 1
+        terminal.height = 1
+        terminal.makeConnection(None)
+        self.widget.render(terminal.width, 1, terminal)
+        self.assertEqual(
+            str(terminal).splitlines()[0].rstrip(),
+            "(failing reverse-i-search)`zz': x")
+
+
+    def test_killWord(self):
+        """
+        Verify that M-d kills to the end of the word under the cursor and C-w
+        kills back to the beginning of the word before it.
+        """
+        self.widget.buffer = 'one two three'
+        self.widget.cursor = 3
+        self.widget.keystrokeReceived('d', ServerProtocol.ALT)
+        self.assertEqual(self.widget.buffer, 'one three')
+        self.assertEqual(self.widget.cursor, 3)
+        self.widget.keystrokeReceived('\x06', None) # C-f
+        self.widget.keystrokeReceived('\x17', None) # C-w
+        self.assertEqual(self.widget.buffer, 'three')
+        self.assertEqual(self.widget.cursor, 0)
+        self.assertEqual(self.widget.killRing, [' two', 'one '])
+
+
+    def test_killMerge(self):
+        """
+        Verify that text killed by consecutive keystrokes is combined into one
+        entry in the kill ring, in the order it appeared in the buffer, but
+        text killed after any other keystroke is a new entry.
+        """
+        self.widget.buffer = 'one two three four'
+        self.widget.cursor = 7
+        self.widget.keystrokeReceived('d', ServerProtocol.ALT)
+        self.widget.keystrokeReceived('\x17', None) # C-w
+        self.widget.keystrokeReceived('\x17', None) # C-w
+        self.assertEqual(self.widget.killRing, ['one two three'])
+        self.widget.keystrokeReceived('\x06', None) # C-f
+        self.widget.keystrokeReceived('\x0b', None) # C-k
+        self.assertEqual(self.widget.killRing, ['one two three', 'four'])
+
+
+    def test_killWordsForward(self):
+        """
+        Verify that consecutive M-d keystrokes combine the words they kill in
+        the order they appeared in the buffer, so C-y puts them back as they
+        were.
+        """
+        self.widget.buffer = 'one two three'
+        self.widget.cursor = 0
+        self.widget.keystrokeReceived('d', ServerProtocol.ALT)
+        self.widget.keystrokeReceived('d', ServerProtocol.ALT)
+        self.assertEqual(self.widget.buffer, ' three')
+        self.assertEqual(self.widget.killRing, ['one two'])
+        self.widget.keystrokeReceived('\x19', None) # C-y
+        self.assertEqual(self.widget.buffer, 'one two three')
+
+
+    def test_sharedKillRing(self):
+        """
+        Verify that text killed in one widget can be yanked in another using
+        the same L{KillRing}.
+        """
+        ring = KillRing(capacity=5)
+        self.widget.killRing = ring
+        other = LineInputWidget(self.maxWidth, self.lines.append, ring)
+        self.widget.buffer = 'hello world'
+        self.widget.cursor = 5
+        self.widget.keystrokeReceived('\x0b', None) # C-k
+        other.keystrokeReceived('\x19', None) # C-y
+        self.assertEqual(other.buffer, ' world')
+
+
+    def test_killRingCapacity(self):
+        """
+        Verify that assigning a list to C{killRing} keeps the capacity of the
+        L{KillRing} it replaces.
+        """
+        self.widget.killRing = KillRing(capacity=2)
+        self.widget.killRing = ['one', 'two', 'three']
+        self.assertEqual(self.widget.killRing, ['two', 'three'])
+
+
+    def test_killRingList(self):
+        """
+        Verify that a list given to L{LineInputWidget} as its kill ring
+        becomes a L{KillRing} of the default capacity.
+        """
+        widget = LineInputWidget(self.maxWidth, self.lines.append, ['a', 'b'])
+        self.assertIsInstance(widget.killRing, KillRing)
+        self.assertEqual(widget.killRing, ['a', 'b'])
+        self.assertEqual(widget.killRing.capacity, KillRing().capacity)
+
+
+    def _completer(self, word, start):
+        self.completed.append((word, start))
+        return [nick for nick in ['alice', 'alison', 'bob']
+                if nick.startswith(word)]
+
+
+    def test_tabWithoutCompleter(self):
+        """
+        Verify that tab moves the focus to another widget if there is no
+        completer.
+        """
+        self.assertRaises(
+            YieldFocus, self.widget.keystrokeReceived, '\t', None)
+
+
+    def test_completeUnique(self):
+        """
+        Verify that tab replaces the word before the cursor with its only
+        completion, followed by a space.
+        """
+        self.completed = []
+        self.widget.completer = self._completer
+        self.widget.buffer = 'hi b there'
+        self.widget.cursor = 4
+        self.widget.keystrokeReceived('\t', None)
+        self.assertEqual(self.completed, [('b', 3)])
+        self.assertEqual(self.widget.buffer, 'hi bob  there')
+        self.assertEqual(self.widget.cursor, 7)
+
+
+    def test_completeCommonPrefix(self):
+        """
+        Verify that tab extends the word before the cursor to the prefix its
+        completions share, and pressing it again cycles through them.
+        """
+        self.completed = []
+        self.widget.completer = self._completer
+        self.widget.buffer = 'a'
+        self.widget.cursor = 1
+        self.widget.keystrokeReceived('\t', None)
+        self.assertEqual(self.widget.buffer, 'ali')
+        self.widget.keystrokeReceived('\t', None)
+        self.assertEqual(self.widget.buffer, 'alice')
+        self.widget.keystrokeReceived('\t', None)
+        self.assertEqual(self.widget.buffer, 'alison')
+        self.widget.keystrokeReceived('\t', None)
+        self.assertEqual(self.widget.buffer, 'alice')
+        self.assertEqual(self.widget.cursor, 5)
+        self.assertEqual(self.completed, [('a', 0)])
+
+
+    def test_completeCycle(self):
+        """
+        Verify that tab replaces a word which its completions share no more
+        of with the first of them, and that typing something else stops the
+        cycling.
+        """
+        self.completed = []
+        self.widget.completer = self._completer
+        self.widget.buffer = 'ali'
+        self.widget.cursor = 3
+        self.widget.keystrokeReceived('\t', None)
+        self.assertEqual(self.widget.buffer, 'alice')
+        self.widget.keystrokeReceived(' ', None)
+        self.widget.keystrokeReceived('\t', None)
+        self.assertEqual(self.widget.buffer, 'alice alice')
+        self.assertEqual(self.completed, [('ali', 0), ('', 6)])
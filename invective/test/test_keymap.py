@@ -0,0 +1,140 @@
+
+"""
+Tests for L{invective.keymap}.
+"""
+
+from twisted.trial.unittest import TestCase
+from twisted.conch.insults.insults import ServerProtocol
+
+from invective.keymap import Keymap, methods, methodKeymap, classKeymap
+
+
+class KeymapTests(TestCase):
+    """
+    Tests for L{Keymap}'s storage and lookup of bindings.
+    """
+    def test_lookup(self):
+        """
+        Verify that a keystroke bound with its modifier is found only with
+        that modifier, and one bound without a modifier matches any.
+        """
+        altB, home = object(), object()
+        keymap = Keymap()
+        keymap.bind(('b', ServerProtocol.ALT), altB)
+        keymap.bind(ServerProtocol.HOME, home)
+        self.assertIdentical(keymap.lookup('b', ServerProtocol.ALT), altB)
+        self.assertIdentical(keymap.lookup('b', None), None)
+        self.assertIdentical(keymap.lookup(ServerProtocol.HOME, None), home)
+        self.assertIdentical(
+            keymap.lookup(ServerProtocol.HOME, ServerProtocol.ALT), home)
+
+
+    def test_namedAction(self):
+        """
+        Verify that an action may be bound by its name in C{actions}.
+        """
+        action = lambda widget, modifier: None
+        keymap = Keymap(actions={'func_X': action})
+        keymap.bind(('\x17', None), 'func_X')
+        self.assertIdentical(keymap.lookup('\x17', None), action)
+        self.assertRaises(KeyError, keymap.bind, ('\x17', None), 'func_Y')
+
+
+    def test_sequence(self):
+        """
+        Verify that binding a sequence of keys binds the first key to a
+        L{Keymap} holding the binding for the rest.
+        """
+        action = object()
+        keymap = Keymap()
+        keymap.bind([('\x18', None), ('\x13', None)], action)
+        prefix = keymap.lookup('\x18', None)
+        self.assertIsInstance(prefix, Keymap)
+        self.assertIdentical(prefix.lookup('\x13', None), action)
+
+
+    def test_unbind(self):
+        """
+        Verify that L{Keymap.unbind} removes a binding, and ignores keys which
+        are not bound.
+        """
+        keymap = Keymap()
+        keymap.bind([('\x18', None), ('\x13', None)], object())
+        keymap.bind(('a', None), object())
+        keymap.unbind([('\x18', None), ('\x13', None)])
+        keymap.unbind(('a', None))
+        keymap.unbind([('\x19', None), ('\x13', None)])
+        self.assertIdentical(keymap.lookup('\x18', None).lookup('\x13', None), None)
+        self.assertIdentical(keymap.lookup('a', None), None)
+
+
+    def test_copy(self):
+        """
+        Verify that changing the bindings of a copy of a L{Keymap}, including
+        those of multi-key sequences, does not change the original.
+        """
+        first, second = object(), object()
+        keymap = Keymap()
+        keymap.bind([('\x18', None), ('\x13', None)], first)
+        copy = keymap.copy()
+        copy.bind([('\x18', None), ('\x13', None)], second)
+        copy.bind(('a', None), second)
+        self.assertIdentical(keymap.lookup('\x18', None).lookup('\x13', None), first)
+        self.assertIdentical(keymap.lookup('a', None), None)
+
+
+
+class Handlers(object):
+    def func_HOME(self, modifier):
+        return ('home', modifier)
+
+    def func_CTRL_a(self):
+        return 'ctrl-a'
+
+    def func_ALT_b(self):
+        return 'alt-b'
+
+    def func_UNKNOWN_c(self):
+        pass
+
+    def cmd_JOIN(self, line):
+        pass
+
+
+
+class MethodKeymapTests(TestCase):
+    """
+    Tests for building keymaps from methods.
+    """
+    def test_methods(self):
+        """
+        Verify that L{methods} finds the methods with the given prefix.
+        """
+        self.assertEqual(methods(Handlers, 'cmd_'), {'JOIN': Handlers.cmd_JOIN})
+
+
+    def test_methodKeymap(self):
+        """
+        Verify that L{methodKeymap} binds the keys named by C{func_} methods to
+        actions calling them, and ignores names it does not understand.
+        """
+        keymap = methodKeymap(Handlers)
+        widget = Handlers()
+        self.assertEqual(
+            keymap.lookup(ServerProtocol.HOME, ServerProtocol.ALT)(
+                widget, ServerProtocol.ALT),
+            ('home', ServerProtocol.ALT))
+        self.assertEqual(keymap.lookup('\x01', None)(widget, None), 'ctrl-a')
+        self.assertEqual(
+            keymap.lookup('b', ServerProtocol.ALT)(widget, ServerProtocol.ALT),
+            'alt-b')
+        self.assertEqual(len(keymap.bindings), 3)
+        self.assertEqual(
+            sorted(keymap.actions), ['func_ALT_b', 'func_CTRL_a', 'func_HOME'])
+
+
+    def test_classKeymap(self):
+        """
+        Verify that L{classKeymap} builds the keymap for a class only once.
+        """
+        self.assertIdentical(classKeymap(Handlers), classKeymap(Handlers))
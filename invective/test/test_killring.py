@@ -0,0 +1,77 @@
+
+"""
+Tests for L{invective.killring}.
+"""
+
+from twisted.trial.unittest import TestCase
+
+from invective.killring import KillRing
+
+
+class KillRingTests(TestCase):
+    """
+    Tests for L{KillRing}'s storage and rotation of killed strings.
+    """
+    def test_empty(self):
+        """
+        Verify that a new L{KillRing} is empty.
+        """
+        ring = KillRing()
+        self.assertEqual(len(ring), 0)
+        self.assertEqual(ring, [])
+        self.assertIdentical(ring.newest(), None)
+        self.assertIdentical(ring.rotate(), None)
+
+
+    def test_invalidCapacity(self):
+        """
+        Verify that a capacity less than one is rejected.
+        """
+        self.assertRaises(ValueError, KillRing, capacity=0)
+
+
+    def test_kill(self):
+        """
+        Verify that killed strings are added to the end of the ring.
+        """
+        ring = KillRing(['one'])
+        ring.kill('two')
+        self.assertEqual(ring, ['one', 'two'])
+        self.assertEqual(ring.newest(), 'two')
+        self.assertNotEqual(ring, ['two', 'one'])
+
+
+    def test_capacity(self):
+        """
+        Verify that when the ring is full, the oldest string is discarded to
+        make room for a new one.
+        """
+        ring = KillRing(['one', 'two', 'three'], capacity=2)
+        self.assertEqual(ring, ['two', 'three'])
+        ring.kill('four')
+        self.assertEqual(ring, ['three', 'four'])
+
+
+    def test_merge(self):
+        """
+        Verify that a merged kill is combined with the newest string, after it
+        or before it.
+        """
+        ring = KillRing(['one'])
+        ring.kill('two', merge=True)
+        self.assertEqual(ring, ['onetwo'])
+        ring.kill('zero', merge=True, before=True)
+        self.assertEqual(ring, ['zeroonetwo'])
+        empty = KillRing()
+        empty.kill('one', merge=True)
+        self.assertEqual(empty, ['one'])
+
+
+    def test_rotate(self):
+        """
+        Verify that rotating the ring moves the newest string to the beginning
+        and returns the new newest one.
+        """
+        ring = KillRing(['one', 'two', 'three'])
+        self.assertEqual(ring.rotate(), 'two')
+        self.assertEqual(ring, ['three', 'one', 'two'])
@@ -0,0 +1,77 @@
+
+"""
+Tests for L{invective.message}.
+"""
+
+from twisted.trial.unittest import TestCase
+
+from invective.message import (
+    Message, MESSAGE, JOINED, LEFT, NICK, TOPIC, MEMBERS, MASS_JOINED,
+    MASS_LEFT)
+
+
+class RecordingMessage(Message):
+    """
+    A L{Message} which counts the times it is formatted.
+    """
+    formatted = 0
+
+    def __str__(self):
+        self.formatted += 1
+        return Message.__str__(self)
+
+
+
+class MessageTests(TestCase):
+    """
+    Tests for L{Message}'s storage and formatting of conversation events.
+    """
+    def test_fields(self):
+        """
+        Verify that a L{Message} keeps the fields it is created with, and has
+        no room for others.
+        """
+        m = Message(12.5, 'network', '#chan', 'alice', MESSAGE, 'hi')
+        self.assertEqual(
+            (m.time, m.network, m.channel, m.sender, m.kind, m.text),
+            (12.5, 'network', '#chan', 'alice', MESSAGE, 'hi'))
+        self.assertRaises(AttributeError, setattr, m, 'extra', 1)
+
+
+    def test_formats(self):
+        """
+        Verify that each kind of L{Message} is displayed as the line the
+        conversation has always shown for it.
+        """
+        def format(sender, kind, text=None):
+            return str(Message(0, 'network', 'chan', sender, kind, text))
+        self.assertEqual(format('alice', MESSAGE, 'hi'), 'chan/alice> hi')
+        self.assertEqual(format('alice', JOINED), 'chan/alice joined')
+        self.assertEqual(format('alice', LEFT), 'chan/alice left')
+        self.assertEqual(
+            format(None, MASS_JOINED, 'alice bob'), 'chan/2 joined: alice, bob')
+        names = ' '.join(['nick%d' % (i,) for i in range(12)])
+        self.assertEqual(
+            format(None, MASS_LEFT, names),
+            'chan/12 left: ' + ', '.join(names.split()[:10]) + ' and 2 more')
+        self.assertEqual(
+            format('alice', NICK, 'alison'), 'chan/alice is now chan/alison')
+        self.assertEqual(
+            format('alice', TOPIC, 'news'),
+            'chan/alice changed the topic to news')
+        self.assertEqual(
+            format(None, MEMBERS, 'alice bob'), 'chan memebers: alice bob')
+
+
+    def test_lazy(self):
+        """
+        Verify that a L{Message} can be measured without being formatted, and
+        that it does not keep the text it is formatted as.
+        """
+        m = RecordingMessage(0, 'network', 'chan', 'alice', MESSAGE, 'hi')
+        self.assertEqual(m.size(), len('chanalicehi'))
+        self.assertTrue(m)
+        self.assertEqual(m.formatted, 0)
+        self.assertEqual(str(m), 'chan/alice> hi')
+        self.assertEqual(Message.__slots__, (
+                'time', 'network', 'channel', 'sender', 'kind', 'text'))
@@ -7,8 +7,43 @@ from StringIO import StringIO
 
 from twisted.trial.unittest import TestCase
 from twisted.conch.insults.helper import TerminalBuffer
+from twisted.conch.insults.window import BoundedTerminalWrapper
 
 from invective.widgets import OutputWidget
+from invective.scrollback import Scrollback
+from invective.message import MESSAGE
+from invective.test.test_message import RecordingMessage
+
+
+class RecordingTerminal(TerminalBuffer):
+    """
+    A L{TerminalBuffer} which remembers the row of the cursor for each write.
+    """
+    def connectionMade(self):
+        TerminalBuffer.connectionMade(self)
+        self.writtenRows = []
+
+
+    def write(self, bytes):
+        self.writtenRows.append(self.y)
+        TerminalBuffer.write(self, bytes)
+
+
+
+class ScrollingTerminal(RecordingTerminal):
+    """
+    A L{RecordingTerminal} which also records scroll region changes.  It does
+    not implement scroll regions, so the tests using it only scroll regions
+    which cover the whole terminal.
+    """
+    def connectionMade(self):
+        RecordingTerminal.connectionMade(self)
+        self.regions = []
+
+
+    def setScrollRegion(self, first=None, last=None):
+        self.regions.append((first, last))
+
 
 
 class TextOutputTests(TestCase):
@@ -87,3 +122,277 @@ class TextOutputTests(TestCase):
             self.assertEqual(L, ' ' * self.width)
         self.assertEqual(firstLine, 'very long message ' * 4 + 'very    ')
         self.assertEqual(secondLine, '  long message' + ' ' * (self.width - 14))
+
+
+    def test_incrementalRender(self):
+        """
+        Verify that rendering after more messages have been added to an
+        L{OutputWidget} which has already been rendered produces the same
+        output as rendering all of the messages from scratch.
+        """
+        message = 'very long message ' * 5
+        for i in range(30):
+            self.widget.addMessage('%d %s' % (i, message))
+            self.widget.render(self.width, self.height, self.terminal)
+        incremental = str(self.terminal)
+
+        fresh = OutputWidget()
+        for message in self.widget.messages:
+            fresh.addMessage(message)
+        fresh.render(self.width, self.height, self.terminal)
+        self.assertEqual(str(self.terminal), incremental)
+
+
+    def test_onlyNewMessagesWrapped(self):
+        """
+        Verify that when messages are added to an L{OutputWidget} after it has
+        been rendered, the next render only formats the new messages.
+        """
+        formatted = []
+        def formatMessage(message, width):
+            formatted.append(message)
+            return [message]
+        self.widget.formatMessage = formatMessage
+
+        for i in range(self.height * 2):
+            self.widget.addMessage(str(i))
+        self.widget.render(self.width, self.height, self.terminal)
+        self.assertEqual(len(formatted), self.height)
+
+        del formatted[:]
+        self.widget.addMessage('new')
+        self.widget.render(self.width, self.height, self.terminal)
+        self.assertEqual(formatted, ['new'])
+        output = str(self.terminal).splitlines()
+        self.assertEqual(output[-1].rstrip(), 'new')
+        self.assertEqual(output[0].rstrip(), str(self.height + 1))
+
+
+    def test_resizeRewrapsEverything(self):
+        """
+        Verify that rendering an L{OutputWidget} at a different size than it
+        was previously rendered at formats the visible messages again.
+        """
+        self.widget.addMessage('very long message ' * 5)
+        self.widget.render(self.width, self.height, self.terminal)
+        self.widget.render(40, self.height, self.terminal)
+        lines = self.widget.visibleLines(40, self.height)
+        self.assertEqual(len(lines), 3)
+
+
+    def _countFormatting(self):
+        """
+        Replace the widget's C{formatMessage} with a wrapper which records the
+        messages formatted and return the list it records them in.
+        """
+        formatted = []
+        formatMessage = self.widget.formatMessage
+        def recordingFormatMessage(message, width):
+            formatted.append(message)
+            return formatMessage(message, width)
+        self.widget.formatMessage = recordingFormatMessage
+        return formatted
+
+
+    def test_wrapCache(self):
+        """
+        Verify that a message which has already been wrapped at a particular
+        width is not formatted again when it is rendered at that width.
+        """
+        formatted = self._countFormatting()
+        self.widget.addMessage('Hello, world')
+        self.widget.render(self.width, self.height, self.terminal)
+        self.assertEqual(formatted, ['Hello, world'])
+        # A different height defeats the frame reuse but not the wrap cache.
+        self.widget.render(self.width, self.height - 1, self.terminal)
+        self.assertEqual(formatted, ['Hello, world'])
+
+
+    def test_wrapCacheDroppedOnResize(self):
+        """
+        Verify that the wrap cache is discarded when the L{OutputWidget} is
+        rendered at a different width.
+        """
+        formatted = self._countFormatting()
+        self.widget.addMessage('Hello, world')
+        self.widget.render(self.width, self.height, self.terminal)
+        self.widget.render(self.width - 10, self.height, self.terminal)
+        self.widget.render(self.width, self.height, self.terminal)
+        self.assertEqual(formatted, ['Hello, world'] * 3)
+        self.assertEqual(self.widget._wrapCache.keys(), ['Hello, world'])
+
+
+    def test_messageRecords(self):
+        """
+        Verify that L{Message} records are displayed as their text, and that
+        those which are never on the display are never formatted.
+        """
+        messages = [
+            RecordingMessage(0, 'network', 'chan', 'alice', MESSAGE, str(i))
+            for i in range(self.height * 2)]
+        self.widget.addMessages(messages)
+        self.widget.render(self.width, self.height, self.terminal)
+        output = str(self.terminal).splitlines()
+        self.assertEqual(output[-1].rstrip(), 'chan/alice> %d' % (
+                self.height * 2 - 1,))
+        self.assertEqual(messages[0].formatted, 0)
+        self.assertEqual(messages[-1].formatted, 1)
+
+
+    def test_boundedScrollback(self):
+        """
+        Verify that an L{OutputWidget} only retains as many messages as its
+        L{Scrollback} allows, and still renders the newest of them.
+        """
+        self.widget = OutputWidget(scrollback=Scrollback(5))
+        for i in range(20):
+            self.widget.addMessage(str(i))
+        self.assertEqual(list(self.widget.messages), ['15', '16', '17', '18', '19'])
+        self.widget.render(self.width, self.height, self.terminal)
+        output = str(self.terminal).splitlines()
+        self.assertEqual([L.rstrip() for L in output[-5:]], ['15', '16', '17', '18', '19'])
+
+
+    def test_scroll(self):
+        """
+        Verify that L{OutputWidget.scroll} moves the display back to older
+        messages and forward again, stopping at the oldest and newest.
+        """
+        self.widget.repaint = lambda: None
+        for i in range(50):
+            self.widget.addMessage(str(i))
+        self.widget.scroll(10)
+        self.assertEqual(self.widget.visibleLines(self.width, 3), ['37', '38', '39'])
+        self.widget.scroll(100)
+        self.assertEqual(self.widget.visibleLines(self.width, 3), ['0'])
+        self.widget.scroll(-100)
+        self.assertEqual(self.widget.scrolled, 0)
+        self.assertEqual(self.widget.visibleLines(self.width, 3), ['47', '48', '49'])
+
+
+    def test_scrolledDisplayStays(self):
+        """
+        Verify that messages added while an L{OutputWidget} is scrolled back do
+        not change what it displays.
+        """
+        painted = []
+        self.widget.repaint = lambda: painted.append(True)
+        for i in range(50):
+            self.widget.addMessage(str(i))
+        self.widget.scroll(10)
+        del painted[:]
+        self.widget.addMessage('new')
+        self.assertEqual(painted, [])
+        self.assertEqual(self.widget.visibleLines(self.width, 3), ['37', '38', '39'])
+
+
+    def test_onlyChangedRowsWritten(self):
+        """
+        Verify that when an L{OutputWidget} is rendered again, only the rows
+        which differ from the previous rendering are written to the terminal.
+        """
+        terminal = RecordingTerminal()
+        terminal.makeConnection(self.transport)
+        self.widget.addMessage('first')
+        self.widget.render(self.width, self.height, terminal)
+        self.assertEqual(terminal.writtenRows, range(self.height))
+
+        del terminal.writtenRows[:]
+        self.widget.addMessage('second')
+        self.widget.render(self.width, self.height, terminal)
+        self.assertEqual(terminal.writtenRows, [self.height - 2, self.height - 1])
+        output = str(terminal).splitlines()
+        self.assertEqual(output[-2].rstrip(), 'first')
+        self.assertEqual(output[-1].rstrip(), 'second')
+
+        del terminal.writtenRows[:]
+        self.widget.render(self.width, self.height, terminal)
+        self.assertEqual(terminal.writtenRows, [])
+
+
+    def test_filthyRewritesEverything(self):
+        """
+        Verify that every row is written when an L{OutputWidget} is redrawn,
+        even if nothing has changed.
+        """
+        terminal = RecordingTerminal()
+        terminal.makeConnection(self.transport)
+        self.widget.addMessage('first')
+        self.widget.draw(self.width, self.height, terminal)
+        del terminal.writtenRows[:]
+        self.widget.redraw(self.width, self.height, terminal)
+        self.assertEqual(terminal.writtenRows, range(self.height))
+
+
+    def test_scrollRegion(self):
+        """
+        Verify that when an L{OutputWidget} which is displaying the newest
+        messages is given a new message, it scrolls the terminal's scroll
+        region and writes only the new rows at the bottom.
+        """
+        terminal = ScrollingTerminal()
+        terminal.makeConnection(self.transport)
+        for i in range(self.height):
+            self.widget.addMessage(str(i))
+        self.widget.render(self.width, self.height, terminal)
+        del terminal.writtenRows[:]
+
+        self.widget.addMessage('very long message ' * 5)
+        self.widget.render(self.width, self.height, terminal)
+        self.assertEqual(terminal.regions, [(1, self.height), (None, None)])
+        self.assertEqual(terminal.writtenRows, [self.height - 2, self.height - 1])
+        output = [L.rstrip() for L in str(terminal).splitlines()]
+        self.assertEqual(output[0], '2')
+        self.assertEqual(output[-3], str(self.height - 1))
+        self.assertEqual(output[-1], '  long message')
+
+
+    def test_scrollRegionOffset(self):
+        """
+        Verify that the scroll region used by L{OutputWidget} is positioned
+        according to where the widget is on the terminal.
+        """
+        terminal = ScrollingTerminal()
+        terminal.makeConnection(self.transport)
+        wrapper = BoundedTerminalWrapper(terminal, self.width, 10, 0, 3)
+        self.widget.addMessage('first')
+        self.widget.render(self.width, 10, wrapper)
+        self.widget.addMessage('second')
+        self.widget.render(self.width, 10, wrapper)
+        self.assertEqual(terminal.regions, [(4, 13), (None, None)])
+
+
+    def test_noScrollRegionWhenScrolledBack(self):
+        """
+        Verify that an L{OutputWidget} which is scrolled back does not scroll
+        the terminal.
+        """
+        terminal = ScrollingTerminal()
+        terminal.makeConnection(self.transport)
+        for i in range(50):
+            self.widget.addMessage(str(i))
+        self.widget.scroll(1)
+        self.widget.render(self.width, self.height, terminal)
+        self.widget.scroll(-1)
+        self.widget.render(self.width, self.height, terminal)
+        self.assertEqual(terminal.regions, [])
+        output = [L.rstrip() for L in str(terminal).splitlines()]
+        self.assertEqual(output[-1], '49')
+
+
+    def test_setScrollback(self):
+        """
+        Verify that L{OutputWidget.setScrollback} makes the widget display the
+        newest messages of a different scrollback.
+        """
+        self.widget.addMessage('old')
+        self.widget.render(self.width, self.height, self.terminal)
+        self.widget.scroll(1)
+        scrollback = Scrollback()
+        scrollback.append('other')
+        self.widget.setScrollback(scrollback)
+        self.assertEqual(self.widget.scrolled, 0)
+        self.widget.render(self.width, self.height, self.terminal)
+        output = str(self.terminal).splitlines()
+        self.assertEqual(output[-1].rstrip(), 'other')
+        self.assertEqual(output[-2].strip(), '')
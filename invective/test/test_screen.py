@@ -0,0 +1,276 @@
+
+"""
+Tests for L{invective.screen}.
+"""
+
+from twisted.trial.unittest import TestCase
+from twisted.conch.insults.helper import TerminalBuffer
+from twisted.conch.insults.insults import REVERSE_VIDEO
+from twisted.conch.insults.window import cursor
+
+from invective.screen import ShadowTerminal
+
+
+class RecordingTerminal(TerminalBuffer):
+    """
+    A L{TerminalBuffer} which records calls to the methods used by
+    L{ShadowTerminal.flush}.
+    """
+    def connectionMade(self):
+        TerminalBuffer.connectionMade(self)
+        self.calls = []
+
+
+    def cursorPosition(self, column, line):
+        self.calls.append(('cursorPosition', column, line))
+        TerminalBuffer.cursorPosition(self, column, line)
+
+
+    def write(self, bytes):
+        self.calls.append(('write', bytes))
+        TerminalBuffer.write(self, bytes)
+
+
+    def selectGraphicRendition(self, *attributes):
+        self.calls.append(('selectGraphicRendition',) + attributes)
+        TerminalBuffer.selectGraphicRendition(self, *attributes)
+
+
+
+class ScrollingTerminal(RecordingTerminal):
+    """
+    A L{RecordingTerminal} which also records scrolling.  It does not
+    implement scroll regions, so tests using it only scroll regions which
+    cover the whole terminal.
+    """
+    def setScrollRegion(self, first=None, last=None):
+        self.calls.append(('setScrollRegion', first, last))
+
+
+    def index(self):
+        self.calls.append(('index',))
+        RecordingTerminal.index(self)
+
+
+
+class ShadowTerminalTests(TestCase):
+    """
+    Tests for L{ShadowTerminal}'s tracking of screen contents and its updating
+    of a real terminal.
+    """
+    width = 20
+    height = 5
+
+    def setUp(self):
+        self.screen = ShadowTerminal(self.width, self.height)
+        self.terminal = RecordingTerminal()
+        self.terminal.width = self.width
+        self.terminal.height = self.height
+        self.terminal.makeConnection(None)
+
+
+    def lines(self):
+        return [L.rstrip() for L in str(self.terminal).splitlines()]
+
+
+    def test_firstFlush(self):
+        """
+        Verify that the first flush writes every row of the screen.
+        """
+        self.screen.cursorPosition(2, 1)
+        self.screen.write('hello')
+        self.screen.flush(self.terminal)
+        self.assertEqual(self.lines(), ['', '  hello', '', '', ''])
+        self.assertEqual(
+            [call for call in self.terminal.calls if call[0] == 'cursorPosition'],
+            [('cursorPosition', 0, y) for y in range(self.height)])
+
+
+    def test_unchangedFlush(self):
+        """
+        Verify that a flush with no changes since the previous one writes
+        nothing.
+        """
+        self.screen.write('hello')
+        self.screen.flush(self.terminal)
+        del self.terminal.calls[:]
+        self.screen.cursorPosition(0, 0)
+        self.screen.write('hello')
+        self.screen.flush(self.terminal)
+        self.assertEqual(self.terminal.calls, [])
+
+
+    def test_changedCells(self):
+        """
+        Verify that only cells which have changed are written, and that the
+        cursor is positioned once for a run of changes.
+        """
+        self.screen.write('hello world')
+        self.screen.flush(self.terminal)
+        del self.terminal.calls[:]
+        self.screen.cursorPosition(0, 0)
+        self.screen.write('hello there')
+        self.screen.flush(self.terminal)
+        self.assertEqual(
+            self.terminal.calls,
+            [('cursorPosition', 6, 0), ('write', 'there')])
+        self.assertEqual(self.lines()[0], 'hello there')
+
+
+    def test_gap(self):
+        """
+        Verify that two changes separated by a few unchanged cells are written
+        as one run, but changes separated by more than C{maxGap} unchanged
+        cells are written separately.
+        """
+        self.screen.write('abcdefghijklmnop')
+        self.screen.flush(self.terminal)
+        del self.terminal.calls[:]
+        self.screen.cursorPosition(0, 0)
+        self.screen.write('Xbcdefghijklmnop')
+        self.screen.cursorPosition(3, 0)
+        self.screen.write('Y')
+        self.screen.cursorPosition(15, 0)
+        self.screen.write('Z')
+        self.screen.flush(self.terminal)
+        self.assertEqual(
+            self.terminal.calls,
+            [('cursorPosition', 0, 0), ('write', 'XbcY'),
+             ('cursorPosition', 15, 0), ('write', 'Z')])
+
+
+    def test_multibyte(self):
+        """
+        Verify that a UTF-8 encoded character occupies one cell, and that a
+        change next to it writes it whole.
+        """
+        self.screen.write('caf\xc3\xa9 au lait')
+        self.assertEqual(self.screen.x, 12)
+        self.screen.flush(self.terminal)
+        del self.terminal.calls[:]
+        self.screen.cursorPosition(2, 0)
+        self.screen.write('X\xc3\xa8')
+        self.screen.flush(self.terminal)
+        self.assertEqual(
+            self.terminal.calls,
+            [('cursorPosition', 2, 0), ('write', 'X\xc3\xa8')])
+        self.assertEqual(
+            [ch for ch, attributes in self.screen.cells[0][:5]],
+            [u'c', u'a', u'X', u'\xe8', u' '])
+
+
+    def test_clipping(self):
+        """
+        Verify that writes beyond the edges of the screen are discarded.
+        """
+        self.screen.cursorPosition(15, 0)
+        self.screen.write('0123456789')
+        self.screen.cursorPosition(0, self.height)
+        self.screen.write('off screen')
+        self.screen.flush(self.terminal)
+        self.assertEqual(self.lines(), ['               01234', '', '', '', ''])
+
+
+    def test_attributes(self):
+        """
+        Verify that cells written with graphic rendition attributes are
+        written to the real terminal with those attributes, and that the
+        attributes are reset afterwards.  The attributes saved by
+        C{saveCursor} are restored by C{restoreCursor}.
+        """
+        self.screen.flush(self.terminal)
+        del self.terminal.calls[:]
+        self.screen.write('a')
+        cursor(self.screen, 'b')
+        self.screen.write('c')
+        self.screen.flush(self.terminal)
+        self.assertEqual(
+            self.terminal.calls,
+            [('cursorPosition', 0, 0), ('write', 'a'),
+             ('selectGraphicRendition', '0', str(REVERSE_VIDEO)),
+             ('write', 'b'),
+             ('selectGraphicRendition', '0'),
+             ('write', 'c')])
+        self.assertEqual(self.screen.cells[0][1][1][1], frozenset([REVERSE_VIDEO]))
+
+
+    def test_resetAttributes(self):
+        """
+        Verify that if the last cell written has attributes, the real terminal's
+        attributes are reset at the end of the flush.
+        """
+        self.screen.flush(self.terminal)
+        del self.terminal.calls[:]
+        self.screen.selectGraphicRendition(str(REVERSE_VIDEO))
+        self.screen.write('a')
+        self.screen.flush(self.terminal)
+        self.assertEqual(self.terminal.calls[-1], ('selectGraphicRendition', '0'))
+
+
+    def test_scroll(self):
+        """
+        Verify that scrolling the screen with a scroll region and C{index}
+        scrolls the real terminal the same way, so only the new row need be
+        written.
+        """
+        terminal = ScrollingTerminal()
+        terminal.width = self.width
+        terminal.height = self.height
+        terminal.makeConnection(None)
+        for y in range(self.height):
+            self.screen.cursorPosition(0, y)
+            self.screen.write(str(y))
+        self.screen.flush(terminal)
+        del terminal.calls[:]
+
+        self.screen.setScrollRegion(1, self.height)
+        self.screen.cursorPosition(0, self.height - 1)
+        self.screen.index()
+        self.screen.setScrollRegion()
+        self.screen.cursorPosition(0, self.height - 1)
+        self.screen.write('new')
+        self.screen.flush(terminal)
+        self.assertEqual(
+            terminal.calls,
+            [('setScrollRegion', 1, self.height),
+             ('cursorPosition', 0, self.height - 1),
+             ('index',),
+             ('setScrollRegion', None, None),
+             ('cursorPosition', 0, self.height - 1),
+             ('write', 'new')])
+        self.assertEqual(
+            [L.rstrip() for L in str(terminal).splitlines()],
+            ['1', '2', '3', '4', 'new'])
+
+
+    def test_scrollWithoutScrollRegions(self):
+        """
+        Verify that if the real terminal does not support scroll regions, the
+        rows scrolled on the screen are written to it instead.
+        """
+        for y in range(self.height):
+            self.screen.cursorPosition(0, y)
+            self.screen.write(str(y))
+        self.screen.flush(self.terminal)
+        self.screen.setScrollRegion(1, self.height)
+        self.screen.cursorPosition(0, self.height - 1)
+        self.screen.index()
+        self.screen.flush(self.terminal)
+        self.assertEqual(self.lines(), ['1', '2', '3', '4', ''])
+
+
+    def test_resize(self):
+        """
+        Verify that after a resize the screen is blank and the next flush
+        writes every row.
+        """
+        self.screen.write('hello')
+        self.screen.flush(self.terminal)
+        self.screen.resize(10, 3)
+        del self.terminal.calls[:]
+        self.screen.flush(self.terminal)
+        self.assertEqual(
+            self.terminal.calls,
+            [('cursorPosition', 0, 0), ('write', ' ' * 10),
+             ('cursorPosition', 0, 1), ('write', ' ' * 10),
+             ('cursorPosition', 0, 2), ('write', ' ' * 10)])
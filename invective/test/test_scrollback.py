@@ -0,0 +1,203 @@
+
+"""
+Tests for L{invective.scrollback}.
+"""
+
+from twisted.trial.unittest import TestCase
+
+from invective.scrollback import Scrollback, SpillingScrollback
+from invective.message import Message, MESSAGE
+
+
+class ScrollbackTests(TestCase):
+    """
+    Tests for L{Scrollback}'s bounded storage of messages.
+    """
+    def test_empty(self):
+        """
+        Verify that a new L{Scrollback} contains no messages.
+        """
+        s = Scrollback()
+        self.assertEqual(len(s), 0)
+        self.assertEqual(list(s), [])
+        self.assertEqual(s.bytes, 0)
+        self.assertRaises(IndexError, s.__getitem__, 0)
+        self.assertRaises(IndexError, s.__getitem__, -1)
+
+
+    def test_invalidCapacity(self):
+        """
+        Verify that a L{Scrollback} cannot be created with room for no
+        messages.
+        """
+        self.assertRaises(ValueError, Scrollback, 0)
+
+
+    def test_append(self):
+        """
+        Verify that messages appended to a L{Scrollback} are retrievable in
+        order by iteration and by positive and negative indexes.
+        """
+        s = Scrollback()
+        s.append('a')
+        s.append('bc')
+        self.assertEqual(list(s), ['a', 'bc'])
+        self.assertEqual(len(s), 2)
+        self.assertEqual(s[0], 'a')
+        self.assertEqual(s[-1], 'bc')
+        self.assertEqual(s.bytes, 3)
+
+
+    def test_slice(self):
+        """
+        Verify that slicing a L{Scrollback} gives back a list of the selected
+        messages.
+        """
+        s = Scrollback(3)
+        s.extend(['a', 'b', 'c', 'd'])
+        self.assertEqual(s[1:], ['c', 'd'])
+        self.assertEqual(s[-2:], ['c', 'd'])
+        self.assertEqual(s[:], ['b', 'c', 'd'])
+
+
+    def test_lineLimit(self):
+        """
+        Verify that once a L{Scrollback} holds C{maxLines} messages, adding
+        another discards the oldest.
+        """
+        s = Scrollback(3)
+        s.extend(['a', 'b', 'c', 'd', 'e'])
+        self.assertEqual(list(s), ['c', 'd', 'e'])
+        self.assertEqual(s[0], 'c')
+        self.assertEqual(s[-1], 'e')
+        self.assertEqual(s.bytes, 3)
+        self.assertEqual(len(s._ring), 3)
+
+
+    def test_byteLimit(self):
+        """
+        Verify that a L{Scrollback} discards the oldest messages when the
+        total length of its messages exceeds C{maxBytes}.
+        """
+        s = Scrollback(10, 5)
+        s.extend(['ab', 'cd', 'e'])
+        self.assertEqual(list(s), ['ab', 'cd', 'e'])
+        s.append('fg')
+        self.assertEqual(list(s), ['cd', 'e', 'fg'])
+        self.assertEqual(s.bytes, 5)
+
+
+    def test_oversizedMessage(self):
+        """
+        Verify that a message larger than C{maxBytes} is retained by itself.
+        """
+        s = Scrollback(10, 5)
+        s.extend(['ab', 'cdefghi'])
+        self.assertEqual(list(s), ['cdefghi'])
+
+
+    def test_mixedLimits(self):
+        """
+        Verify that a L{Scrollback} which has discarded messages because of
+        C{maxBytes} before filling up still respects C{maxLines}.
+        """
+        s = Scrollback(3, 4)
+        s.extend(['abc', 'd', 'e', 'f', 'g', 'h'])
+        self.assertEqual(list(s), ['f', 'g', 'h'])
+        self.assertEqual(len(s._ring), 3)
+
+
+
+class SpillingScrollbackTests(TestCase):
+    """
+    Tests for L{SpillingScrollback}'s retention of discarded messages in a log
+    file.
+    """
+    def setUp(self):
+        self.path = self.mktemp()
+        self.scrollback = SpillingScrollback(self.path, 2)
+        self.addCleanup(self.scrollback.close)
+
+
+    def test_spill(self):
+        """
+        Verify that messages discarded from memory are written to the log file
+        and remain available by index.
+        """
+        s = self.scrollback
+        s.extend(['a', 'bc', 'def', 'g'])
+        self.assertEqual(len(s), 4)
+        self.assertEqual(len(s._ring), 2)
+        s._log.flush()
+        self.assertEqual(open(self.path).read(), 'abc')
+        self.assertEqual([s[i] for i in range(4)], ['a', 'bc', 'def', 'g'])
+        self.assertEqual(s[-4], 'a')
+        self.assertEqual(s[1:3], ['bc', 'def'])
+        self.assertEqual(list(s), ['a', 'bc', 'def', 'g'])
+        self.assertRaises(IndexError, s.__getitem__, 4)
+
+
+    def test_spillAfterRead(self):
+        """
+        Verify that messages spilled after the log has already been read from
+        are also retrievable.
+        """
+        s = self.scrollback
+        s.extend(['a', 'b', 'c'])
+        self.assertEqual(s[0], 'a')
+        s.extend(['d', 'e'])
+        self.assertEqual(list(s), ['a', 'b', 'c', 'd', 'e'])
+
+
+    def test_emptyMessage(self):
+        """
+        Verify that an empty message can be spilled and read back.
+        """
+        s = self.scrollback
+        s.extend(['', 'a', 'b'])
+        self.assertEqual(s[0], '')
+        self.assertEqual(list(s), ['', 'a', 'b'])
+
+
+    def test_spillRecord(self):
+        """
+        Verify that a message which is not a C{str} is written to the log as
+        the text which displays it, and is read back as that text.
+        """
+        s = self.scrollback
+        message = Message(0, 'network', 'chan', 'alice', MESSAGE, 'hi')
+        s.extend([message, 'b', 'c'])
+        self.assertEqual(s[0], 'chan/alice> hi')
+        self.assertEqual(s.bytes, 2)
+
+
+    def test_existingLog(self):
+        """
+        Verify that a L{SpillingScrollback} appends to an existing log file
+        rather than replacing it, but does not treat its contents as messages.
+        """
+        self.scrollback.extend(['a', 'b', 'c'])
+        self.scrollback.close()
+        s = SpillingScrollback(self.path, 1)
+        self.addCleanup(s.close)
+        s.extend(['x', 'y'])
+        self.assertEqual(list(s), ['x', 'y'])
+        s.close()
+        self.assertEqual(open(self.path).read(), 'ax')
+
+
+    def test_truncateLog(self):
+        """
+        Verify that a log file larger than C{maxSize} is truncated to its
+        newest C{maxSize} bytes when it is opened, and that messages spilled
+        afterwards are appended to what remains.
+        """
+        self.scrollback.extend(['a', 'b', 'c', 'd', 'e', 'f'])
+        self.scrollback.close()
+        s = SpillingScrollback(self.path, 1, maxSize=3)
+        self.addCleanup(s.close)
+        self.assertEqual(open(self.path).read(), 'bcd')
+        s.extend(['x', 'y'])
+        self.assertEqual(list(s), ['x', 'y'])
+        s.close()
+        self.assertEqual(open(self.path).read(), 'bcdx')
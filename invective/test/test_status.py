@@ -11,14 +11,19 @@ from invective.widgets import StatusWidget
 from invective import version
 
 class DummyModel(object):
-    def __init__(self, focusedChannel):
+    def __init__(self, focusedChannel, servers=''):
         self._focChan = focusedChannel
+        self._servers = servers
 
 
     def focusedChannel(self):
         return self._focChan
 
 
+    def serverStatus(self):
+        return self._servers
+
+
 
 class StatusWidgetTests(TestCase):
     """
@@ -77,6 +82,17 @@ class StatusWidgetTests(TestCase):
         self.assertEqual(str(self.terminal), expected + ' ' * (self.width - len(expected)))
 
 
+    def test_serverRendering(self):
+        """
+        Verify that the status widget displays the status of the servers in
+        its model after the channel.
+        """
+        status = StatusWidget(DummyModel('#example', 'a.example b.example(connecting)'))
+        status.render(self.width, self.height, self.terminal)
+        expected = '[%s] #example [a.example b.example(connecting)]' % (version,)
+        self.assertEqual(str(self.terminal), expected + ' ' * (self.width - len(expected)))
+
+
     def test_shortenedStatus(self):
         """
         Verify that if a new status is shorter than the previous status, the
@@ -90,3 +106,28 @@ class StatusWidgetTests(TestCase):
         status.render(self.width, self.height, self.terminal)
         expected = '[%s] %s' % (version, shortChannel)
         self.assertEqual(str(self.terminal), expected + ' ' * (self.width - len(expected)))
+
+
+    def test_unchangedStatusNotWritten(self):
+        """
+        Verify that rendering the status widget again when the status has not
+        changed writes nothing to the terminal, but that a redraw does.
+        """
+        writes = []
+        write = self.terminal.write
+        def recordingWrite(bytes):
+            writes.append(bytes)
+            write(bytes)
+        self.terminal.write = recordingWrite
+
+        model = DummyModel('#example')
+        status = StatusWidget(model)
+        status.draw(self.width, self.height, self.terminal)
+        self.assertEqual(len(writes), 1)
+        status.render(self.width, self.height, self.terminal)
+        self.assertEqual(len(writes), 1)
+        model._focChan = '#other'
+        status.render(self.width, self.height, self.terminal)
+        self.assertEqual(len(writes), 2)
+        status.redraw(self.width, self.height, self.terminal)
+        self.assertEqual(len(writes), 3)
@@ -7,11 +7,28 @@ from twisted.trial.unittest import TestCase
 from twisted.internet.error import TimeoutError
 from twisted.internet.task import Clock
 from twisted.conch.insults.window import TopWindow, VBox
+from twisted.words.im.basesupport import AbstractAccount, AbstractGroup
 from twisted.conch.insults.helper import TerminalBuffer
-from twisted.conch.insults.insults import privateModes
+from twisted.conch.insults.insults import ServerProtocol, privateModes
 
 from invective.widgets import LineInputWidget, StatusWidget, OutputWidget
-from invective.tui import createChatRootWidget, UserInterface
+from invective.scrollback import SpillingScrollback
+from invective.history import FileHistory
+from invective.tui import (
+    BRACKETED_PASTE, createChatRootWidget, RepaintScheduler, UserInterface)
+
+
+class DummyModel(object):
+    """
+    Status model with no focused channel or servers.
+    """
+    def focusedChannel(self):
+        return None
+
+
+    def serverStatus(self):
+        return ''
+
 
 
 class WidgetLayoutTests(TestCase):
@@ -54,6 +71,108 @@ class WidgetLayoutTests(TestCase):
 
 
 
+class RepaintSchedulerTests(TestCase):
+    """
+    Tests for L{RepaintScheduler}'s coalescing and rate limiting of repaints.
+    """
+    def setUp(self):
+        self.clock = Clock()
+        self.painted = []
+        self.scheduler = RepaintScheduler(self.clock, 4)
+
+
+    def paint(self):
+        self.painted.append(self.clock.seconds())
+
+
+    def test_coalesce(self):
+        """
+        Verify that many requests made before the painter is called result in
+        only one call.
+        """
+        for i in range(10):
+            self.scheduler(self.paint)
+        self.clock.advance(0)
+        self.assertEqual(self.painted, [0])
+        self.assertEqual(self.clock.calls, [])
+
+
+    def test_frameRate(self):
+        """
+        Verify that a request made less than a frame after the last paint is
+        delayed until a full frame has passed.
+        """
+        self.scheduler(self.paint)
+        self.clock.advance(0)
+        self.clock.advance(0.125)
+        self.scheduler(self.paint)
+        self.clock.advance(0.0625)
+        self.assertEqual(self.painted, [0])
+        self.clock.advance(0.0625)
+        self.assertEqual(self.painted, [0, 0.25])
+
+
+    def test_hold(self):
+        """
+        Verify that no painting happens between L{RepaintScheduler.hold} and
+        L{RepaintScheduler.release}, and that requests made in between are
+        satisfied after the release.
+        """
+        self.scheduler.hold()
+        self.scheduler(self.paint)
+        self.clock.advance(1)
+        self.assertEqual(self.painted, [])
+        self.scheduler.release()
+        self.clock.advance(0)
+        self.assertEqual(self.painted, [1])
+
+
+    def test_holdAfterScheduling(self):
+        """
+        Verify that a hold also defers a paint which was scheduled before the
+        hold began.
+        """
+        self.scheduler(self.paint)
+        self.scheduler.hold()
+        self.clock.advance(0)
+        self.assertEqual(self.painted, [])
+        self.scheduler.release()
+        self.clock.advance(0)
+        self.assertEqual(self.painted, [0])
+
+
+    def test_burstOfMessages(self):
+        """
+        Verify that adding many messages to the output area of a chat root
+        widget in one reactor iteration results in a single draw.
+        """
+        terminal = TerminalBuffer()
+        terminal.makeConnection(None)
+        draws = []
+        def painter():
+            draws.append(None)
+            root.draw(80, 24, terminal)
+        root = createChatRootWidget(
+            self.clock, 80, 24, painter, DummyModel(), lambda line: None)
+        self.clock.advance(0)
+        output = root.children[0].children[0]
+        rendered = []
+        render = output.render
+        def recordingRender(width, height, terminal):
+            rendered.append(None)
+            return render(width, height, terminal)
+        output.render = recordingRender
+
+        del draws[:]
+        for i in range(500):
+            output.addMessage('message %d' % (i,))
+        self.clock.advance(1)
+        self.assertEqual(len(draws), 1)
+        self.assertEqual(len(rendered), 1)
+        self.assertEqual(str(terminal).splitlines()[-3].rstrip(), 'message 499')
+
+
+
 class UserInterfaceTests(TestCase):
     """
     Test that the TerminalProtocol in charge of the user's terminal behaves in
@@ -104,6 +223,10 @@ class InputParsingTests(TestCase):
         return self.clock.callLater(n, f, *a, **kw)
 
 
+    def seconds(self):
+        return self.clock.seconds()
+
+
     def test_commandDispatch(self):
         """
         Verify that a line starting with C{/} and a word is dispatched to a
@@ -125,10 +248,6 @@ class InputParsingTests(TestCase):
         This is poorly factored.  IRC testing should be done elsewhere.
         Connection setup testing should be done elsewhere.
         """
-        # XXX See #2504 in Twisted tracker
-        from twisted.words.im import ircsupport
-        self.patch(ircsupport, 'reactor', self)
-
         self.protocol.cmd_SERVER('/server irc.example.org testuser')
         self.assertEqual(len(self.tcpConnections), 1)
         self.assertEqual(self.tcpConnections[0][:2], ('irc.example.org', 6667))
@@ -159,10 +278,6 @@ class InputParsingTests(TestCase):
         """
         Like L{test_serverCommand} but for a connection which fails.
         """
-        # XXX See #2504 in Twisted tracker
-        from twisted.words.im import ircsupport
-        self.patch(ircsupport, 'reactor', self)
-
         self.protocol.cmd_SERVER('/server irc.example.org testuser')
         self.assertEqual(len(self.tcpConnections), 1)
         self.assertEqual(self.tcpConnections[0][:2], ('irc.example.org', 6667))
@@ -180,3 +295,304 @@ class InputParsingTests(TestCase):
             self.assertEqual(L, ' ' * 80)
         message = '== irc.example.org failed: User timeout caused connection failure: mock.'
         self.assertEqual(report, message + ' ' * (80 - len(message)))
+
+
+    def test_serverCommandMany(self):
+        """
+        Verify that C{/server} connects to another server while already
+        connected to one, and that the most recently connected server is the
+        one commands apply to.
+        """
+        self.protocol.cmd_SERVER('/server irc.example.org testuser')
+        self.protocol.cmd_SERVER('/server irc.example.net testuser 6697')
+        self.assertEqual(
+            [connection[:2] for connection in self.tcpConnections],
+            [('irc.example.org', 6667), ('irc.example.net', 6697)])
+        for host, port, factory, timeout, bindAddress in self.tcpConnections:
+            protocol = factory.buildProtocol((host, port))
+            protocol.makeConnection(StringTransport())
+            self.clock.advance(0)
+            self.assertEqual(self.protocol.server, host)
+            self.assertIdentical(self.protocol.client, protocol)
+        self.assertEqual(
+            self.protocol.serverStatus(), 'irc.example.org irc.example.net')
+        self.clock.advance(1)
+        status = str(self.terminal).splitlines()[-2]
+        self.assertIn('[irc.example.org irc.example.net]', status)
+
+
+    def test_reconnect(self):
+        """
+        Verify that a lost server connection is reported along with when it
+        will be reconnected, and that the channels joined on it are joined
+        again then.
+        """
+        self.protocol.cmd_SERVER('/server irc.example.org testuser')
+        host, port, factory = self.tcpConnections[0][:3]
+        protocol = factory.buildProtocol((host, port))
+        protocol.makeConnection(StringTransport())
+        self.clock.advance(0)
+        self.protocol.parseInputLine('/join #example')
+        account = self.protocol.account
+        account.random = lambda: 0.5
+        protocol.connectionLost(None)
+        self.assertIdentical(self.protocol.client, None)
+        output = self.protocol.rootWidget.children[0].children[0]
+        self.assertEqual(
+            list(output.messages)[-1],
+            '== Connection to irc.example.org lost, reconnecting in 2 seconds.')
+
+        self.clock.advance(2)
+        host, port, factory = self.tcpConnections[1][:3]
+        protocol = factory.buildProtocol((host, port))
+        transport = StringTransport()
+        protocol.makeConnection(transport)
+        self.clock.advance(0)
+        self.assertIdentical(self.protocol.client, protocol)
+        protocol.lineReceived(':irc.example.org 001 testuser :Welcome')
+        self.assertIn('JOIN #example\r\n', transport.value())
+
+
+    def test_serverCommandUsage(self):
+        """
+        Verify that C{/server} without a hostname and username reports how
+        it is used.
+        """
+        self.protocol.cmd_SERVER('/server irc.example.org')
+        self.assertEqual(self.tcpConnections, [])
+        output = self.protocol.rootWidget.children[0].children[0]
+        self.assertEqual(
+            list(output.messages),
+            ['== usage: /server <hostname> <username> [<port>]'])
+
+
+    def test_pageUpAndDown(self):
+        """
+        Verify that the page up and page down keys scroll the output area back
+        and forward by half a screen of messages.
+        """
+        output = self.protocol.rootWidget.children[0].children[0]
+        for i in range(100):
+            output.addMessage(str(i))
+        self.protocol.keystrokeReceived(ServerProtocol.PGUP, None)
+        self.assertEqual(output.scrolled, 12)
+        self.protocol.keystrokeReceived(ServerProtocol.PGDN, None)
+        self.assertEqual(output.scrolled, 0)
+
+
+    def test_scrollbackPath(self):
+        """
+        Verify that if L{UserInterface.scrollbackPath} is set, the output area
+        writes old messages to a file of that name.
+        """
+        protocol = UserInterface()
+        protocol.reactor = self
+        protocol.scrollbackPath = self.mktemp()
+        protocol.makeConnection(self.terminal)
+        output = protocol.rootWidget.children[0].children[0]
+        self.addCleanup(output.messages.close)
+        self.assertIsInstance(output.messages, SpillingScrollback)
+        self.assertEqual(output.messages._log.name, protocol.scrollbackPath)
+        self.assertEqual(output.messages.maxSize, protocol.scrollbackMaxSize)
+
+
+    def test_conversationScrollbackPath(self):
+        """
+        Verify that each conversation's scrollback is written to a file named
+        after its account and group, with characters which cannot appear in a
+        file name escaped, and that the files are closed when the terminal
+        connection is lost.
+        """
+        protocol = UserInterface()
+        protocol.reactor = self
+        protocol.scrollbackPath = self.mktemp()
+        protocol.makeConnection(self.terminal)
+        account = AbstractAccount('name', False, 'user', 'pass', 'host', 6667)
+        conversation = protocol.ui.getGroupConversation(
+            AbstractGroup('a/b', account))
+        self.assertEqual(
+            conversation.messages._log.name,
+            protocol.scrollbackPath + '.name.a%2Fb')
+        output = protocol.rootWidget.children[0].children[0]
+        protocol.connectionLost(None)
+        self.assertTrue(conversation.messages._log.closed)
+        self.assertTrue(output.messages._log.closed)
+
+
+    def test_historyPath(self):
+        """
+        Verify that if L{UserInterface.historyPath} is set, the input area
+        keeps its history in a file of that name.
+        """
+        protocol = UserInterface()
+        protocol.reactor = self
+        protocol.historyPath = self.mktemp()
+        protocol.makeConnection(self.terminal)
+        history = protocol.rootWidget.children[0].children[2].inputHistory
+        self.addCleanup(history.close)
+        self.assertIsInstance(history, FileHistory)
+        self.assertEqual(history.path, protocol.historyPath)
+        self.assertEqual(history.maxSize, protocol.historyMaxSize)
+        self.assertTrue(history.ignoreRepeats)
+
+
+    def test_historyIndexed(self):
+        """
+        Verify that the lines in the history file are indexed for searching
+        once the history is first searched, and not before, a batch at a time.
+        """
+        path = self.mktemp()
+        history = FileHistory(path)
+        for i in range(1500):
+            history.addLine(str(i))
+        history.close()
+        protocol = UserInterface()
+        protocol.reactor = self
+        protocol.historyPath = path
+        protocol.makeConnection(self.terminal)
+        history = protocol.rootWidget.children[0].children[2].inputHistory
+        self.addCleanup(history.close)
+        self.clock.advance(0)
+        self.assertIdentical(history._segments, None)
+        protocol.keystrokeReceived('\x12', None) # C-r
+        self.assertEqual(
+            [(s.first, s.count) for s in history._segments],
+            [(1500 - 1024, 1024)])
+        self.clock.advance(0)
+        self.assertEqual(history._unindexed, 0)
+        self.assertEqual(
+            [(s.first, s.count) for s in history._segments],
+            [(0, 1500 - 1024), (1500 - 1024, 1024)])
+
+
+    def test_keystrokeWritesInputRow(self):
+        """
+        Verify that after the screen has been drawn, typing a character writes
+        to the terminal only on the row of the input area.
+        """
+        while self.clock.calls:
+            self.clock.advance(1)
+        rows = []
+        cursorPosition = self.terminal.cursorPosition
+        def recordingCursorPosition(column, line):
+            rows.append(line)
+            cursorPosition(column, line)
+        self.terminal.cursorPosition = recordingCursorPosition
+        self.protocol.keystrokeReceived('x', None)
+        while self.clock.calls:
+            self.clock.advance(1)
+        self.assertEqual(set(rows), set([23]))
+        self.assertEqual(str(self.terminal).splitlines()[23].strip(), 'x')
+
+
+    def test_resizeRedraws(self):
+        """
+        Verify that after the terminal is resized, the widgets whose size did
+        not change, such as the status and input areas, are drawn again.
+        """
+        self.protocol.keystrokeReceived('x', None)
+        while self.clock.calls:
+            self.clock.advance(1)
+        before = str(self.terminal).splitlines()
+        self.assertNotEqual(before[22].strip(), '')
+        self.protocol.terminalSize(self.protocol.width, self.protocol.height)
+        while self.clock.calls:
+            self.clock.advance(1)
+        after = str(self.terminal).splitlines()
+        self.assertEqual(after[22:24], before[22:24])
+        self.assertEqual(after[23].strip(), 'x')
+
+
+    def test_focusCommand(self):
+        """
+        Verify that C{/focus} makes a joined channel the focused one and
+        displays its messages.
+        """
+        account = AbstractAccount('name', False, 'user', 'pass', 'host', 6667)
+        conversation = self.protocol.ui.getGroupConversation(
+            AbstractGroup('example', account))
+        conversation.showGroupMessage('alice', 'hi')
+        self.protocol.parseInputLine('/focus #example')
+        self.assertIdentical(self.protocol.group, conversation)
+        self.assertEqual(self.protocol.focusedChannel(), 'example')
+        output = self.protocol.rootWidget.children[0].children[0]
+        self.assertEqual(map(str, output.messages), ['example/alice> hi'])
+
+
+    def test_focusCommandServer(self):
+        """
+        Verify that C{/focus} with a server chooses between channels of the
+        same name joined on different servers, and makes that server the
+        one commands apply to.
+        """
+        self.protocol.cmd_SERVER('/server irc.example.org testuser')
+        self.protocol.cmd_SERVER('/server irc.example.net testuser')
+        conversations = []
+        for name in ['irc.example.org', 'irc.example.net']:
+            account = self.protocol.connections.get(name)
+            conversations.append(self.protocol.ui.getGroupConversation(
+                account.getGroup('example')))
+        self.protocol.parseInputLine('/focus #example irc.example.org')
+        self.assertIdentical(self.protocol.group, conversations[0])
+        self.assertEqual(self.protocol.server, 'irc.example.org')
+        self.protocol.parseInputLine('/focus #example irc.example.net')
+        self.assertIdentical(self.protocol.group, conversations[1])
+        self.assertEqual(self.protocol.server, 'irc.example.net')
+
+
+    def test_focusCommandUnknownChannel(self):
+        """
+        Verify that C{/focus} with a channel which has not been joined reports
+        an error.
+        """
+        self.protocol.parseInputLine('/focus #example')
+        output = self.protocol.rootWidget.children[0].children[0]
+        self.assertEqual(list(output.messages), ['== not in #example'])
+
+
+    def test_completeWord(self):
+        """
+        Verify that the input area completes commands at the beginning of the
+        line, channels beginning with C{#}, and nicks in the focused channel.
+        """
+        input = self.protocol.rootWidget.children[0].children[2]
+        self.assertEqual(input.completer, self.protocol.completeWord)
+        account = AbstractAccount('name', False, 'user', 'pass', 'host', 6667)
+        conversation = self.protocol.ui.getGroupConversation(
+            AbstractGroup('example', account))
+        conversation.setGroupMembers(['alice', 'bob'])
+        self.assertEqual(self.protocol.completeWord('/f', 0), ['/focus'])
+        self.assertEqual(self.protocol.completeWord('/f', 3), [])
+        self.assertEqual(self.protocol.completeWord('#ex', 7), ['#example'])
+        self.assertEqual(self.protocol.completeWord('al', 0), [])
+        self.protocol.parseInputLine('/focus #example')
+        self.assertEqual(self.protocol.completeWord('al', 0), ['alice'])
+
+
+    def test_bracketedPasteEnabled(self):
+        """
+        Verify that bracketed paste mode is enabled when the connection is
+        made.
+        """
+        self.assertIn(BRACKETED_PASTE, self.terminal.privateModes)
+
+
+    def test_bracketedPaste(self):
+        """
+        Verify that the characters between the start and end of a bracketed
+        paste are given to the input area all at once, rather than as
+        keystrokes.
+        """
+        while self.clock.calls:
+            self.clock.advance(1)
+        input = self.protocol.rootWidget.children[0].children[2]
+        pasted = []
+        input.pasteReceived = pasted.append
+        self.protocol.unhandledControlSequence('\x1b[200~')
+        for ch in 'hello\rworld':
+            self.protocol.keystrokeReceived(ch, None)
+        self.protocol.keystrokeReceived(ServerProtocol.HOME, None)
+        self.protocol.unhandledControlSequence('\x1b[201~')
+        self.assertEqual(pasted, ['hello\rworld'])
+        self.protocol.keystrokeReceived('x', None)
+        self.assertEqual(input.buffer, 'x')
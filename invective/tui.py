@@ -4,6 +4,8 @@
 Create and arrange widgets to form an IRC client.
 """
 
+import os
+from urllib import quote
 from signal import signal, SIGWINCH
 from fcntl import ioctl
 from tty import TIOCGWINSZ
@@ -11,22 +13,121 @@ from struct import unpack
 
 from twisted.internet import reactor
 
-from twisted.words.im.ircsupport import IRCAccount
-
-from twisted.conch.insults.insults import TerminalProtocol, privateModes
+from twisted.conch.insults.insults import TerminalProtocol, ServerProtocol, privateModes
 from twisted.conch.insults.window import TopWindow, VBox
 
 from invective.widgets import LineInputWidget, StatusWidget, OutputWidget
+from invective.scrollback import SpillingScrollback
+from invective.history import FileHistory
+from invective.screen import ShadowTerminal
 from invective.chat import InvectiveChatUI
+from invective.keymap import methods
+from invective.completion import PrefixIndex
+from invective.connection import ConnectionManager, DISCONNECTED
+from invective.message import Message, MESSAGE
+
+class RepaintScheduler(object):
+    """
+    A L{TopWindow} scheduler which calls the painter no more often than a
+    maximum frame rate.  Any number of repaint requests made before the
+    painter is called are satisfied by that one call.
+
+    @ivar maxFPS: The greatest number of times per second the painter will be
+    called.
+
+    @ivar _pending: C{None} or the no-argument callable most recently given to
+    this scheduler which has not yet been called.
+
+    @ivar _call: C{None} or the L{IDelayedCall} which will call C{_pending}.
+
+    @ivar _lastPaint: C{None} or the time at which the painter was last
+    called.
+
+    @ivar _holds: The number of calls to L{hold} not yet matched by a call to
+    L{release}.  Nothing is painted while this is non-zero.
+    """
+    _pending = None
+    _call = None
+    _lastPaint = None
+    _holds = 0
+
+    def __init__(self, reactor, maxFPS=30):
+        self.reactor = reactor
+        self.maxFPS = maxFPS
+
+
+    def __call__(self, f):
+        """
+        Arrange for C{f} to be called at the next opportunity allowed by the
+        frame rate.
+        """
+        self._pending = f
+        if self._call is None and not self._holds:
+            self._schedule()
+
+
+    def _schedule(self):
+        delay = 0
+        if self._lastPaint is not None:
+            delay = max(0, self._lastPaint + 1.0 / self.maxFPS - self.reactor.seconds())
+        self._call = self.reactor.callLater(delay, self._paint)
+
+
+    def _paint(self):
+        self._call = None
+        if self._holds:
+            # Held since this call was scheduled; release will reschedule.
+            return
+        f = self._pending
+        self._pending = None
+        self._lastPaint = self.reactor.seconds()
+        f()
+
+
+    def hold(self):
+        """
+        Defer painting until a matching call to L{release}, for example while
+        a burst of input is being processed.
+        """
+        self._holds += 1
+
+
+    def release(self):
+        """
+        Undo one call to L{hold}, and schedule any deferred painting if there
+        are no other holds.
+        """
+        self._holds -= 1
+        if not self._holds and self._pending is not None and self._call is None:
+            self._schedule()
+
+
+
+_commandTables = {}
+
+def commandTable(cls):
+    """
+    Get a C{dict} mapping the upper-case name of each command a
+    L{UserInterface} subclass supports to the unbound C{cmd_} method which
+    implements it.  The table is built once per class.
+    """
+    table = _commandTables.get(cls)
+    if table is None:
+        table = _commandTables[cls] = methods(cls, 'cmd_')
+    return table
+
+
+
+# The DEC private mode which makes the terminal bracket pasted text with
+# ESC [ 200 ~ and ESC [ 201 ~.
+BRACKETED_PASTE = 2004
 
 # XXX TODO - Use Glade
-def createChatRootWidget(reactor, width, height, painter, statusModel, controller):
-    def _schedule(f):
-        reactor.callLater(0, f)
-    root = TopWindow(painter, _schedule)
+def createChatRootWidget(reactor, width, height, painter, statusModel, controller, scrollback=None, maxFPS=30):
+    root = TopWindow(painter, RepaintScheduler(reactor, maxFPS))
     root.reactor = reactor
     vbox = VBox()
-    vbox.addChild(OutputWidget())
+    vbox.addChild(OutputWidget(scrollback=scrollback))
     vbox.addChild(StatusWidget(statusModel))
     vbox.addChild(LineInputWidget(width, controller))
     root.addChild(vbox)
@@ -36,12 +137,59 @@ def createChatRootWidget(reactor, width, height, painter, statusModel, controlle
 class UserInterface(TerminalProtocol):
     """
     Set up an input area and an output area for a chat client.
+
+    @type scrollbackPath: C{str} or C{NoneType}
+    @ivar scrollbackPath: The name of a file to which messages too old to be
+    kept in memory are written, or C{None} to discard them instead.  Each
+    channel's messages are written to a file named by adding a dot, the name
+    of the server, another dot and the channel name to this, with any
+    character which could not appear in a file name, such as C{/}, escaped
+    as in a URL.
+
+    @ivar scrollbackMaxSize: The size in bytes to which each scrollback file
+    is truncated when it is opened larger than this.
+
+    @ivar maxFPS: The greatest number of times per second the screen will be
+    redrawn.
+
+    @ivar historyPath: C{None} or the name of a file in which input history
+    is kept from one session to the next.
+
+    @ivar historyMaxSize: The size in bytes to which the input history file
+    is compacted when it grows too large.
+
+    @type commands: L{PrefixIndex}
+    @ivar commands: The names of the commands this interface supports, with a
+    leading C{/}, for completion.
+
+    @type connections: L{ConnectionManager}
+    @ivar connections: The accounts this interface has connected to servers.
+
+    @ivar server: C{None}, or the name of the account in C{connections} to
+    which commands such as C{/join} apply.  This is the most recently
+    connected one, or the one the focused channel was joined on.
+
+    @ivar _paste: C{None}, or a C{list} of the characters received so far in
+    a bracketed paste.
+
+    @type screen: L{ShadowTerminal}
+    @ivar screen: The screen widgets are drawn on.  After each draw, the
+    changes to it are sent to C{terminal}.
+
+    @ivar _scrollbacks: The L{SpillingScrollback}s which have been created,
+    to be closed when the terminal connection is lost.
     """
     width = 80
     height = 24
+    scrollbackPath = None
+    scrollbackMaxSize = 2 ** 24
+    maxFPS = 30
+    historyPath = None
+    historyMaxSize = 2 ** 20
 
     group = None
-    client = None
+    server = None
+    _paste = None
 
     reactor = reactor
 
@@ -49,17 +197,92 @@ class UserInterface(TerminalProtocol):
         super(UserInterface, self).connectionMade()
         self.terminal.eraseDisplay()
         self.terminal.resetPrivateModes([privateModes.CURSOR_MODE])
+        self.terminal.setPrivateModes([BRACKETED_PASTE])
+        self.screen = ShadowTerminal(self.width, self.height)
+        scrollback = createScrollback = None
+        self._scrollbacks = []
+        if self.scrollbackPath is not None:
+            scrollback = SpillingScrollback(
+                self.scrollbackPath, maxSize=self.scrollbackMaxSize)
+            self._scrollbacks.append(scrollback)
+            def createScrollback(name):
+                scrollback = SpillingScrollback('%s.%s' % (
+                        self.scrollbackPath, quote(name, safe='#.')),
+                    maxSize=self.scrollbackMaxSize)
+                self._scrollbacks.append(scrollback)
+                return scrollback
         self.rootWidget = createChatRootWidget(
             self.reactor,
             self.width - 2, self.height,
-            self._painter, self, self.parseInputLine)
+            self._painter, self, self.parseInputLine, scrollback, self.maxFPS)
+
+        input = self.rootWidget.children[0].children[2]
+        input.completer = self.completeWord
+        self.commands = PrefixIndex([
+            '/' + name.lower() for name in commandTable(type(self))])
+
+        if self.historyPath is not None:
+            history = FileHistory(
+                self.historyPath, self.historyMaxSize, ignoreRepeats=True)
+            input.setInputHistory(history)
+            input.searchStarted = self._searchStarted
 
         # XXX rootWidget obviously needs a richer interface
-        self.ui = InvectiveChatUI(self.rootWidget.children[0].children[0])
+        self.ui = InvectiveChatUI(
+            self.rootWidget.children[0].children[0], createScrollback,
+            self.reactor)
+        self.connections = ConnectionManager(self.ui, self.reactor)
+        self.connections.statusChanged = self._connectionStatusChanged
+
+
+    def connectionLost(self, reason):
+        """
+        Close the scrollback files.
+        """
+        for scrollback in self._scrollbacks:
+            scrollback.close()
+        self._scrollbacks = []
+        super(UserInterface, self).connectionLost(reason)
+
+
+    def _searchStarted(self):
+        """
+        Begin indexing the lines in the history file the first time it is
+        searched, rather than reading the whole file at startup.  Lines not
+        yet indexed are scanned by the search instead.
+        """
+        input = self.rootWidget.children[0].children[2]
+        input.searchStarted = None
+        self._indexHistory(input.inputHistory)
+
+
+    def _indexHistory(self, history):
+        """
+        Index the lines in the history file for searching, a few at a time so
+        that input is not held up.
+        """
+        if history.indexMore(1024):
+            self.reactor.callLater(0, self._indexHistory, history)
 
 
     def _painter(self):
-        self.rootWidget.draw(self.width, self.height, self.terminal)
+        self.rootWidget.draw(self.width, self.height, self.screen)
+        self.screen.flush(self.terminal)
+
+
+    def completeWord(self, word, start):
+        """
+        Find the completions of a word typed in the input area: a command if
+        it begins the line with C{/}, a channel if it begins with C{#}, and
+        otherwise a nick in the focused channel.
+        """
+        if start == 0 and word[:1] == '/':
+            return self.commands.complete(word)
+        elif word[:1] == '#':
+            return self.ui.channels.complete(word)
+        elif self.group is not None:
+            return self.group.nicks.complete(word)
+        return []
 
 
     def statusChanged(self):
@@ -70,69 +293,146 @@ class UserInterface(TerminalProtocol):
         return self.rootWidget.children[0].children[0].addMessage(msg)
 
 
-    def newServerConnection(self, host, username):
-        account = IRCAccount(
-            "IRC",
-            True,
-            username,
-            "",
-            host,
-            6667,
-            "")
-        def cbLogOn(client):
-            self.client = client
-            self.addOutputMessage("== Connection to %s established." % (host,))
+    def _connectionStatusChanged(self, account):
+        if account.reconnectCall is not None and account.status == DISCONNECTED:
+            self.addOutputMessage(
+                "== Connection to %s lost, reconnecting in %d seconds." % (
+                    account.accountName,
+                    account.reconnectCall.getTime() - self.reactor.seconds()))
+        self.statusChanged()
+
+
+    def _getAccount(self):
+        if self.server is not None:
+            return self.connections.get(self.server)
+        return None
+
+    account = property(
+        _getAccount, doc="""
+        C{None}, or the account named by C{server}.
+        """)
+
+
+    def _getClient(self):
+        account = self.account
+        if account is not None:
+            return account.client
+        return None
+
+    client = property(
+        _getClient, doc="""
+        C{None}, or the IRC client connected for the account named by
+        C{server}.
+        """)
+
+
+    def newServerConnection(self, host, username, port=6667):
+        """
+        Connect to a server, in addition to any others already connected, and
+        make it the one commands apply to once it has logged on.
+        """
+        def cbLogOn(account):
+            self.server = account.accountName
+            self.addOutputMessage("== Connection to %s established." % (account.accountName,))
+            self.statusChanged()
         def ebLogOn(err):
             self.addOutputMessage("== %s failed: %s" % (host, err.getErrorMessage()))
-        account.logOn(self.ui).addCallbacks(cbLogOn, ebLogOn)
+            self.statusChanged()
+        self.connections.connect(host, username, port).addCallbacks(cbLogOn, ebLogOn)
 
 
     def cmd_JOIN(self, line):
-        if self.client is None:
+        """
+        Join a channel on the current server, now and whenever the server is
+        reconnected to.
+        """
+        account = self.account
+        if account is None:
             self.addOutputMessage('== no server')
         else:
-            channel = line.split()[1][1:]
-            self.client.joinGroup(channel)
-            self.group = self.client.getGroupConversation(channel)
+            channel = line.split()[1][1:].lower()
+            account.joinGroup(channel)
+            self.group = self.ui.getGroupConversation(account.getGroup(channel))
+            self.ui.focus(self.group)
             self.statusChanged()
 
 
     def cmd_PART(self, line):
-        if self.client is None:
+        account = self.account
+        if account is None:
             self.addOutputMessage('== no server')
         else:
-            channel = line.split()[1][1:]
-            self.client.leaveGroup(channel)
+            channel = line.split()[1][1:].lower()
+            account.leaveGroup(channel)
             self.group = None
+            self.ui.focus(None)
             self.statusChanged()
 
 
+    def cmd_FOCUS(self, line):
+        """
+        Display a channel which has already been joined, and make the server
+        it was joined on the one commands apply to.
+
+        @type line: C{str}
+        @param line: A string of the form '/focus #<channel>' or
+        '/focus #<channel> <server>', where the server is needed only if the
+        channel has been joined on more than one.
+        """
+        words = line.split()
+        channel = words[1][1:].lower()
+        server = words[2:3]
+        for conversation in self.ui.groupConversations.values():
+            account = conversation.group.account
+            if (conversation.group.name == channel
+                and server in ([], [account.accountName])):
+                self.group = conversation
+                if self.connections.get(account.accountName) is account:
+                    self.server = account.accountName
+                self.ui.focus(conversation)
+                self.statusChanged()
+                return
+        self.addOutputMessage('== not in %s' % (line.split()[1],))
+
+
     def cmd_QUIT(self, line):
+        self.terminal.resetPrivateModes([BRACKETED_PASTE])
         self.terminal.setPrivateModes([privateModes.CURSOR_MODE])
         self.terminal.loseConnection()
 
 
     def cmd_SERVER(self, line):
         """
-        Establish a new connection to a server.
+        Establish a new connection to a server, keeping any others.
 
         @type line: C{str}
-        @param line: A string of the form '/server <server hostname> <username>'.
+        @param line: A string of the form
+        '/server <server hostname> <username> [<port>]'.
         """
-        if self.client is not None:
-            self.addOutputMessage('== already connected')
-        else:
-            hostname, username = line.split()[1:]
+        words = line.split()[1:]
+        if len(words) == 3 and words[2].isdigit():
+            hostname, username, port = words
+            self.newServerConnection(hostname, username, int(port))
+        elif len(words) == 2:
+            hostname, username = words
             self.newServerConnection(hostname, username)
+        else:
+            self.addOutputMessage('== usage: /server <hostname> <username> [<port>]')
 
 
     def parseInputLine(self, line):
         if line[:1] == '/':
-            special = getattr(self, 'cmd_' + line[1:].split()[0].upper(), None)
-            if special is not None:
-                special(line)
+            name = line[1:].split()[0].upper()
+            table = commandTable(type(self))
+            if name in table:
+                table[name](self, line)
             else:
-                self.addOutputMessage('== no such command')
+                # Commands may also be added to a single instance.
+                special = getattr(self, 'cmd_' + name, None)
+                if special is not None:
+                    special(line)
+                else:
+                    self.addOutputMessage('== no such command')
         else:
             if self.group is None:
                 self.addOutputMessage('== no channel')
@@ -141,13 +441,56 @@ class UserInterface(TerminalProtocol):
                 self.group.showGroupMessage(self.group.group.account.username, line, {})
 
 
+    def scrollOutput(self, pages):
+        """
+        Scroll the output area back by the given number of half-screens of
+        messages, or forward if C{pages} is negative.
+        """
+        self.rootWidget.children[0].children[0].scroll(pages * max(1, self.height // 2))
+
+
+    def unhandledControlSequence(self, seq):
+        """
+        Recognize the beginning and end of a bracketed paste.  The pasted text
+        is collected and given to the input area all at once.
+        """
+        if seq == '\x1b[200~':
+            self._paste = []
+        elif seq == '\x1b[201~' and self._paste is not None:
+            text = ''.join(self._paste)
+            self._paste = None
+            scheduler = self.rootWidget.scheduler
+            scheduler.hold()
+            try:
+                self.rootWidget.children[0].children[2].pasteReceived(text)
+            finally:
+                scheduler.release()
+
+
     def keystrokeReceived(self, keyID, modifier):
-        self.rootWidget.keystrokeReceived(keyID, modifier)
+        if self._paste is not None:
+            if isinstance(keyID, str):
+                self._paste.append(keyID)
+            return
+        scheduler = self.rootWidget.scheduler
+        scheduler.hold()
+        try:
+            if keyID == ServerProtocol.PGUP:
+                self.scrollOutput(1)
+            elif keyID == ServerProtocol.PGDN:
+                self.scrollOutput(-1)
+            else:
+                self.rootWidget.keystrokeReceived(keyID, modifier)
+        finally:
+            scheduler.release()
 
 
     def terminalSize(self, width, height):
         self.width = width
         self.height = height
+        self.screen.resize(width, height)
+        # The screen is blank now, so every widget must be drawn again.
+        self.rootWidget.filthy()
         self._painter()
 
 
@@ -158,9 +501,18 @@ class UserInterface(TerminalProtocol):
         return None
 
 
+    def serverStatus(self):
+        """
+        Describe the server connections for the status area.
+        """
+        return self.connections.summary()
+
+
     # IChatObserver
     def messageReceived(self, user, channel, message):
-        self.addOutputMessage('[%s] <%s> %s' % (channel, user, message))
+        self.addOutputMessage(Message(
+                self.reactor.seconds(), self.server, channel, user, MESSAGE,
+                message))
 
 
     def channelJoined(self, channel):
@@ -184,6 +536,9 @@ class UserInterface(TerminalProtocol):
 
 
 class CommandLineUserInterface(UserInterface):
+    historyPath = os.path.expanduser('~/.invective_history')
+    scrollbackPath = os.path.expanduser('~/.invective_scrollback')
+
     def connectionMade(self):
         signal(SIGWINCH, self.windowChanged)
         winSize = self.getWindowSize()
@@ -193,6 +548,7 @@ class CommandLineUserInterface(UserInterface):
 
 
     def connectionLost(self, reason):
+        super(CommandLineUserInterface, self).connectionLost(reason)
         reactor.stop()
 
 
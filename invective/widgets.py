@@ -7,10 +7,48 @@ Insults Widgets used by the Invective user-interface.
 from textwrap import wrap
 
 from twisted.conch.insults.insults import ServerProtocol
-from twisted.conch.insults.window import YieldFocus, Widget, TextInput, TextOutput
+from twisted.conch.insults.window import (
+    YieldFocus, Widget, TextInput, TextOutput, BoundedTerminalWrapper, cursor)
 
 from invective import version
 from invective.history import History
+from invective.editbuffer import EditBuffer
+from invective.keymap import Keymap, classKeymap
+from invective.killring import KillRing
+from invective.completion import commonPrefix
+from invective.scrollback import Scrollback
+
+
+def scrollRegion(terminal, height, n):
+    """
+    Scroll the top C{height} rows of C{terminal} up by C{n} rows, using the
+    terminal's scroll region so the rows which remain on the display need not
+    be written again.  The rows scrolled in at the bottom are left blank.
+
+    @param terminal: The terminal a widget is drawing on, possibly a
+        L{BoundedTerminalWrapper} around the real terminal.
+
+    @return: C{True} if the rows were scrolled, C{False} if the terminal does
+        not support scroll regions or the area does not start at the left
+        edge of the terminal.
+    """
+    top = 0
+    while isinstance(terminal, BoundedTerminalWrapper):
+        if terminal.xoff:
+            return False
+        top += terminal.yoff
+        terminal = terminal.terminal
+    setScrollRegion = getattr(terminal, 'setScrollRegion', None)
+    if setScrollRegion is None:
+        return False
+    # DECSTBM rows are one-based.
+    setScrollRegion(top + 1, top + height)
+    terminal.cursorPosition(0, top + height - 1)
+    for i in xrange(n):
+        terminal.index()
+    setScrollRegion()
+    return True
+
 
 
 class LineInputWidget(TextInput):
@@ -20,24 +58,127 @@ class LineInputWidget(TextInput):
     @ivar previousKeystroke: A reference to the most recently received
     keystroke, updated after each keystroke is processed.
 
-    @ivar killRing: A list of killed strings, in order of oldest to newest.
+    @type killRing: L{KillRing}
+    @ivar killRing: The killed strings, in order of oldest to newest.  It may
+    be shared with other widgets.  Assigning a C{list} to this attribute
+    replaces it with a new L{KillRing} of the same capacity holding those
+    strings.
+
+    @ivar _killed: C{True} if the keystroke being handled killed some text.
+
+    @ivar _merging: C{True} if the previous keystroke killed some text, so
+    text killed by this one is combined with it.
 
     @type savedBuffer: C{NoneType} or C{str}
     @ivar savedBuffer: The string in the edit buffer at the time a history
     traversal command was first invoked, or C{None} if the history is not
     currently being traversed.
+
+    @type submitPastedLines: C{bool}
+    @ivar submitPastedLines: If C{True}, each line break in pasted text submits
+    the line before it, as though enter had been pressed there.  If C{False},
+    line breaks in pasted text are inserted as spaces.
+
+    @type keymap: L{Keymap}
+    @ivar keymap: The bindings of keystrokes to the actions they invoke.  It
+    starts as the keymap shared by every instance of the class, built from its
+    C{func_} methods, and is copied the first time L{bindKey} or L{unbindKey}
+    is called.
+
+    @ivar _search: C{None} if no incremental history search is in progress.
+    Otherwise, a C{list} with a tuple for the search string as it was after
+    each character typed, so that backspace can return to the previous one.
+    Each tuple holds the search string, the history position, whether a line
+    containing the search string was found, and the buffer and cursor.
+
+    @ivar _searchBackward: C{True} if the search in progress is through older
+    lines, C{False} if newer.
+
+    @ivar _lastSearch: The search string of the most recent incremental search,
+    repeated if C-r or C-s is pressed again before anything else is typed.
+
+    @ivar completer: C{None}, or a callable which is called by tab with the
+    part of the word before the cursor and the position at which the word
+    begins, and returns a C{list} of the words it could be completed to.  If
+    C{None}, tab moves the focus to the next widget instead.
+
+    @ivar searchStarted: C{None}, or a callable which is called with no
+    arguments when an incremental search of the input history begins.
+
+    @ivar _completion: C{None}, or a tuple of the position at which the word
+    being completed begins, the words it could be completed to, and the index
+    of the one in the buffer, so that pressing tab again can replace it with
+    the next one.
+
+    @ivar _chord: C{None}, or the L{Keymap} holding the bindings for the
+    remainder of a multi-key sequence which has been partially typed.
+
+    @type buffer: C{str}
+    @ivar buffer: The text being edited.  It is stored in an L{EditBuffer} so
+    that edits near the cursor do not copy the whole line; assigning to this
+    attribute replaces the contents of the L{EditBuffer}.
+
+    @ivar _rendered: C{None} if what the terminal displays is not known, or a
+    tuple of the width, focus, cursor position and length of the text with
+    which the input line was last rendered.  The text displayed then is the
+    text in the L{EditBuffer} apart from the changes it has recorded since.
     """
 
     previousKeystroke = None
     savedBuffer = None
-
-    def __init__(self, maxWidth, onSubmit):
+    submitPastedLines = False
+    _chord = None
+    _rendered = None
+    _search = None
+    _searchBackward = True
+    _lastSearch = ''
+    _killed = False
+    _merging = False
+    completer = None
+    searchStarted = None
+    _completion = None
+
+    def __init__(self, maxWidth, onSubmit, killRing=None):
+        """
+        @param killRing: The L{KillRing} to use, or C{None} to create a new
+            one.
+        """
+        if killRing is None:
+            killRing = KillRing()
+        self._edit = EditBuffer()
         self._realSubmit = onSubmit
-        self.killRing = []
+        self.killRing = killRing
+        self.keymap = classKeymap(type(self))
         self.setInputHistory(History())
         super(LineInputWidget, self).__init__(maxWidth, self._onSubmit)
 
 
+    def _getBuffer(self):
+        return str(self._edit)
+
+
+    def _setBuffer(self, text):
+        self._edit.replace(0, len(self._edit), text)
+
+    buffer = property(_getBuffer, _setBuffer)
+
+
+    def _getKillRing(self):
+        return self._killRing
+
+
+    def _setKillRing(self, killRing):
+        if not isinstance(killRing, KillRing):
+            existing = getattr(self, '_killRing', None)
+            if existing is None:
+                killRing = KillRing(killRing)
+            else:
+                killRing = KillRing(killRing, existing.capacity)
+        self._killRing = killRing
+
+    killRing = property(_getKillRing, _setKillRing)
+
+
     def setInputHistory(self, history):
         """
         Set the complete input history to the given history object.
@@ -52,6 +193,30 @@ class LineInputWidget(TextInput):
         return self.inputHistory.allLines()
 
 
+    def bindKey(self, keys, action):
+        """
+        Change the action a key, or a sequence of keys, invokes in this widget.
+
+        @param keys: A key, or a C{list} of keys, as accepted by
+        L{Keymap.bind}.
+
+        @param action: A callable taking this widget and a modifier, or the
+        name of one of this widget's C{func_} methods.
+        """
+        if self.keymap is classKeymap(type(self)):
+            self.keymap = self.keymap.copy()
+        self.keymap.bind(keys, action)
+
+
+    def unbindKey(self, keys):
+        """
+        Make a key, or a sequence of keys, invoke nothing in this widget.
+        """
+        if self.keymap is classKeymap(type(self)):
+            self.keymap = self.keymap.copy()
+        self.keymap.unbind(keys)
+
+
     def _onSubmit(self, line):
         """
         Clear the current buffer and call the submit handler specified when
@@ -115,9 +280,10 @@ class LineInputWidget(TextInput):
         Words are considered non-whitespace characters delimited by whitespace
         characters.
         """
-        while self.cursor > 0 and self.buffer[self.cursor - 1].isspace():
+        buffer = self.buffer
+        while self.cursor > 0 and buffer[self.cursor - 1].isspace():
             self.cursor -= 1
-        while self.cursor > 0 and not self.buffer[self.cursor - 1].isspace():
+        while self.cursor > 0 and not buffer[self.cursor - 1].isspace():
             self.cursor -= 1
 
 
@@ -128,22 +294,54 @@ class LineInputWidget(TextInput):
         are considered non-whitespace characters delimited by whitespace
         characters.
         """
-        n = len(self.buffer)
-        while self.cursor < n and self.buffer[self.cursor].isspace():
+        buffer = self.buffer
+        n = len(buffer)
+        while self.cursor < n and buffer[self.cursor].isspace():
             self.cursor += 1
-        while self.cursor < n and not self.buffer[self.cursor].isspace():
+        while self.cursor < n and not buffer[self.cursor].isspace():
             self.cursor += 1
 
 
+    def _kill(self, start, stop, before=False):
+        """
+        Remove the text between two positions and add it to the kill ring,
+        leaving the cursor at C{start}.  If the previous keystroke also killed
+        text, the two are combined into one string in the kill ring, with
+        this text first if C{before} is C{True}, as when killing backwards.
+        """
+        killed = self._edit.delete(start, stop - start)
+        if killed:
+            self.killRing.kill(killed, merge=self._merging, before=before)
+            self._killed = True
+        self.cursor = start
+
+
     def func_CTRL_k(self):
         """
         Handle C-k by truncating the line from the character beneath the cursor
         and adding the removed text to the kill ring.
         """
-        chopped = self.buffer[self.cursor:]
-        self.buffer = self.buffer[:self.cursor]
-        if chopped:
-            self.killRing.append(chopped)
+        self._kill(self.cursor, len(self._edit))
+
+
+    def func_ALT_d(self):
+        """
+        Handle M-d by killing from the cursor to the end of the word under it,
+        as M-f would move the cursor.
+        """
+        start = self.cursor
+        self.func_ALT_f()
+        self._kill(start, self.cursor)
+
+
+    def func_CTRL_w(self):
+        """
+        Handle C-w by killing from the cursor back to the beginning of the word
+        before it, as M-b would move the cursor.
+        """
+        stop = self.cursor
+        self.func_ALT_b()
+        self._kill(self.cursor, stop, before=True)
 
 
     def func_CTRL_y(self):
@@ -151,9 +349,9 @@ class LineInputWidget(TextInput):
         Handle C-y by inserting an element from the kill ring at the current
         cursor position, moving the cursor to the end of the inserted text.
         """
-        if self.killRing:
-            insert = self.killRing[-1]
-            self.buffer = self.buffer[:self.cursor] + insert + self.buffer[self.cursor:]
+        insert = self.killRing.newest()
+        if insert is not None:
+            self._edit.insert(self.cursor, insert)
             self.cursor += len(insert)
 
 
@@ -162,13 +360,13 @@ class LineInputWidget(TextInput):
         Handle M-y by cycling the kill ring and replacing the previously yanked
         text with the new final element in the ring.
         """
-        if self.previousKeystroke in (('\x19', None), ('y', ServerProtocol.ALT)): # C-y and M-y
-            previous = self.killRing.pop()
-            self.killRing.insert(0, previous)
-            next = self.killRing[-1]
+        if (self.previousKeystroke in (('\x19', None), ('y', ServerProtocol.ALT)) # C-y and M-y
+            and self.killRing):
+            previous = self.killRing.newest()
+            next = self.killRing.rotate()
 
             self.cursor -= len(previous)
-            self.buffer = self.buffer[:self.cursor] + next + self.buffer[self.cursor + len(previous):]
+            self._edit.replace(self.cursor, len(previous), next)
             self.cursor += len(next)
 
 
@@ -177,7 +375,7 @@ class LineInputWidget(TextInput):
         Handle C-p to swap the current input buffer with the previous line from
         input history.
         """
-        if not self.inputHistory.afterLines:
+        if self.inputHistory.atEnd():
             # Going from normal editing to history traversal - save the edit
             # buffer.
             self.savedBuffer = self.buffer
@@ -200,51 +398,321 @@ class LineInputWidget(TextInput):
                 self.savedBuffer = None
 
 
+    def func_CTRL_r(self):
+        """
+        Handle C-r by beginning an incremental search backwards through input
+        history.
+        """
+        self._startSearch(True)
+
+
+    def func_CTRL_s(self):
+        """
+        Handle C-s by beginning an incremental search forwards through input
+        history.
+        """
+        self._startSearch(False)
+
+
+    def _startSearch(self, backward):
+        if self.searchStarted is not None:
+            self.searchStarted()
+        if self.inputHistory.atEnd():
+            self.savedBuffer = self.buffer
+        self._searchBackward = backward
+        self._search = [
+            ('', self.inputHistory.position, True, self.buffer, self.cursor)]
+        self.repaint()
+
+
+    def _searchFor(self, query, again):
+        """
+        Find the next line of history containing C{query} and put it in the
+        buffer, recording the result as the latest state of the search.
+        """
+        history = self.inputHistory
+        line = history.search(query, self._searchBackward, again)
+        if line is not None:
+            self.buffer = line
+            self.cursor = line.find(query)
+        self._search.append(
+            (query, history.position, line is not None, self.buffer, self.cursor))
+        self.repaint()
+
+
+    def _searchKeystroke(self, keyID, modifier):
+        """
+        Handle a keystroke during an incremental search.  Characters are added
+        to the search string, and backspace removes them.  C-r and C-s find
+        the next match, C-g abandons the search, and any other key ends the
+        search, leaving the line found in the buffer.
+
+        @return: C{True} if the keystroke was handled, C{False} if it ended the
+        search and should be handled as usual.
+        """
+        query = self._search[-1][0]
+        if modifier is None and keyID in ('\x12', '\x13'): # C-r and C-s
+            self._searchBackward = keyID == '\x12'
+            if query:
+                self._searchFor(query, True)
+            elif self._lastSearch:
+                self._searchFor(self._lastSearch, True)
+        elif modifier is None and keyID == '\x07': # C-g
+            (query, position, found, buffer, cursor) = self._search[0]
+            self._search = None
+            self.inputHistory.position = position
+            self.buffer = buffer
+            self.cursor = cursor
+            self.repaint()
+        elif keyID == ServerProtocol.BACKSPACE:
+            if len(self._search) > 1:
+                self._search.pop()
+                (query, position, found, buffer, cursor) = self._search[-1]
+                self.inputHistory.position = position
+                self.buffer = buffer
+                self.cursor = cursor
+                self.repaint()
+        elif modifier is None and isinstance(keyID, str) and keyID >= ' ':
+            self._searchFor(query + keyID, False)
+        else:
+            if query:
+                self._lastSearch = query
+            self._search = None
+            self.repaint()
+            return False
+        return True
+
+
+    def _complete(self, start, text):
+        self._edit.replace(start, self.cursor - start, text)
+        self.cursor = start + len(text)
+
+
+    def tabReceived(self, modifier):
+        """
+        Handle tab by completing the word before the cursor with C{completer}.
+
+        If there is only one completion, it replaces the word, followed by a
+        space.  Otherwise the word is extended to the prefix the completions
+        have in common, and if that adds nothing, replaced by the first of
+        them.  Pressing tab again replaces it with each of the others in turn.
+        """
+        if self.completer is None:
+            return super(LineInputWidget, self).tabReceived(modifier)
+        if (self._completion is not None and self.previousKeystroke is not None
+            and self.previousKeystroke[0] == '\t'):
+            start, words, index = self._completion
+            index = (index + 1) % len(words)
+            self._completion = (start, words, index)
+            self._complete(start, words[index])
+            return
+        self._completion = None
+        buffer = self.buffer
+        start = self.cursor
+        while start > 0 and not buffer[start - 1].isspace():
+            start -= 1
+        word = buffer[start:self.cursor]
+        words = self.completer(word, start)
+        if len(words) == 1:
+            self._complete(start, words[0] + ' ')
+        elif words:
+            prefix = commonPrefix(words)
+            if len(prefix) > len(word):
+                self._completion = (start, words, -1)
+                self._complete(start, prefix)
+            else:
+                self._completion = (start, words, 0)
+                self._complete(start, words[0])
+
+
     def func_DELETE(self, modifier):
         """
         Handle delete to remove the character beneath the cursor.
         """
-        self.buffer = self.buffer[:self.cursor] + self.buffer[self.cursor + 1:]
+        self._edit.delete(self.cursor)
+
+
+    def backspaceReceived(self):
+        """
+        Handle backspace to remove the character before the cursor.
+        """
+        if self.cursor > 0:
+            self.cursor -= 1
+            self._edit.delete(self.cursor)
+
+
+    def _insertPasted(self, text):
+        text = text.replace('\t', ' ')
+        text = ''.join([ch for ch in text if ch >= ' ' and ch != '\x7f'])
+        text = text[:max(0, self.maxwidth - len(self._edit))]
+        self._edit.insert(self.cursor, text)
+        self.cursor += len(text)
+
+
+    def pasteReceived(self, text):
+        """
+        Insert pasted text at the cursor as a single edit, requesting a single
+        repaint.  Line breaks are handled according to C{submitPastedLines},
+        and other control characters are discarded.
+        """
+        lines = text.replace('\r\n', '\r').replace('\n', '\r').split('\r')
+        if self.submitPastedLines:
+            for line in lines[:-1]:
+                self._insertPasted(line)
+                self.onSubmit(self.buffer)
+            self._insertPasted(lines[-1])
+        else:
+            self._insertPasted(' '.join(lines))
+        self.previousKeystroke = None
+        self.repaint()
+
+
+    def _dispatch(self, keyID, modifier):
+        """
+        Invoke the action bound to a keystroke in C{keymap}, or to the
+        keystrokes typed so far in a multi-key sequence.  A keystroke which
+        is not bound is handled by the inherited behavior, unless it ends a
+        multi-key sequence, in which case it is discarded.
+        """
+        if self._search is not None and self._searchKeystroke(keyID, modifier):
+            return
+        chord = self._chord
+        if chord is None:
+            binding = self.keymap.lookup(keyID, modifier)
+        else:
+            binding = chord.lookup(keyID, modifier)
+        if isinstance(binding, Keymap):
+            self._chord = binding
+            return
+        self._chord = None
+        if binding is not None:
+            binding(self, modifier)
+        elif chord is None:
+            super(LineInputWidget, self).keystrokeReceived(keyID, modifier)
 
 
     def keystrokeReceived(self, keyID, modifier):
         """
-        Override the inherited behavior to track whether either the cursor
-        position or buffer contents change and automatically request a repaint
-        if either does.
+        Override the inherited behavior to dispatch keystrokes through
+        C{keymap}, and to track whether either the cursor position or buffer
+        contents change and automatically request a repaint if either does.
         """
-        buffer = self.buffer
+        version = self._edit.version
         cursor = self.cursor
-        super(LineInputWidget, self).keystrokeReceived(keyID, modifier)
+        self._merging = self._killed
+        self._killed = False
+        self._dispatch(keyID, modifier)
         self.previousKeystroke = (keyID, modifier)
-        if self.buffer != buffer or self.cursor != cursor:
+        if self._edit.version != version or self.cursor != cursor:
             self.repaint()
 
 
     def characterReceived(self, keyID, modifier):
         """
-        Handle a single non-function key, possibly with a modifier.
+        Handle a single non-function key which is not bound in C{keymap}.
+
+        Submit the line for a carriage return and otherwise insert the
+        character at the cursor.  Control characters and characters with a
+        modifier are ignored.
+        """
+        if keyID == '\r' and modifier is None:
+            self.onSubmit(self.buffer)
+        elif modifier is not None or ord(keyID) <= 26:
+            pass
+        elif len(self._edit) < self.maxwidth:
+            self._edit.insert(self.cursor, keyID)
+            self.cursor += 1
+
+
+    def filthy(self):
+        self._rendered = None
+        super(LineInputWidget, self).filthy()
+
+
+    def _renderColumns(self, line, start, stop, terminal, column=None):
+        """
+        Write the columns of the input line from C{start} up to C{stop}.
 
-        If there is no modifier, let the super class handle this.  Otherwise,
-        dispatch to a function for the specific key and modifier present.
+        @param column: The column the cursor is displayed in, if not the
+            column of the cursor in the buffer.
         """
-        if modifier is not None:
-            f = getattr(self, 'func_' + modifier.name + '_' + keyID, None)
-            if f is not None:
-                f()
-        elif ord(keyID) <= 26 and keyID != '\r':
-            f = getattr(self, 'func_CTRL_' + chr(ord(keyID) + ord('a') - 1), None)
-            if f is not None:
-                f()
+        if column is None:
+            column = self.cursor
+        terminal.cursorPosition(start, 0)
+        if self.focused and start <= column < stop:
+            terminal.write(line[start:column])
+            cursor(terminal, line[column])
+            terminal.write(line[column + 1:stop])
         else:
-            super(LineInputWidget, self).characterReceived(keyID, modifier)
+            terminal.write(line[start:stop])
+
+
+    def render(self, width, height, terminal):
+        """
+        Display the input line, writing only the columns which may differ
+        from what was displayed last time: those from the first character
+        changed in the L{EditBuffer} to the end of the longer of the old and
+        new text, and the cells the cursor has left and moved to.
+
+        During an incremental search, the search string is displayed before
+        the buffer.
+        """
+        if self._search is not None:
+            self._renderSearch(terminal)
+            return
+        text = self._renderText()
+        if self.focused:
+            line = text + ' ' * (self.maxwidth - len(text) + 1)
+        else:
+            line = text + '_' * (self.maxwidth - len(text))
+        changedFrom = self._edit.changedFrom
+        self._edit.resetChanges()
+        rendered = (width, self.focused, self.cursor, len(text))
+        if self._rendered is None or self._rendered[:2] != rendered[:2]:
+            self._renderColumns(line, 0, len(line), terminal)
+        else:
+            previous, length = self._rendered[2:]
+            if changedFrom is not None:
+                start = min(changedFrom, previous, self.cursor)
+                # The column just past the end of the text may hold the
+                # cursor, so it is written too.
+                stop = min(len(line), max(length, len(text)) + 1)
+                self._renderColumns(line, start, stop, terminal)
+            elif previous != self.cursor:
+                self._renderColumns(line, previous, previous + 1, terminal)
+                self._renderColumns(line, self.cursor, self.cursor + 1, terminal)
+        self._rendered = rendered
+
+
+    def _renderSearch(self, terminal):
+        query, position, found = self._search[-1][:3]
+        prompt = 'i-search'
+        if self._searchBackward:
+            prompt = 'reverse-' + prompt
+        if not found:
+            prompt = 'failing ' + prompt
+        prompt = "(%s)`%s': " % (prompt, query)
+        line = prompt + self._renderText()
+        line = line[:self.maxwidth + 1]
+        line += ' ' * (self.maxwidth + 1 - len(line))
+        column = min(len(prompt) + self.cursor, self.maxwidth)
+        self._renderColumns(line, 0, len(line), terminal, column)
+        self._edit.resetChanges()
+        # The prompt has shifted the text, so the next render must write all
+        # of it.
+        self._rendered = None
 
 
 
 class StatusWidget(Widget):
     """
     Display status information such as channel activity and modes.
+
+    @ivar _rendered: The status line most recently written to the terminal,
+    or C{None} if what the terminal displays is not known.
     """
+    _rendered = None
+
     def __init__(self, statusModel):
         super(StatusWidget, self).__init__()
         self.model = statusModel
@@ -268,46 +736,237 @@ class StatusWidget(Widget):
         raise YieldFocus()
 
 
+    def filthy(self):
+        self._rendered = None
+        super(StatusWidget, self).filthy()
+
+
     def render(self, width, height, terminal):
         """
         Display invective version information and information about the state
-        of the model we were constructed with.
+        of the model we were constructed with.  Nothing is written if this is
+        the same as what was displayed last time.
         """
         info = {'version': version}
         chan = self.model.focusedChannel()
         if chan is None:
             chan = '(No Channel)'
         info['focusedChannel'] = chan
+        servers = self.model.serverStatus()
 
-        terminal.cursorPosition(0, 0)
         status = '[%(version)s] %(focusedChannel)s' % info
-        terminal.write(status + ' ' * (width - len(status)))
+        if servers:
+            status += ' [%s]' % (servers,)
+        status += ' ' * (width - len(status))
+        if status != self._rendered:
+            terminal.cursorPosition(0, 0)
+            terminal.write(status)
+            self._rendered = status
 
 
 
 class OutputWidget(TextOutput):
-    def __init__(self, size=None):
+    """
+    Display a list of messages, wrapped to the available width, with the most
+    recently added message at the bottom.
+
+    @type messages: L{Scrollback}
+    @ivar messages: The messages which have been added to this widget and not
+    yet discarded, in order of oldest to newest.
+
+    @ivar received: The total number of messages which have ever been added to
+    this widget.  Unlike C{len(self.messages)}, this never decreases, so it
+    identifies how many messages have arrived since some earlier point.
+
+    @type scrolled: C{int}
+    @ivar scrolled: The number of the newest messages which are hidden below
+    the bottom of the display because the user has scrolled back through
+    older messages.
+
+    @ivar _frame: C{None} or a tuple of the width, height, value of
+    C{received}, and list of wrapped lines from the most recent call to
+    L{render} made while not scrolled back.  If only new messages have been
+    added since then, the next frame is computed by wrapping just those
+    messages and shifting the old lines up.
+
+    @ivar maxCachedMessages: The number of wrapped messages which will be
+    remembered before the wrap cache is discarded and started over.
+
+    @ivar _shift: C{None} or the number of lines by which the frame most
+    recently computed by L{visibleLines} moved the previous frame's lines
+    up, when it was computed from the previous frame.
+
+    @ivar _rows: C{None} or a tuple of the width and the list of lines, from
+    top to bottom, most recently written to the terminal.  Only rows which
+    differ from these are written by L{render}.  C{None} indicates that what
+    the terminal displays is not known.
+
+    @ivar _wrapCache: A C{dict} mapping messages to the result of
+    L{formatMessage} for them at the width given by C{_wrapWidth}.  Since the
+    wrapping of a message only changes when the width does, the whole cache is
+    dropped whenever a different width is requested.
+    """
+    scrolled = 0
+    _frame = None
+    _rows = None
+    _shift = None
+    _wrapWidth = None
+    maxCachedMessages = 1000
+
+    def __init__(self, size=None, scrollback=None):
         super(OutputWidget, self).__init__(size)
-        self.messages = []
+        if scrollback is None:
+            scrollback = Scrollback()
+        self.messages = scrollback
+        self.received = 0
+        self._wrapCache = {}
 
 
     def formatMessage(self, s, width):
         return wrap(s, width=width, subsequent_indent="  ")
 
 
-    def addMessage(self, message):
-        self.messages.append(message)
+    def wrappedMessage(self, message, width):
+        """
+        Return the lines of C{message} wrapped to C{width}, formatting it only
+        if it has not already been formatted at that width.
+
+        @param message: A C{str}, or a record such as an L{invective.message.Message} which
+            C{str} turns into the text to display.
+        """
+        if width != self._wrapWidth or len(self._wrapCache) >= self.maxCachedMessages:
+            self._wrapCache = {}
+            self._wrapWidth = width
+        try:
+            return self._wrapCache[message]
+        except KeyError:
+            lines = self._wrapCache[message] = self.formatMessage(
+                str(message), width)
+            return lines
+
+
+    def setScrollback(self, scrollback):
+        """
+        Display the messages in a different scrollback, from the newest.
+        """
+        self.messages = scrollback
+        self.scrolled = 0
+        self._frame = None
         self.repaint()
 
 
-    def render(self, width, height, terminal):
-        output = []
-        for i in xrange(len(self.messages) - 1, -1, -1):
-            output[:0] = self.formatMessage(self.messages[i], width - 2)
-            if len(output) >= height:
+    def addMessage(self, message):
+        self.addMessages([message])
+
+
+    def addMessages(self, messages):
+        """
+        Add several messages at once, with a single request to be repainted.
+        """
+        if not messages:
+            return
+        self.messages.extend(messages)
+        self.received += len(messages)
+        if self.scrolled:
+            # Keep the same messages on the display while scrolled back.
+            self.scrolled = min(self.scrolled + len(messages), len(self.messages) - 1)
+        else:
+            self.repaint()
+
+
+    def scroll(self, n):
+        """
+        Move the display C{n} messages back towards older messages, or forward
+        towards newer messages if C{n} is negative.  The display cannot be
+        moved past the oldest or newest message.
+        """
+        scrolled = max(0, min(self.scrolled + n, len(self.messages) - 1))
+        if scrolled != self.scrolled:
+            self.scrolled = scrolled
+            self.repaint()
+
+
+    def _wrapBackward(self, start, stop, width, height):
+        """
+        Wrap messages, newest first, until at least C{height} lines have been
+        produced or the messages run out.
+
+        @param start: The index in C{self.messages} of the oldest message to
+            consider.
+
+        @param stop: The index in C{self.messages} just after the newest
+            message to consider.
+
+        @return: A C{list} of the wrapped lines in order of newest to oldest.
+        """
+        lines = []
+        messages = self.messages
+        for i in xrange(stop - 1, start - 1, -1):
+            lines.extend(reversed(self.wrappedMessage(messages[i], width)))
+            if len(lines) >= height:
                 break
-        if len(output) < height:
-            output[:0] = [''] * (height - len(output))
-        for n, L in enumerate(output):
-            terminal.cursorPosition(0, n)
-            terminal.write(L + ' ' * (width - len(L)))
+        return lines
+
+
+    def visibleLines(self, width, height):
+        """
+        Compute the lines which fill a display area of the given size.
+
+        @return: A C{list} of at most C{height} strings, in order from top to
+            bottom.  If there are not enough messages to fill the area, the
+            list is shorter than C{height}.
+        """
+        count = len(self.messages)
+        self._shift = None
+        if self.scrolled:
+            self._frame = None
+            lines = self._wrapBackward(0, count - self.scrolled, width - 2, height)
+            del lines[height:]
+            lines.reverse()
+            return lines
+
+        frame = self._frame
+        added = self.received - frame[2] if frame is not None else None
+        if frame is not None and frame[:2] == (width, height) and added <= count:
+            # Only new messages have arrived since the last frame.  Wrap just
+            # those and keep as many of the previous lines as still fit.
+            lines = self._wrapBackward(count - added, count, width - 2, height)
+            self._shift = len(lines)
+            if len(lines) < height:
+                keep = height - len(lines)
+                lines.reverse()
+                lines[:0] = frame[3][-keep:]
+            else:
+                del lines[height:]
+                lines.reverse()
+        else:
+            lines = self._wrapBackward(0, count, width - 2, height)
+            del lines[height:]
+            lines.reverse()
+        self._frame = (width, height, self.received, lines)
+        return lines
+
+
+    def filthy(self):
+        self._rows = None
+        super(OutputWidget, self).filthy()
+
+
+    def render(self, width, height, terminal):
+        output = self.visibleLines(width, height)
+        rows = [''] * (height - len(output))
+        rows.extend(output)
+        previous = self._rows
+        if previous is None or previous[0] != width or len(previous[1]) != height:
+            previous = [None] * height
+        else:
+            previous = previous[1]
+            shift = self._shift
+            if shift and shift < height and scrollRegion(terminal, height, shift):
+                # The terminal moved the old rows up for us.
+                previous = previous[shift:] + [''] * shift
+        for n, L in enumerate(rows):
+            if L != previous[n]:
+                terminal.cursorPosition(0, n)
+                terminal.write(L + ' ' * (width - len(L)))
+        self._rows = (width, rows)